@@ -1 +1,9 @@
-from .app import app
+def __getattr__(name):
+    # The Flask app is imported lazily so render-pool processes can import
+    # api.qr / api.imaging without booting the app and its database.
+    if name == "app":
+        from .app import app
+
+        globals()["app"] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
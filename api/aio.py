@@ -0,0 +1,174 @@
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+LAG_INTERVAL = 0.5
+
+
+async def _in_context(coro, context):
+    return await context.run(asyncio.ensure_future, coro)
+
+
+class BackgroundLoop:
+    """One long-lived asyncio loop per worker process, running in a daemon
+    thread. Sync request handlers hand it coroutines and wait for the result,
+    so loop-scoped resources (aiohttp sessions, connectors) live across requests."""
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._shutdown_callbacks = []
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def _run(self, loop, ready):
+        asyncio.set_event_loop(loop)
+        loop.create_task(self._measure_lag())
+        ready.set()
+        loop.run_forever()
+
+    async def _measure_lag(self):
+        # How late the loop wakes up is how long something blocked it.
+        while True:
+            expected = time.monotonic() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lag = max(0.0, time.monotonic() - expected)
+            self.max_lag = max(self.max_lag, self.lag)
+            metrics.observe("event_loop_lag_seconds", self.lag)
+            metrics.set_gauge("event_loop_lag_seconds_last", self.lag)
+
+    def start(self):
+        if (
+            self.loop is not None
+            and self._pid == os.getpid()
+            and self._thread.is_alive()
+        ):
+            return self.loop
+        with self._lock:
+            if (
+                self.loop is None
+                or self._pid != os.getpid()
+                or not self._thread.is_alive()
+            ):
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run,
+                    args=(loop, ready),
+                    name="asyncio-loop",
+                    daemon=True,
+                )
+                self._thread.start()
+                ready.wait()
+                self.loop, self._pid = loop, os.getpid()
+        return self.loop
+
+    def on_shutdown(self, coro_fn):
+        """Register an async cleanup to run on the loop before it stops."""
+        self._shutdown_callbacks.append(coro_fn)
+
+    def submit(self, coro):
+        # Tasks normally inherit the loop thread's context; carry the caller's
+        # instead so context-local state (e.g. Flask's request) follows the coroutine.
+        return asyncio.run_coroutine_threadsafe(
+            _in_context(coro, contextvars.copy_context()), self.start()
+        )
+
+    def run(self, coro, timeout=None):
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def _cleanup(self):
+        for callback in self._shutdown_callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                logger.warning(f"Event loop shutdown hook failed: {e}")
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def shutdown(self, timeout=5):
+        with self._lock:
+            loop, thread = self.loop, self._thread
+            if loop is None or self._pid != os.getpid() or not thread.is_alive():
+                return
+            self.loop = None
+        try:
+            asyncio.run_coroutine_threadsafe(self._cleanup(), loop).result(timeout)
+        except Exception as e:
+            logger.warning(f"Event loop did not shut down cleanly: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+
+    def stats(self):
+        hist = metrics.snapshot()["histograms"].get(("event_loop_lag_seconds", ()))
+        running = self.loop is not None and self._pid == os.getpid()
+        return {
+            "running": running,
+            "tasks": len(asyncio.all_tasks(self.loop)) if running else 0,
+            "lag_ms": round(self.lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "lag_p99": metrics.quantile(hist, 0.99),
+        }
+
+
+background_loop = BackgroundLoop()
+atexit.register(background_loop.shutdown)
+
+
+def run(coro, timeout=None):
+    return background_loop.run(coro, timeout)
+
+
+class SyncIterator:
+    """Drive an async iterator from sync code (e.g. a streamed WSGI body).
+
+    close(), which the server calls when it is done with the body, closes the
+    async iterator directly. A generator-based wrapper would skip that if the
+    server closed it before the first pull, since a generator that never
+    started never runs its finally block."""
+
+    def __init__(self, agen, timeout=None):
+        self._agen = agen
+        self._timeout = timeout
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        try:
+            return background_loop.run(self._agen.__anext__(), self._timeout)
+        except StopAsyncIteration:
+            self.close()
+            raise StopIteration from None
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            background_loop.run(self._agen.aclose(), self._timeout)
+
+
+def iterate(agen, timeout=None):
+    return SyncIterator(agen, timeout)
@@ -1,9 +1,46 @@
-from flask import Flask, Response, jsonify, request, render_template, abort, redirect, send_file
-import psutil
-import platform
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    request,
+    render_template,
+    abort,
+    redirect,
+    send_file,
+    g,
+    has_app_context,
+    url_for,
+)
 import time
 from .errors import errors
+from . import (
+    db,
+    auth,
+    upstream,
+    qr,
+    imaging,
+    discord_rest,
+    aio,
+    prompt_cache,
+    webhooks,
+    news,
+    wikis,
+    sysmon,
+    status_stream,
+    metrics,
+)
+from .cache import LRUCache
+from .ratelimit import limiter, headers_for
+from .rates import rate_table, UnsupportedCurrency
+from .render_pool import render_pool, RenderBusy, RenderTimeout
+from .webhook_schema import validate_message, SchemaError
+from functools import wraps
 import os
+import asyncio
+import concurrent.futures
+import inspect
+import json
+import contextlib
 import requests
 from datetime import datetime, timezone
 from dateutil import tz
@@ -11,91 +48,43 @@ import random
 import base64
 import uuid
 import hashlib
-import io
-from PIL import Image, ImageDraw, ImageFont
 from flask_cors import CORS
 import logging
 import string
 from zoneinfo import ZoneInfo
 import uuid
-import psycopg2
-import urllib.parse as up
 import math
 import pyfiglet
-import asyncio
 import calendar
 from dateutil import parser
 import pytz
-import markdown
-import discord
-import aiohttp
-import mimetypes
 import user_agents
 from psycopg2.extras import RealDictCursor
 
 start_time = time.time()
-TEXT_FILE_EXTENSIONS = ['.txt', '.js', '.bat', '.md', '.csv', '.log', '.json', '.yaml', '.yml', '.xml', '.html']
-
-def run_async(coro):
-    return asyncio.run(coro)
-
-async def fetch_message_attachments(bot_token, channel_id, message_id):
-    intents = discord.Intents.default()
-    bot = discord.Client(intents=intents)
-
-    result = {}
-
-    @bot.event
-    async def on_ready():
-        try:
-            print(f"Logged in as {bot.user}")
-            channel = bot.get_channel(channel_id)
-            if channel is None:
-                print("Channel not in cache, fetching from API...")
-                channel = await bot.fetch_channel(channel_id)
-
-            message = await channel.fetch_message(message_id)
-            print(f"Fetched message with ID {message.id}")
-
-            attachments_info = []
-
-            for attachment in message.attachments:
-                print(f"Found attachment: {attachment.filename}")
-                info = {
-                    "filename": attachment.filename,
-                    "url": attachment.url
-                }
-
-                # Guess file type from mimetypes
-                file_type, _ = mimetypes.guess_type(attachment.filename)
-                info["fileType"] = file_type if file_type else "unknown"
-
-                # Check file extension manually to determine if we should fetch text content
-                if any(attachment.filename.lower().endswith(ext) for ext in TEXT_FILE_EXTENSIONS):
-                    try:
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(attachment.url) as resp:
-                                if resp.status == 200:
-                                    text = await resp.text()
-                                    info["content"] = text
-                                else:
-                                    info["content"] = f"Failed to fetch content: HTTP {resp.status}"
-                    except Exception as e:
-                        info["content"] = f"Error: {str(e)}"
-
-                attachments_info.append(info)
+# Async views wait on upstreams, so give them at least the slowest upstream's
+# whole retry budget (pollinations: two 120 s reads).
+ASYNC_TIMEOUT = max(60, math.ceil(upstream.max_budget()))
+
+
+class App(Flask):
+    def async_to_sync(self, func):
+        # Under WSGI, async views run on the worker's shared background loop
+        # (see api/aio.py) rather than a throwaway loop per request. Under ASGI
+        # (see api/asgi.py) they are awaited directly and never get here.
+        @wraps(func)
+        def run(*args, **kwargs):
+            try:
+                rv = aio.run(func(*args, **kwargs), timeout=ASYNC_TIMEOUT)
+            except concurrent.futures.TimeoutError:
+                return jsonify({"error": "Upstream timed out", "success": False}), 504
+            if isinstance(rv, Response) and hasattr(rv.response, "__aiter__"):
+                # Streamed body: pull it through the loop one chunk at a time.
+                rv.response = aio.iterate(rv.response, timeout=ASYNC_TIMEOUT)
+            return rv
 
-            result["attachments"] = attachments_info
-            result["success"] = True
+        return run
 
-        except Exception as e:
-            result["error"] = str(e)
-            result["success"] = False
-        finally:
-            await bot.close()
-
-    await bot.start(bot_token)
-    return result
 
 def is_admin():
     key = request.headers.get("X-API-KEY")
@@ -108,11 +97,33 @@ def format_duration(seconds):
     minutes, seconds = divmod(remainder, 60)
     return f"{hours:02}:{minutes:02}:{seconds:02}"
 
-app = Flask(__name__, static_folder="templates/static")
+
+app = App(__name__, static_folder="templates/static")
 app.register_blueprint(errors)
 CORS(app)
 
 
+@app.before_request
+def start_request_timer():
+    request._get_current_object().environ["api.request_started"] = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Error responses are finalized through here too, and so are async views
+    # under ASGI. Streamed bodies are timed up to their headers.
+    req = request._get_current_object()
+    started = req.environ.get("api.request_started")
+    if started is not None:
+        rule = req.url_rule
+        metrics.observe_request(
+            rule.rule if rule else "<unmatched>",
+            req.method,
+            response.status_code,
+            time.perf_counter() - started,
+        )
+    return response
+
 
 def restart_heroku_dyno():
     app_name = os.environ.get("HEROKU_APP_NAME")
@@ -135,7 +146,13 @@ class IgnoreSysinfoFilter(logging.Filter):
         try:
             from flask import request
             path = request.path
-            return path not in ["/sysinfo", "/health"]
+            return path not in [
+                "/sysinfo",
+                "/sysinfo/history",
+                "/status/stream",
+                "/health",
+                "/metrics",
+            ]
         except RuntimeError:
             return True
 
@@ -145,86 +162,150 @@ for handler in app.logger.handlers:
 DATABASE = 'api_keys.db'
 
 def get_db():
-    db_url = os.environ.get("DATABASE_URL")
-    if not db_url:
-        raise Exception("DATABASE_URL not set")
-
-    up.uses_netloc.append("postgres")
-    url = up.urlparse(db_url)
-
-    conn = psycopg2.connect(
-        database=url.path[1:],
-        user=url.username,
-        password=url.password,
-        host=url.hostname,
-        port=url.port
-    )
+    # Borrowed from the per-worker pool; conn.close() hands it back.
+    conn = db.get_pool().getconn()
+    if has_app_context():
+        g.setdefault("db_conns", []).append(conn)
     return conn
 
+
+@app.teardown_appcontext
+def release_db(exc):
+    # Return anything a handler forgot to close (e.g. when it raised midway).
+    for conn in g.pop("db_conns", []):
+        conn.close()
+
+
 def init_db():
     conn = get_db()
     c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS api_keys (
-            user_id TEXT PRIMARY KEY,
-            api_key TEXT NOT NULL
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS site_news (
-            id SERIAL PRIMARY KEY,
-            content TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS wikis (
-            id SERIAL PRIMARY KEY,
-            title TEXT NOT NULL,
-            description TEXT NOT NULL,
-            content TEXT NOT NULL,
-            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
-        )
-    ''')
+    c.execute(auth.SCHEMA)
+    c.execute(news.SCHEMA)
+    c.execute(wikis.SCHEMA)
+    c.execute(webhooks.SCHEMA)
     conn.commit()
     conn.close()
 with app.app_context():
     init_db()
-    
+
 def checkapikey(key):
+    cached = auth.cached_key_status(key)
+    if cached is not None:
+        return cached
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT 1 FROM api_keys WHERE api_key = %s", (key,))
+    c.execute("SELECT 1 FROM api_keys WHERE key_hash = %s", (auth.hash_key(key),))
     result = c.fetchone()
     conn.close()
+    auth.remember_key(key, result is not None)
     return result is not None
 
+
+def api_key_from_request():
+    apikey = request.args.get("key")
+    if not apikey and request.is_json:
+        apikey = (request.get_json(silent=True) or {}).get("api_key")
+    return apikey
+
+
+def charge_api_key(apikey, valid, route_class, cost=1):
+    """Return (error response or None, rate-limit result) for a looked-up key."""
+    if not apikey:
+        return (
+            jsonify(
+                {
+                    "error": "Missing api key! Get it from our server at "
+                    "api.loopy5418.dev/support. Pass it as ?key=apikeyhere "
+                    "or as 'api_key' in the JSON body.",
+                    "success": False,
+                }
+            ),
+            400,
+        ), None
+    if not valid:
+        return (jsonify({"error": "Invalid API key", "success": False}), 403), None
+
+    # Rate-limit state lives on disk, so it is keyed by digest as well.
+    limit = limiter.hit(auth.hash_key(apikey).hex(), route_class, cost)
+    if not limit["allowed"]:
+        return (
+            jsonify(
+                {
+                    "error": "Rate limit exceeded. Try again later.",
+                    "retry_after": limit["retry_after"],
+                    "success": False,
+                }
+            ),
+            429,
+            headers_for(limit),
+        ), limit
+
+    g.api_key = apikey
+    return None, limit
+
+
+async def charge_request(route_class, cost=1):
+    """charge_api_key for the request's key, from an async view."""
+    apikey = api_key_from_request()
+    valid = auth.cached_key_status(apikey) if apikey else False
+    if valid is None:
+        # Cache miss: keep the database round-trip off the event loop.
+        valid = await asyncio.to_thread(checkapikey, apikey)
+    # Charging takes a SQLite write lock: keep that off the loop too.
+    return await asyncio.to_thread(charge_api_key, apikey, valid, route_class, cost)
+
+
+def require_api_key(route_class, cost=None):
+    """Authenticate the caller's key (?key= or 'api_key' in the JSON body),
+    then charge it against the route class's token bucket and daily quota.
+    `cost`, if given, is called in the request to get the number of tokens
+    to charge (e.g. one per item of a batch); the default is one.
+    Works for both sync and async views."""
+
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                error, limit = await charge_request(route_class, cost() if cost else 1)
+                if error:
+                    return error
+                response = app.make_response(await view(*args, **kwargs))
+                response.headers.extend(headers_for(limit))
+                return response
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            apikey = api_key_from_request()
+            valid = apikey and checkapikey(apikey)
+            error, limit = charge_api_key(
+                apikey, valid, route_class, cost() if cost else 1
+            )
+            if error:
+                return error
+            response = app.make_response(view(*args, **kwargs))
+            response.headers.extend(headers_for(limit))
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 @app.route('/admin/update-news', methods=['GET', 'POST'])
 def manage_news():
     if request.method == 'GET':
-        conn = get_db()
-        c = conn.cursor()
-        c.execute("SELECT content FROM site_news WHERE id = 1")
-        row = c.fetchone()
-        conn.close()
-        return jsonify({"content": row[0] if row else ""})
+        return jsonify({"content": news.current().content or ""})
 
-    # POST (create/update or delete if empty)
+    # POST (create/update or clear if empty)
     is_admin()  # Validate using admin API key
     data = request.get_json()
     content = data.get('content', '').strip()
+    version = news.save(content)
+    return jsonify({"success": True, "version": version})
 
-    conn = get_db()
-    c = conn.cursor()
-
-    if content:
-        c.execute("INSERT INTO site_news (id, content) VALUES (1, %s) ON CONFLICT (id) DO UPDATE SET content = EXCLUDED.content", (content,))
-    else:
-        c.execute("DELETE FROM site_news WHERE id = 1")
-
-    conn.commit()
-    conn.close()
-    return jsonify({"success": True})
-    
 @app.context_processor
 def inject_now():
     return { 'current_year': datetime.now().year }
@@ -236,19 +317,35 @@ def get_user_id_from_key():
         abort(403)
 
     api_key = request.args.get("api_key")
-    if not api_key:
-        return jsonify({"error": "Missing api_key", "success": False}), 400
+    prefix = request.args.get("key_prefix")
+    if not api_key and not prefix:
+        return (
+            jsonify({"error": "Missing api_key (or key_prefix)", "success": False}),
+            400,
+        )
 
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT user_id FROM api_keys WHERE api_key = %s", (api_key,))
-    result = c.fetchone()
-    conn.close()
-
-    if not result:
-        return jsonify({"error": "API key not found", "success": False}), 404
+    if api_key:
+        c.execute(
+            "SELECT user_id FROM api_keys WHERE key_hash = %s",
+            (auth.hash_key(api_key),),
+        )
+        result = c.fetchone()
+        conn.close()
+        if not result:
+            return jsonify({"error": "API key not found", "success": False}), 404
+        return jsonify({"api_key": api_key, "user_id": result[0], "success": True})
 
-    return jsonify({"api_key": api_key, "user_id": result[0], "success": True})
+    # Only the first few characters of a key are kept in the clear.
+    c.execute(
+        "SELECT user_id FROM api_keys WHERE key_prefix = %s ORDER BY user_id", (prefix,)
+    )
+    user_ids = [row[0] for row in c.fetchall()]
+    conn.close()
+    if not user_ids:
+        return jsonify({"error": "No API key with that prefix", "success": False}), 404
+    return jsonify({"key_prefix": prefix, "user_ids": user_ids, "success": True})
 
 @app.route("/admin/generate-key", methods=["POST"])
 def generate_key():
@@ -262,22 +359,41 @@ def generate_key():
     if not user_id:
         return jsonify({"error": "Missing user_id", "success": False}), 400
 
+    api_key = str(uuid.uuid4())
+    key_hash = auth.hash_key(api_key)
     conn = get_db()
     c = conn.cursor()
-
-    c.execute("SELECT api_key FROM api_keys WHERE user_id = %s", (user_id,))
-    existing = c.fetchone()
-
-    if existing:
-        conn.close()
-        return jsonify({"user_id": user_id, "api_key": existing[0], "success": False, "error": "API Key for this user already exists"})
-
-    api_key = str(uuid.uuid4())
-    c.execute("INSERT INTO api_keys (user_id, api_key) VALUES (%s, %s)", (user_id, api_key))
+    # One round-trip: insert, or hand back the existing row untouched. The
+    # no-op update makes RETURNING see that row; xmax = 0 only for a fresh insert.
+    c.execute(
+        """
+        INSERT INTO api_keys (user_id, key_hash, key_prefix) VALUES (%s, %s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET user_id = EXCLUDED.user_id
+        RETURNING key_prefix, xmax = 0
+    """,
+        (user_id, key_hash, auth.key_prefix(api_key)),
+    )
+    prefix, created = c.fetchone()
+    if created:
+        auth.notify_key_changed(c, key_hash)
     conn.commit()
     conn.close()
 
-    return jsonify({"user_id": user_id, "api_key": api_key, "success": True})
+    if not created:
+        # Only the digest is stored, so the existing key can't be shown again.
+        return jsonify(
+            {
+                "user_id": user_id,
+                "key_prefix": prefix,
+                "success": False,
+                "error": "API Key for this user already exists",
+            }
+        )
+
+    auth.invalidate_key(key_hash)
+    return jsonify(
+        {"user_id": user_id, "api_key": api_key, "key_prefix": prefix, "success": True}
+    )
 
 @app.route("/admin/get-key", methods=["GET"])
 def get_key():
@@ -291,14 +407,14 @@ def get_key():
 
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT api_key FROM api_keys WHERE user_id = %s", (user_id,))
+    c.execute("SELECT key_prefix FROM api_keys WHERE user_id = %s", (user_id,))
     result = c.fetchone()
     conn.close()
 
     if not result:
         return jsonify({"error": "No API key found", "success": False}), 404
 
-    return jsonify({"user_id": user_id, "api_key": result[0], "success": True})
+    return jsonify({"user_id": user_id, "key_prefix": result[0], "success": True})
 
 @app.route("/admin/delete-key", methods=["DELETE"])
 def delete_key():
@@ -312,34 +428,190 @@ def delete_key():
 
     conn = get_db()
     c = conn.cursor()
-    c.execute("DELETE FROM api_keys WHERE user_id = %s", (user_id,))
+    c.execute("DELETE FROM api_keys WHERE user_id = %s RETURNING key_hash", (user_id,))
+    removed = [row[0] for row in c.fetchall()]
+    for key_hash in removed:
+        auth.notify_key_changed(c, key_hash)
     conn.commit()
     conn.close()
+    for key_hash in removed:
+        auth.invalidate_key(key_hash)
 
     return jsonify({"message": f"API key for user {user_id} deleted", "success": True})
 
+
+def bulk_user_ids():
+    """The de-duplicated user_ids list from a bulk admin request body, or an
+    error response."""
+    user_ids = (request.get_json(silent=True) or {}).get("user_ids")
+    if not isinstance(user_ids, list) or not user_ids:
+        return None, (
+            jsonify(
+                {"error": "'user_ids' must be a non-empty list.", "success": False}
+            ),
+            400,
+        )
+    if len(user_ids) > auth.KEY_BULK_MAX:
+        return None, (
+            jsonify(
+                {
+                    "error": f"At most {auth.KEY_BULK_MAX} user_ids per call.",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+    if not all(
+        isinstance(u, (str, int)) and not isinstance(u, bool) and str(u)
+        for u in user_ids
+    ):
+        return None, (
+            jsonify(
+                {
+                    "error": "Each user id must be a non-empty string or an integer.",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+    return list(dict.fromkeys(str(u) for u in user_ids)), None
+
+
+@app.route("/admin/bulk/generate-key", methods=["POST"])
+def bulk_generate_keys():
+    is_admin()
+    user_ids, error = bulk_user_ids()
+    if error:
+        return error
+    keys = auth.provision_keys(user_ids)
+    results = []
+    for user_id in user_ids:
+        api_key, prefix = keys[user_id]
+        if api_key:
+            results.append(
+                {
+                    "user_id": user_id,
+                    "api_key": api_key,
+                    "key_prefix": prefix,
+                    "success": True,
+                }
+            )
+        else:
+            results.append(
+                {
+                    "user_id": user_id,
+                    "key_prefix": prefix,
+                    "success": False,
+                    "error": "API Key for this user already exists",
+                }
+            )
+    return jsonify(
+        {
+            "results": results,
+            "created": sum(r["success"] for r in results),
+            "success": True,
+        }
+    )
+
+
+@app.route("/admin/bulk/get-key", methods=["POST"])
+def bulk_get_keys():
+    is_admin()
+    user_ids, error = bulk_user_ids()
+    if error:
+        return error
+    prefixes = auth.lookup_keys(user_ids)
+    results = [
+        (
+            {"user_id": user_id, "key_prefix": prefixes[user_id], "success": True}
+            if user_id in prefixes
+            else {"user_id": user_id, "success": False, "error": "No API key found"}
+        )
+        for user_id in user_ids
+    ]
+    return jsonify({"results": results, "found": len(prefixes), "success": True})
+
+
+@app.route("/admin/bulk/delete-key", methods=["POST"])
+def bulk_delete_keys():
+    is_admin()
+    user_ids, error = bulk_user_ids()
+    if error:
+        return error
+    revoked = auth.revoke_keys(user_ids)
+    results = [
+        (
+            {"user_id": user_id, "success": True}
+            if user_id in revoked
+            else {"user_id": user_id, "success": False, "error": "No API key found"}
+        )
+        for user_id in user_ids
+    ]
+    return jsonify({"results": results, "deleted": len(revoked), "success": True})
+
+
+@app.route("/admin/bulk/key-holders")
+def bulk_key_holders():
+    """Every user id with a key, a page at a time (?after=<last user_id>), so
+    the bot can reconcile a whole guild in a few calls."""
+    is_admin()
+    try:
+        limit = wikis.parse_limit(
+            request.args.get("limit"), auth.KEY_BULK_MAX, auth.KEY_BULK_MAX
+        )
+    except wikis.BadRequest as e:
+        return jsonify({"error": str(e), "success": False}), 400
+    user_ids = auth.key_holders(request.args.get("after"), limit)
+    return jsonify(
+        {
+            "user_ids": user_ids,
+            "next": user_ids[-1] if len(user_ids) == limit else None,
+            "success": True,
+        }
+    )
+
+
 @app.route("/admin/keys")
 def keyeditor():
     return render_template("keymaker.html")
 
+
+# Rendered landing pages, keyed on everything the template depends on.
+index_pages = LRUCache(max_items=8)
+INDEX_TEMPLATE_MTIME = datetime.fromtimestamp(
+    os.path.getmtime(os.path.join(app.root_path, app.template_folder, "index.html")),
+    timezone.utc,
+)
+
 @app.route("/")
 def index():
     user_agent = request.headers.get('User-Agent', '').lower()
     discord_invite = os.environ.get("DISCORD_INVITE", "#")
     if "mozilla" in user_agent or "chrome" in user_agent or "safari" in user_agent:
-        conn = get_db()
-        c = conn.cursor()
-        c.execute("SELECT content FROM site_news WHERE id = 1")
-        news_row = c.fetchone()
-        conn.close()
-
-        raw_news = news_row[0] if news_row else None
-        news_html = markdown.markdown(raw_news) if raw_news else None
-        return render_template("index.html", discord_invite=discord_invite, news=news_html)
+        current = news.current()
+        key = (current.version, discord_invite, datetime.now().year)
+        page = index_pages.get(key)
+        if page is None:
+            body = render_template(
+                "index.html", discord_invite=discord_invite, news=current.html
+            ).encode()
+            last_modified = max(
+                current.updated_at or INDEX_TEMPLATE_MTIME, INDEX_TEMPLATE_MTIME
+            )
+            page = (body, hashlib.sha1(body).hexdigest(), last_modified)
+            index_pages.set(key, page)
+        body, etag, last_modified = page
+
+        response = Response(body, mimetype="text/html")
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Revalidate every time so news shows up at once; unchanged pages cost a 304.
+        response.cache_control.no_cache = True
+        response.vary.add("User-Agent")
+        return response.make_conditional(request)
     else:
         return jsonify({"status": True, "discord": f"{discord_invite}"})
 
-
 @app.route("/health")
 def health():
     return Response("OK", status=200, mimetype="text/plain")
@@ -350,27 +622,124 @@ def error():
 
 @app.route("/sysinfo")
 def system_info():
-    boot_time = psutil.boot_time()
-    uptime = time.time() - boot_time
-    cpu_percent = psutil.cpu_percent(interval=0.5)
-    ram = psutil.virtual_memory()
-    disk = psutil.disk_usage('/')
+    # Served from the background sampler, so this never blocks on psutil.
+    sample = sysmon.sampler.latest()
+    return jsonify(
+        {
+            **{
+                k: v
+                for k, v in sample.items()
+                if k not in ("workers", "workers_rss_mb")
+            },
+            **sysmon.STATIC,
+            "load_average": [sample["load_1"], sample["load_5"], sample["load_15"]],
+            "workers": sample["workers"],
+            "sample_age_seconds": round(time.time() - sample["sampled_at"], 3),
+        }
+    )
+
+
+@app.route("/sysinfo/history")
+def system_info_history():
+    try:
+        window = int(request.args.get("window", 600))
+        points = int(request.args.get("points", 120))
+    except ValueError:
+        return (
+            jsonify(
+                {"error": "'window' and 'points' must be integers.", "success": False}
+            ),
+            400,
+        )
+    max_window = sysmon.sampler.interval * sysmon.sampler.samples.maxlen
+    if not 1 <= window <= max_window:
+        return (
+            jsonify(
+                {
+                    "error": f"'window' must be between 1 and {max_window} seconds.",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+    if not 1 <= points <= sysmon.SYSINFO_HISTORY_MAX_POINTS:
+        return (
+            jsonify(
+                {
+                    "error": "'points' must be between 1 and "
+                    f"{sysmon.SYSINFO_HISTORY_MAX_POINTS}.",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+    return jsonify(
+        {
+            "window_seconds": window,
+            "interval_seconds": sysmon.sampler.interval,
+            "series": sysmon.sampler.history(window, points),
+            "success": True,
+        }
+    )
+
+
+@app.route("/status/stream")
+async def status_stream_events():
+    """Live /sysinfo samples as Server-Sent Events, for the status page."""
+    stream = status_stream.broadcaster.open()
+    if stream is None:
+        # Every slot is taken: answer with one sample and let EventSource
+        # come back after the retry interval.
+        stream = status_stream.broadcaster.poll()
+    return Response(
+        stream,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Request and internal metrics for every worker, in Prometheus format.
+    Takes the admin key as X-API-KEY or as a bearer token, which is what
+    Prometheus' `authorization` scrape setting sends."""
+    bearer = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not bearer or bearer not in os.environ.get("ADMIN_API_KEYS", "").split(","):
+        is_admin()
+    return Response(
+        metrics.render_prometheus(metrics.store.collect()),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
+@app.route("/admin/stats")
+def admin_stats():
+    is_admin()
+    return jsonify(
+        {
+            "pid": os.getpid(),
+            "db_pool": db.pool_stats(),
+            "key_cache": auth.key_cache.stats(),
+            "rate_limits": limiter.stats(),
+            "upstreams": upstream.stats(),
+            "qr_cache": qr.stats(),
+            "render_pool": render_pool.stats(),
+            "event_loop": aio.background_loop.stats(),
+            "prompt_cache": prompt_cache.stats(),
+            "webhooks": webhooks.dispatcher.stats(),
+            "news": {**news.stats(), "index_pages": index_pages.stats()},
+            "wikis": wikis.stats(),
+            "sysinfo_sampler": sysmon.sampler.stats(),
+            "status_streams": status_stream.broadcaster.stats(),
+            "exchange_rates": {
+                "date": rate_table.date,
+                "age_seconds": rate_table.age,
+                "last_error": rate_table.last_error,
+            },
+            "success": True,
+        }
+    )
 
-    return jsonify({
-        "cpu_usage_percent": cpu_percent,
-        "cpu_cores": psutil.cpu_count(logical=False),
-        "cpu_threads": psutil.cpu_count(logical=True),
-        "ram_total_mb": round(ram.total / 1024**2),
-        "ram_used_percent": ram.percent,
-        "disk_total_gb": round(disk.total / 1024**3),
-        "disk_used_percent": disk.percent,
-        "uptime_seconds": int(uptime),
-        "platform": platform.system(),
-        "platform_release": platform.release(),
-        "python_version": platform.python_version(),
-        "ram_used_mb": round(ram.used / 1024**2),
-        "disk_used_gb": round(disk.used / 1024**3),
-    })
 
 @app.route("/seconds-to-time")
 def seconds_to_time():
@@ -496,167 +865,278 @@ def hash_generator():
 def uuid_generator():
     return jsonify({"uuid": str(uuid.uuid4()), "success": True})
 
+
+CURRENCY_BULK_MAX = 100
+
+
 @app.route("/currency-converter")
-def currency_converter():
-    from requests import get
+@require_api_key("cheap")
+async def currency_converter():
     base = request.args.get("base")
-    target = request.args.get("target")
-    amount = request.args.get("amount")
-    apikey = request.args.get("key")
-    if not apikey:
-        return jsonify({"error": "Missing api key! Get it from our server at api.loopy5418.dev/support. Example: ?key=apikeyhere", "success": False})
-    if not checkapikey(apikey):
-        return jsonify({"message": "Invalid API key", "success": False}), 403
+    target = request.args.get("target") or request.args.get("targets")
+    amount = request.args.get("amount") or request.args.get("amounts")
     if not base or not target or not amount:
         return jsonify({"error": "Parameters 'base', 'target', and 'amount' are required.", "success": False}), 400
+
+    # Comma-separated 'targets' / 'amounts' switch to bulk mode. The singular
+    # parameters take one value, so "amount=1,000" can't quietly convert 1.
+    bulk = "targets" in request.args or "amounts" in request.args
+    for name, plural in (("target", "targets"), ("amount", "amounts")):
+        if "," in request.args.get(name, ""):
+            return (
+                jsonify(
+                    {
+                        "error": f"'{name}' takes a single value; pass a "
+                        f"comma-separated list as '{plural}' instead.",
+                        "success": False,
+                    }
+                ),
+                400,
+            )
+    targets = [t.strip().upper() for t in target.split(",") if t.strip()]
     try:
-        amount = float(amount)
+        amounts = [float(a) for a in amount.split(",") if a.strip()]
     except ValueError:
         return jsonify({"error": "'amount' must be a valid number.", "success": False}), 400
+    if not targets or not amounts:
+        return (
+            jsonify(
+                {
+                    "error": "Parameters 'base', 'target', and 'amount' are required.",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+    if len(targets) * len(amounts) > CURRENCY_BULK_MAX:
+        return (
+            jsonify(
+                {
+                    "error": f"At most {CURRENCY_BULK_MAX} conversions per request.",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+
+    base = base.strip().upper()
     try:
-        # Using Frankfurter API (no API key required)
-        url = f"https://api.frankfurter.app/latest?amount={amount}&from={base.upper()}&to={target.upper()}"
-        resp = get(url)
-        if resp.status_code != 200:
-            return jsonify({"error": "Failed to fetch exchange rate.", "success": False}), 500
-        data = resp.json()
-        if target.upper() not in data.get("rates", {}):
-            return jsonify({"error": f"Currency conversion failed: {data.get('error', 'Unknown error')}", "success": False})
-        return jsonify({
-            "base": data["base"],
-            "target": target.upper(),
-            "amount": amount,
-            "converted": data["rates"][target.upper()],
-            "date": data["date"],
-            "success": True,
-            "note": "This information is from Frankfurter API. Full credits to them."
-        })
+        if rate_table.rates is None:
+            # Only the very first call waits on Frankfurter; keep that off the loop.
+            table = await asyncio.to_thread(rate_table.ensure_fresh)
+        else:
+            table = rate_table.ensure_fresh()
     except Exception as e:
-        return jsonify({"error": f"An error occurred: {str(e)}", "success": False}), 500
+        return (
+            jsonify({"error": "Failed to fetch exchange rate.", "success": False}),
+            500,
+        )
+
+    try:
+        conversions = []
+        for tgt in targets:
+            rate = table.rate(base, tgt)
+            for amt in amounts:
+                conversions.append(
+                    {
+                        "target": tgt,
+                        "amount": amt,
+                        "rate": round(rate, 6),
+                        "converted": round(amt * rate, 6),
+                    }
+                )
+    except UnsupportedCurrency as e:
+        return (
+            jsonify({"error": f"Currency conversion failed: {e}", "success": False}),
+            400,
+        )
+
+    result = {
+        "base": base,
+        "date": table.date,
+        "cache_age_seconds": table.age,
+        "stale": table.stale,
+        "success": True,
+        "note": "This information is from Frankfurter API. Full credits to them.",
+    }
+    if bulk:
+        result["conversions"] = conversions
+    else:
+        result.update(conversions[0])
+    return jsonify(result)
+
 
 @app.route("/support")
 def support_redirect():
     discord_invite = os.environ.get("DISCORD_INVITE", "#")
     return redirect(discord_invite)
 
+
+TEXT_ALIGNMENTS = ("left", "center", "right")
+
+
+def render_pool_broken():
+    # The pool was recycled (a timed-out job was killed) while this job ran on
+    # it; the next call starts a fresh one.
+    return (
+        jsonify({"error": "Rendering was interrupted, try again.", "success": False}),
+        503,
+        {"Retry-After": "1"},
+    )
+
+
 @app.route("/image-with-text", methods=["POST"])
+@require_api_key("cpu")
 def image_with_text():
     data = request.json
     image_url = data.get("image_url")
     text = data.get("text")
-    position = data.get("position", (10, 10))
-    color = data.get("color", "#FFFFFF")
-    font_size = data.get("font_size", 32)
-    font_style = data.get("font_style", "normal").lower()
-    apikey = data.get("api_key")
-    if not apikey:
-        return jsonify({"error": "Missing api key! Get it from our server at api.loopy5418.dev/support. Add 'api_key' parameter to your request body.", "success": False})
-    if not checkapikey(apikey):
-        return jsonify({"error": "Invalid API key", "success": False}), 403
     if not image_url or not text:
         return jsonify({"error": "'image_url' and 'text' are required fields.", "success": False}), 400
+    if not isinstance(text, str) or len(text) > 2000:
+        return (
+            jsonify(
+                {
+                    "error": "'text' must be a string of at most 2000 characters.",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+
+    options = {
+        "position": data.get("position", (10, 10)),
+        "color": data.get("color", "#FFFFFF"),
+        "font_size": data.get("font_size", 32),
+        "font_style": str(data.get("font_style", "normal")).lower(),
+        "align": str(data.get("align", "left")).lower(),
+        "max_width": data.get("max_width"),
+        "line_spacing": data.get("line_spacing", 4),
+        "stroke_width": data.get("stroke_width", 0),
+        "stroke_color": data.get("stroke_color", "#000000"),
+    }
+    if options["align"] not in TEXT_ALIGNMENTS:
+        return (
+            jsonify(
+                {
+                    "error": "'align' must be 'left', 'center' or 'right'.",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+    for name in ("font_size", "line_spacing", "stroke_width"):
+        if not isinstance(options[name], int) or options[name] < 0:
+            return (
+                jsonify(
+                    {
+                        "error": f"'{name}' must be a non-negative integer.",
+                        "success": False,
+                    }
+                ),
+                400,
+            )
+    if options["max_width"] is not None and (
+        not isinstance(options["max_width"], int) or options["max_width"] < 1
+    ):
+        return (
+            jsonify(
+                {"error": "'max_width' must be a positive integer.", "success": False}
+            ),
+            400,
+        )
 
     try:
-        # Download the image with a user-agent header
-        headers = {"User-Agent": "Mozilla/5.0 (compatible; ImageBot/1.0)"}
-        response = requests.get(image_url, headers=headers, timeout=10)
-        if int(response.headers.get("Content-Length", 0)) > 8 * 1024 * 1024:
-            return jsonify({"error": "File too big!", "success": False}), 400
-        content_type = response.headers.get("Content-Type", "")
-        if not content_type.startswith("image/"):
-            return jsonify({"error": f"URL did not return an image. Content-Type: {content_type}", "success": False}), 400
-        if len(response.content) > 8 * 1024 * 1024:
-            return jsonify({"error": "File too big!", "success": False}), 400
-        image = Image.open(io.BytesIO(response.content)).convert("RGBA")
-        draw = ImageDraw.Draw(image)
-        try:
-            # Try to use a font that supports different sizes
-            font_path_base = os.path.join(os.path.dirname(__file__), "templates", "static")
-            font_files = {
-                "normal": "Roboto-Regular.ttf",
-                "bold": "Roboto-Bold.ttf",
-                "italic": "Roboto-Italic.ttf",
-                "bold-italic": "Roboto-BoldItalic.ttf"
-            }
-            font_file = font_files.get(font_style, "Roboto-Regular.ttf")
-            font_path = os.path.join(font_path_base, font_file)
-            if os.path.exists(font_path):
-                font = ImageFont.truetype(font_path, font_size)
-            else:
-                font = ImageFont.truetype("arial.ttf", font_size)
-        except Exception:
-            font = ImageFont.load_default()
-        width, height = image.size
-        # Calculate text size (compatibility for Pillow >=10)
-        try:
-            bbox = draw.textbbox((0, 0), text, font=font)
-            text_width, text_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        except AttributeError:
-            text_width, text_height = font.getsize(text)
-        if isinstance(position, str):
-            pos = position.lower().strip()
-            if pos == "top":
-                position = ((width - text_width) // 2, 10)
-            elif pos == "center":
-                position = ((width - text_width) // 2, (height - text_height) // 2)
-            elif pos == "bottom":
-                position = ((width - text_width) // 2, height - text_height - 10)
-            else:
-                try:
-                    position = tuple(map(int, pos.strip("() ").split(",")))
-                except Exception:
-                    position = (10, 10)
-        elif isinstance(position, (list, tuple)) and len(position) == 2:
-            position = tuple(position)
-        else:
-            position = (10, 10)
-        draw.text(position, text, fill=color, font=font)
-        img_bytes = io.BytesIO()
-        image.save(img_bytes, format="PNG")
-        img_bytes.seek(0)
-        return Response(img_bytes, mimetype="image/png")
+        image_bytes = imaging.fetch_image(image_url)
+    except imaging.ImageError as e:
+        return jsonify({"error": str(e), "success": False}), 400
+    except requests.RequestException as e:
+        return (
+            jsonify({"error": f"Failed to download image: {str(e)}", "success": False}),
+            400,
+        )
+
+    try:
+        png = render_pool.run(
+            "image_with_text", imaging.render_text_image, image_bytes, text, **options
+        )
+    except RenderBusy as e:
+        return (
+            jsonify(
+                {
+                    "error": "Image rendering is busy, try again shortly.",
+                    "success": False,
+                }
+            ),
+            503,
+            {"Retry-After": str(e.retry_after)},
+        )
+    except RenderTimeout as e:
+        return jsonify({"error": str(e), "success": False}), 504
+    except concurrent.futures.process.BrokenProcessPool:
+        return render_pool_broken()
+    except imaging.ImageError as e:
+        return jsonify({"error": str(e), "success": False}), 400
     except Exception as e:
         return jsonify({"error": f"Failed to process image: {str(e)}", "success": False}), 500
+    return Response(png, mimetype="image/png")
+
+
+def qr_response(data):
+    try:
+        options = qr.parse_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e), "success": False}), 400
+
+    # The output is a pure function of the inputs, so the ETag is known
+    # before rendering and a revalidation never touches qrcode at all.
+    headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    key = qr.cache_key(data, options)
+    if request.if_none_match.contains(key):
+        return Response(status=304, headers={**headers, "ETag": f'"{key}"'})
+
+    try:
+        etag, body, mimetype = qr.get_or_render(data, options)
+    except RenderBusy as e:
+        return (
+            jsonify(
+                {"error": "QR rendering is busy, try again shortly.", "success": False}
+            ),
+            503,
+            {"Retry-After": str(e.retry_after)},
+        )
+    except RenderTimeout as e:
+        return jsonify({"error": str(e), "success": False}), 504
+    except concurrent.futures.process.BrokenProcessPool:
+        return render_pool_broken()
+    except qr.DataOverflowError:
+        return (
+            jsonify({"error": "Too much data for a QR code.", "success": False}),
+            400,
+        )
+    return Response(body, mimetype=mimetype, headers={**headers, "ETag": etag})
+
 
 @app.route("/qr")
+@require_api_key("cheap")
 def qr_code():
-    import qrcode
-    import io
     data = request.args.get("data")
-    apikey = request.args.get("key")
-    if not apikey:
-        return jsonify({"error": "Missing api key! Get it from our server at api.loopy5418.dev/support. Example: ?key=api_key_here", "success": False})
-    if not checkapikey(apikey):
-        return jsonify({"error": "Invalid API key", "success": False}), 403
     if not data:
         return jsonify({"error": "Missing 'data' query parameter.", "success": False}), 400
-    img = qrcode.make(data)
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return Response(buf, mimetype="image/png")
+    return qr_response(data)
+
 
 @app.route("/wifi-qr")
+@require_api_key("cheap")
 def wifi_qr():
-    import qrcode
-    import io
     ssid = request.args.get("ssid")
     password = request.args.get("password", "")
     security = request.args.get("security", "WPA")
     hidden = request.args.get("hidden", "false").lower() == "true"
-    apikey = request.args.get("key")
-    if not apikey:
-        return jsonify({"error": "Missing api key! Get it from our server at api.loopy5418.dev/support. Example: ?key=apikeyhere", "success": False})
-    if not checkapikey(apikey):
-        return jsonify({"error": "Invalid API key", "success": False}), 403
     if not ssid:
         return jsonify({"error": "Missing 'ssid' query parameter.", "success": False}), 400
     qr_data = f"WIFI:T:{security};S:{ssid};P:{password};{'H:true;' if hidden else ''};"
-    img = qrcode.make(qr_data)
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return Response(buf, mimetype="image/png")
+    return qr_response(qr_data)
 
 @app.route("/emojify")
 def emojify():
@@ -703,140 +1183,127 @@ def choose():
     choice = random.choice(opts)
     return jsonify({"result": choice, "success": True})
 
-@app.route("/webhook-send", methods=["POST"])
-def webhook_send():
-    import requests
-
-    def validate_embed(embed):
-        """Validate one embed dict and return a cleaned version or raise ValueError."""
-        if not isinstance(embed, dict):
-            raise ValueError("Each embed must be an object.")
-
-        embed_obj = {}
-
-        if "title" in embed:
-            if not isinstance(embed["title"], str):
-                raise ValueError("'title' must be a string.")
-            embed_obj["title"] = embed["title"]
-
-        if "description" in embed:
-            if not isinstance(embed["description"], str):
-                raise ValueError("'description' must be a string.")
-            embed_obj["description"] = embed["description"]
-
-        if "url" in embed:
-            if not isinstance(embed["url"], str):
-                raise ValueError("'url' must be a string.")
-            embed_obj["url"] = embed["url"]
-
-        if "color" in embed:
-            if not isinstance(embed["color"], int):
-                raise ValueError("'color' must be an integer.")
-            embed_obj["color"] = embed["color"]
-
-        if "author" in embed:
-            if not isinstance(embed["author"], dict):
-                raise ValueError("'author' must be an object.")
-            author = {}
-            if "name" in embed["author"]:
-                if not isinstance(embed["author"]["name"], str):
-                    raise ValueError("'author.name' must be a string.")
-                author["name"] = embed["author"]["name"]
-            if "url" in embed["author"]:
-                if not isinstance(embed["author"]["url"], str):
-                    raise ValueError("'author.url' must be a string.")
-                author["url"] = embed["author"]["url"]
-            if "icon_url" in embed["author"]:
-                if not isinstance(embed["author"]["icon_url"], str):
-                    raise ValueError("'author.icon_url' must be a string.")
-                author["icon_url"] = embed["author"]["icon_url"]
-            if author:
-                embed_obj["author"] = author
-
-        if "footer" in embed:
-            if not isinstance(embed["footer"], dict):
-                raise ValueError("'footer' must be an object.")
-            footer = {}
-            if "text" in embed["footer"]:
-                if not isinstance(embed["footer"]["text"], str):
-                    raise ValueError("'footer.text' must be a string.")
-                footer["text"] = embed["footer"]["text"]
-            if "icon_url" in embed["footer"]:
-                if not isinstance(embed["footer"]["icon_url"], str):
-                    raise ValueError("'footer.icon_url' must be a string.")
-                footer["icon_url"] = embed["footer"]["icon_url"]
-            if footer:
-                embed_obj["footer"] = footer
-
-        if "fields" in embed:
-            if not isinstance(embed["fields"], list):
-                raise ValueError("'fields' must be a list.")
-            fields = []
-            for field in embed["fields"]:
-                if not isinstance(field, dict):
-                    raise ValueError("Each field in 'fields' must be an object.")
-                if "name" not in field or "value" not in field:
-                    raise ValueError("Each field must have 'name' and 'value'.")
-                if not isinstance(field["name"], str) or not isinstance(field["value"], str):
-                    raise ValueError("'field.name' and 'field.value' must be strings.")
-                field_obj = {
-                    "name": field["name"],
-                    "value": field["value"],
-                    "inline": bool(field.get("inline", False))
-                }
-                fields.append(field_obj)
-            embed_obj["fields"] = fields
-
-        if "image" in embed:
-            if not isinstance(embed["image"], dict) or "url" not in embed["image"] or not isinstance(embed["image"]["url"], str):
-                raise ValueError("'image' must be an object with a string 'url'.")
-            embed_obj["image"] = {"url": embed["image"]["url"]}
 
-        if "thumbnail" in embed:
-            if not isinstance(embed["thumbnail"], dict) or "url" not in embed["thumbnail"] or not isinstance(embed["thumbnail"]["url"], str):
-                raise ValueError("'thumbnail' must be an object with a string 'url'.")
-            embed_obj["thumbnail"] = {"url": embed["thumbnail"]["url"]}
-
-        return embed_obj
-
-    data = request.json
-    url = data.get("url")
-    content = data.get("content")
-    username = data.get("username")
-    avatar_url = data.get("avatar_url")
-    embeds = data.get("embeds")
-
-    if not url or (not content and not embeds):
-        return jsonify({"error": "'url' and either 'content' or 'embeds' are required fields.", "success": False}), 400
-
-    payload = {}
+def build_webhook_payload(data, path=None):
+    """Validate one message (content/username/avatar_url/embeds) against
+    webhook_schema and return the payload to post to Discord, or raise ValueError."""
+    if not isinstance(data, dict):
+        raise SchemaError(path, "must be an object")
+    if not data.get("content") and not data.get("embeds"):
+        raise ValueError(
+            f"'{path}' needs either 'content' or 'embeds'."
+            if path
+            else "Either 'content' or 'embeds' is required."
+        )
+    # Empty/null optional fields are ignored rather than rejected.
+    message = {
+        key: data[key]
+        for key in ("content", "username", "avatar_url", "embeds")
+        if data.get(key)
+    }
+    return validate_message(message, path)
 
-    if content:
-        if not isinstance(content, str):
-            return jsonify({"error": "'content' must be a string.", "success": False}), 400
-        payload["content"] = content
 
-    if username:
-        if not isinstance(username, str):
-            return jsonify({"error": "'username' must be a string.", "success": False}), 400
-        payload["username"] = username
+WEBHOOK_BATCH_MAX = 25
 
-    if avatar_url:
-        if not isinstance(avatar_url, str):
-            return jsonify({"error": "'avatar_url' must be a string.", "success": False}), 400
-        payload["avatar_url"] = avatar_url
 
-    if embeds:
-        if not isinstance(embeds, list):
-            return jsonify({"error": "'embeds' must be a list.", "success": False}), 400
+@app.route("/webhook-send", methods=["POST"])
+async def webhook_send():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return (
+            jsonify({"error": "Request body must be a JSON object.", "success": False}),
+            400,
+        )
+    url = data.get("url")
+    messages = data.get("messages")
+
+    # 'messages' (a batch) is always queued; a single message is queued when
+    # 'async' is set in the body or the query string.
+    queued = (
+        messages is not None
+        or bool(data.get("async"))
+        or request.args.get("async", "").lower() in ("1", "true", "yes")
+    )
 
+    if messages is None:
+        if not url or (not data.get("content") and not data.get("embeds")):
+            return (
+                jsonify(
+                    {
+                        "error": "'url' and either 'content' or 'embeds' "
+                        "are required fields.",
+                        "success": False,
+                    }
+                ),
+                400,
+            )
+        try:
+            payloads = [build_webhook_payload(data)]
+        except ValueError as e:
+            return jsonify({"error": str(e), "success": False}), 400
+    else:
+        if not url:
+            return (
+                jsonify({"error": "'url' is a required field.", "success": False}),
+                400,
+            )
+        if not isinstance(messages, list) or not messages:
+            return (
+                jsonify(
+                    {"error": "'messages' must be a non-empty list.", "success": False}
+                ),
+                400,
+            )
+        if len(messages) > WEBHOOK_BATCH_MAX:
+            return (
+                jsonify(
+                    {
+                        "error": f"At most {WEBHOOK_BATCH_MAX} messages per request.",
+                        "success": False,
+                    }
+                ),
+                400,
+            )
         try:
-            payload["embeds"] = [validate_embed(embed) for embed in embeds]
+            payloads = [
+                build_webhook_payload(message, f"messages[{i}]")
+                for i, message in enumerate(messages)
+            ]
         except ValueError as e:
             return jsonify({"error": str(e), "success": False}), 400
 
+    if not isinstance(url, str):
+        return jsonify({"error": "'url' must be a string.", "success": False}), 400
+
+    if queued:
+        # Queued deliveries are stored until they are sent: only callers with a
+        # key may queue them, and each message is charged as one upstream call.
+        error, limit = await charge_request("upstream", len(payloads))
+        if error:
+            return error
+        try:
+            ids = await asyncio.to_thread(webhooks.enqueue, url, payloads)
+        except Exception as e:
+            return (
+                jsonify(
+                    {"error": f"Failed to queue delivery: {str(e)}", "success": False}
+                ),
+                500,
+            )
+        result = {
+            "delivery_ids": ids,
+            "status_url": f"/webhook-send/status?ids={','.join(ids)}",
+            "success": True,
+        }
+        if messages is None:
+            result["delivery_id"] = ids[0]
+        response = app.make_response((jsonify(result), 202))
+        response.headers.extend(headers_for(limit))
+        return response
+
     try:
-        resp = requests.post(url, json=payload)
+        resp = await upstream.apost("webhook", url, json=payloads[0])
         if resp.status_code in (200, 204):
             return jsonify({"success": True})
         else:
@@ -844,6 +1311,44 @@ def webhook_send():
     except Exception as e:
         return jsonify({"error": f"Request failed: {str(e)}", "success": False}), 500
 
+
+@app.route("/webhook-send/status", methods=["GET"])
+@app.route("/webhook-send/status/<delivery_id>", methods=["GET"])
+def webhook_send_status(delivery_id=None):
+    ids = (
+        [delivery_id]
+        if delivery_id
+        else [i.strip() for i in request.args.get("ids", "").split(",") if i.strip()]
+    )
+    if not ids:
+        return (
+            jsonify(
+                {
+                    "error": "Provide a delivery id, "
+                    "or 'ids' as a comma-separated list.",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+    if len(ids) > WEBHOOK_BATCH_MAX:
+        return (
+            jsonify(
+                {
+                    "error": f"At most {WEBHOOK_BATCH_MAX} ids per request.",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+    deliveries = webhooks.get_statuses(ids)
+    if delivery_id:
+        if deliveries[0]["status"] == "unknown":
+            return jsonify({"error": "Unknown delivery id", "success": False}), 404
+        return jsonify({**deliveries[0], "success": True})
+    return jsonify({"deliveries": deliveries, "success": True})
+
+
 @app.route("/status")
 def status():
     return render_template("status.html")
@@ -914,7 +1419,7 @@ def generate_password():
         "password": password,
         "success": True
     })
-    
+
 @app.route('/convert-timezone', methods=['GET'])
 def convert_timezone():
     from_tz = request.args.get('from')
@@ -947,7 +1452,7 @@ def convert_timezone():
 
     except Exception as e:
         return jsonify({"error": str(e), "success": False}), 400
-        
+
 @app.route('/sqrt')
 def sqrt():
     try:
@@ -964,7 +1469,7 @@ def sqrt():
 
     except ValueError:
         return jsonify({'success': False, 'error': 'Invalid number provided'}), 400
-        
+
 @app.route('/cbrt')
 def cube_root():
     try:
@@ -983,7 +1488,7 @@ def cube_root():
 
     except ValueError:
         return jsonify({'success': False, 'error': 'Invalid number provided'}), 400
-        
+
 @app.route('/ascii-art', methods=['GET'])
 def ascii_art():
     text = request.args.get('text', '')
@@ -996,20 +1501,32 @@ def ascii_art():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/openai/text', methods=['GET'])
-def openai_text():
-    text = request.args.get("prompt")
-    apikey = request.args.get("key")
-    speed = request.args.get("speed", "balanced").lower()
 
-    if not apikey:
-        return jsonify({
-            "error": "Missing api key! Get it from our server at api.loopy5418.dev/support. Example: ?key=apikeyhere",
-            "success": False
-        })
+OPENAI_SYSTEM_PROMPT = (
+    "You are an AI service in an API called 'api.loopy5418.dev'. The API owner is "
+    "Loopy5418. Refrain from providing data that is guessed. Refrain from any "
+    "political, nsfw, or inappropriate question. Do what the user says, thank you."
+)
+OPENAI_URL = "https://text.pollinations.ai/openai"
+# Streams: total time allowed, and longest silence between two chunks.
+OPENAI_STREAM_TIMEOUT = db.env_int("OPENAI_STREAM_TIMEOUT", 120)
+OPENAI_STREAM_IDLE_TIMEOUT = db.env_int("OPENAI_STREAM_IDLE_TIMEOUT", 30)
+
 
-    if not checkapikey(apikey):
-        return jsonify({"error": "Invalid API key", "success": False}), 403
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n".encode()
+
+
+@app.route("/openai/text", methods=["GET"])
+@require_api_key("upstream")
+async def openai_text():
+    text = request.args.get("prompt")
+    speed = request.args.get("speed", "balanced").lower()
+    stream = (
+        request.args.get("stream", "").lower() in ("1", "true", "yes")
+        or request.accept_mimetypes.best == "text/event-stream"
+    )
 
     if not text:
         return jsonify({"error": "Missing 'prompt' parameter", "success": False})
@@ -1025,25 +1542,28 @@ def openai_text():
     if not model:
         return jsonify({"error": "Invalid 'speed' value. Must be 'balanced', 'fast', or 'large'", "success": False}), 400
 
-    try:
-        payload = {
-            "model": model,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are an AI service in an API called 'api.loopy5418.dev'. The API owner is Loopy5418. Refrain from providing data that is guessed. Refrain from any political, nsfw, or inappropriate question. Do what the user says, thank you."
-                },
-                {"role": "user", "content": text}
-            ]
-        }
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": OPENAI_SYSTEM_PROMPT},
+            {"role": "user", "content": text},
+        ],
+    }
+
+    if stream:
+        return await openai_text_stream(payload, text)
 
-        response = requests.post("https://text.pollinations.ai/openai", json=payload)
+    async def fetch():
+        response = await upstream.apost("pollinations", OPENAI_URL, json=payload)
         if response.status_code != 200:
-            return jsonify({
-                "error": "Failed to fetch from pollinations.ai",
-                "details": response.text,
-                "success": False
-            }), response.status_code
+            return {
+                "body": {
+                    "error": "Failed to fetch from pollinations.ai",
+                    "details": response.text,
+                    "success": False,
+                },
+                "status": response.status_code,
+            }, False
 
         data = response.json()
         message = data["choices"][0]["message"]["content"]
@@ -1051,33 +1571,143 @@ def openai_text():
         filters = data["choices"][0]["content_filter_results"]
         final_model = data.get("model", model)
 
-        return jsonify({
-            "response": message,
-            "refused": refusal,
-            "filter_results": filters,
-            "prompt": text,
-            "model": final_model,
-            "success": True
-        })
+        return {
+            "body": {
+                "response": message,
+                "refused": refusal,
+                "filter_results": filters,
+                "model": final_model,
+                "success": True,
+            },
+            "status": 200,
+        }, True
+
+    # Identical prompts share one cached answer (and one upstream call while
+    # it is in flight) unless the caller opts out with ?cache=false or
+    # Cache-Control: no-cache.
+    bypass = request.args.get("cache", "").lower() in (
+        "0",
+        "false",
+        "no",
+    ) or "no-cache" in request.headers.get("Cache-Control", "")
+    try:
+        if bypass:
+            prompt_cache.record_bypass()
+            result, _ = await fetch()
+            outcome = "bypass"
+        else:
+            result, outcome = await prompt_cache.get_or_fetch(
+                prompt_cache.cache_key(model, text), fetch
+            )
+    except Exception as e:
+        return jsonify({"error": str(e), "success": False}), 500
 
+    body = result["body"]
+    if body["success"]:
+        body = {**body, "prompt": text}
+    response = jsonify(body)
+    response.status_code = result["status"]
+    response.headers["X-Cache"] = outcome.upper()
+    return response
+
+
+async def openai_text_stream(payload, text):
+    """Relay pollinations' completion as Server-Sent Events: one 'data' event
+    per token batch, then a 'done' (or 'error') event. If the client
+    disconnects, the generator is cancelled/closed and the upstream request is
+    dropped with it."""
+    stack = contextlib.AsyncExitStack()
+    try:
+        resp = await stack.enter_async_context(
+            upstream.astream(
+                "pollinations",
+                "POST",
+                OPENAI_URL,
+                json={**payload, "stream": True},
+                timeout=(5, OPENAI_STREAM_IDLE_TIMEOUT),
+            )
+        )
+        if resp.status != 200:
+            details = await resp.text()
+            await stack.aclose()
+            return (
+                jsonify(
+                    {
+                        "error": "Failed to fetch from pollinations.ai",
+                        "details": details,
+                        "success": False,
+                    }
+                ),
+                resp.status,
+            )
     except Exception as e:
+        await stack.aclose()
         return jsonify({"error": str(e), "success": False}), 500
 
-@app.route('/roblox-user-search', methods=['GET'])
-def roblox_user_search():
+    async def events():
+        deadline = time.monotonic() + OPENAI_STREAM_TIMEOUT
+        model = payload["model"]
+        try:
+            async with stack:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    line = await asyncio.wait_for(resp.content.readline(), remaining)
+                    if not line:
+                        break
+                    line = line.strip()
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    model = chunk.get("model") or model
+                    for choice in chunk.get("choices", []):
+                        token = (choice.get("delta") or {}).get("content")
+                        if token:
+                            yield sse_event({"token": token})
+        except (asyncio.TimeoutError, requests.Timeout):
+            yield sse_event(
+                {"error": "Upstream timed out", "success": False}, event="error"
+            )
+            return
+        except (requests.RequestException, ValueError) as e:
+            yield sse_event({"error": str(e), "success": False}, event="error")
+            return
+        yield sse_event({"prompt": text, "model": model, "success": True}, event="done")
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Overridable so load tests can point the Roblox routes at a local fake
+# (tests/load/fake_roproxy.py).
+ROPROXY_USERS_URL = os.environ.get(
+    "ROPROXY_USERS_URL", "https://users.roproxy.com"
+).rstrip("/")
+ROPROXY_APIS_URL = os.environ.get(
+    "ROPROXY_APIS_URL", "https://apis.roproxy.com"
+).rstrip("/")
+
+
+@app.route("/roblox-user-search", methods=["GET"])
+@require_api_key("upstream")
+async def roblox_user_search():
     username = request.args.get('username')
-    apikey = request.args.get("key")
-    if not apikey:
-        return jsonify({"error": "Missing api key! Get it from our server at api.loopy5418.dev/support. Example: ?key=apikeyhere", "success": False})
-    if not checkapikey(apikey):
-        return jsonify({"error": "Invalid API key", "success": False}), 403
     if not username:
         return jsonify({"error": "Missing 'username' parameter", "success": False}), 400
 
-    roproxy_url = f"https://users.roproxy.com/v1/users/search?keyword={username}&limit=25"
+    roproxy_url = f"{ROPROXY_USERS_URL}/v1/users/search"
 
     try:
-        response = requests.get(roproxy_url)
+        response = await upstream.aget(
+            "roproxy", roproxy_url, params={"keyword": username, "limit": 25}
+        )
         response.raise_for_status()
         data = response.json()
 
@@ -1090,103 +1720,216 @@ def roblox_user_search():
 
     except requests.RequestException as e:
         return jsonify({"error": "Failed to fetch data from Roblox servers: str(e)", "success": False}), 500
-        
 
-@app.route('/roblox-user-info', methods=['GET'])
-def roblox_user_info():
-    apikey = request.args.get("key")
-    if not apikey: # 1000th line!!!
-        return jsonify({
-            "error": "Missing API key! Get it from our server at api.loopy5418.dev/support. Example: ?key=apikeyhere",
-            "success": False
-        }), 400
 
-    if not checkapikey(apikey):
-        return jsonify({
-            "error": "Invalid API key",
-            "success": False
-        }), 403
+ROBLOX_THUMBNAIL_TIMEOUT = float(os.environ.get("ROBLOX_THUMBNAIL_TIMEOUT", 3))
+ROBLOX_BATCH_MAX = 50
+ROBLOX_BATCH_CONCURRENCY = db.env_int("ROBLOX_BATCH_CONCURRENCY", 8)
 
-    username = request.args.get('username')
-    user_id = request.args.get('user_id')
 
-    if (username and user_id) or (not username and not user_id):
-        return jsonify({
-            "error": "Provide either 'username' or 'user_id', but not both",
-            "success": False
-        }), 400
+def format_roblox_created(created_raw):
+    try:
+        dt = datetime.strptime(created_raw, "%Y-%m-%dT%H:%M:%S.%fZ")
+        return {
+            "day": dt.day,
+            "year": dt.year,
+            "month": dt.strftime("%B"),
+            "date": dt.strftime("%B %d, %Y"),
+            "time": dt.strftime("%H:%M"),
+        }
+    except ValueError:
+        return {"raw": created_raw, "error": "Invalid date format"}
 
+
+def is_roblox_id(value):
+    # Ids go into upstream URL paths, so only plain ASCII digits get through.
+    return not isinstance(value, bool) and str(value).isascii() and str(value).isdigit()
+
+
+async def fetch_roblox_user(username=None, user_id=None):
+    """Resolve one Roblox user and return (payload, status_code)."""
     # Step 1: Get user_id from username if needed
     if username:
         try:
-            search_url = f"https://users.roproxy.com/v1/users/search?keyword={username}&limit=25"
-            search_response = requests.get(search_url)
+            search_url = f"{ROPROXY_USERS_URL}/v1/users/search"
+            search_response = await upstream.aget(
+                "roproxy", search_url, params={"keyword": username, "limit": 25}
+            )
             search_response.raise_for_status()
             search_data = search_response.json().get("data", [])
             if not search_data:
-                return jsonify({"error": "User not found", "success": False}), 404
+                return {"error": "User not found", "success": False}, 404
             user_id = search_data[0]["id"]
-        except requests.RequestException as e:
-            return jsonify({
-                "error": "Failed to search user",
-                "success": False
-            }), 500
+        except (requests.RequestException, ValueError, KeyError):
+            return {"error": "Failed to search user", "success": False}, 500
+    elif not is_roblox_id(user_id):
+        return {"error": "'user_id' must be a number", "success": False}, 400
 
-    # Step 2: Fetch user info
     headers = {
         "x-api-key": os.environ.get("ROBLOX_API_KEY", "")
     }
 
     if not headers["x-api-key"]:
-        return jsonify({
-            "error": "ROBLOX_API_KEY not set in environment",
-            "success": False
-        }), 500
+        return {"error": "ROBLOX_API_KEY not set in environment", "success": False}, 500
+
+    # Step 2: Fetch user info and profile picture at the same time
+    user_info_url = f"{ROPROXY_USERS_URL}/v1/users/{user_id}"
+    thumb_url = (
+        f"{ROPROXY_APIS_URL}/cloud/v2/users/{user_id}:generateThumbnail"
+        "?size=100&format=PNG&shape=ROUND"
+    )
+    info_task = asyncio.ensure_future(
+        upstream.aget("roproxy", user_info_url, headers=headers)
+    )
+    thumb_task = asyncio.ensure_future(
+        upstream.aget(
+            "roproxy",
+            thumb_url,
+            headers=headers,
+            timeout=(3, ROBLOX_THUMBNAIL_TIMEOUT),
+            retries=0,
+        )
+    )
 
     try:
-        user_info_url = f"https://users.roproxy.com/v1/users/{user_id}"
-        user_info_response = requests.get(user_info_url, headers=headers)
+        user_info_response = await info_task
         user_info_response.raise_for_status()
         user_data = user_info_response.json()
-
-        # Format "created" timestamp
-        created_raw = user_data.get("created")
-        if created_raw:
-            try:
-                dt = datetime.strptime(created_raw, "%Y-%m-%dT%H:%M:%S.%fZ")
-                user_data["created"] = {
-                    "day": dt.day,
-                    "year": dt.year,
-                    "month": dt.strftime("%B"),
-                    "date": dt.strftime("%B %d, %Y"),
-                    "time": dt.strftime("%H:%M")
-                }
-            except ValueError:
-                user_data["created"] = {
-                    "raw": created_raw,
-                    "error": "Invalid date format"
-                }
-
-        # Step 3: Fetch profile picture
-        thumb_url = f"https://apis.roproxy.com/cloud/v2/users/{user_id}:generateThumbnail?size=100&format=PNG&shape=ROUND"
-        thumb_response = requests.get(thumb_url, headers=headers)
+    except (requests.RequestException, ValueError):
+        thumb_task.cancel()
+        return {"error": "Failed to fetch user info", "success": False}, 500
+    except BaseException:
+        # Cancelled (or anything unexpected): don't leave the thumbnail
+        # request running on its own.
+        thumb_task.cancel()
+        raise
+
+    if user_data.get("created"):
+        user_data["created"] = format_roblox_created(user_data["created"])
+
+    # Step 3: The picture is optional; report a partial result instead of failing
+    try:
+        thumb_response = await thumb_task
         if thumb_response.ok:
             thumb_data = thumb_response.json()
             user_data["profile_picture_url"] = thumb_data.get("response", {}).get("imageUri")
+        else:
+            user_data["partial"] = True
+            user_data["partial_reason"] = (
+                f"Thumbnail request failed: HTTP {thumb_response.status_code}"
+            )
+    except (requests.RequestException, ValueError) as e:
+        user_data["partial"] = True
+        user_data["partial_reason"] = (
+            "Thumbnail request timed out"
+            if isinstance(e, requests.Timeout)
+            else "Thumbnail request failed"
+        )
+
+    user_data.setdefault("profile_picture_url", None)
+    user_data.setdefault("partial", False)
+    user_data["success"] = True
+    return user_data, 200
+
+
+@app.route("/roblox-user-info", methods=["GET"])
+@require_api_key("upstream")
+async def roblox_user_info():
+    username = request.args.get("username")
+    user_id = request.args.get("user_id")
+
+    if (username and user_id) or (not username and not user_id):
+        return (
+            jsonify(
+                {
+                    "error": "Provide either 'username' or 'user_id', but not both",
+                    "success": False,
+                }
+            ),
+            400,
+        )
+
+    data, status = await fetch_roblox_user(username=username, user_id=user_id)
+    return jsonify(data), status
+
+
+def roblox_batch_lookups():
+    """Parse a batch request into ([(kind, value)], error message or None)."""
+    if request.method == "POST":
+        body = request.get_json(silent=True) or {}
+        user_ids = body.get("user_ids", [])
+        usernames = body.get("usernames", [])
+    else:
+        user_ids = [
+            u.strip() for u in request.args.get("user_ids", "").split(",") if u.strip()
+        ]
+        usernames = [
+            u.strip() for u in request.args.get("usernames", "").split(",") if u.strip()
+        ]
+
+    if not isinstance(user_ids, list) or not isinstance(usernames, list):
+        return [], "'user_ids' and 'usernames' must be lists"
+    if not user_ids and not usernames:
+        return [], "Provide 'user_ids' and/or 'usernames'"
+    if len(user_ids) + len(usernames) > ROBLOX_BATCH_MAX:
+        return [], f"At most {ROBLOX_BATCH_MAX} users per batch"
+    invalid = [u for u in user_ids if not is_roblox_id(u)]
+    if invalid:
+        return [], f"'user_ids' must be numbers: {', '.join(map(str, invalid[:5]))}"
+    return [("user_id", str(u)) for u in user_ids] + [
+        ("username", str(u)) for u in usernames
+    ], None
+
+
+def roblox_batch_cost():
+    # Every user costs an upstream token, as if it were looked up on its own.
+    lookups, _ = roblox_batch_lookups()
+    return max(len(lookups), 1)
+
+
+@app.route("/roblox-user-info/batch", methods=["GET", "POST"])
+@require_api_key("upstream", cost=roblox_batch_cost)
+async def roblox_user_info_batch():
+    lookups, error = roblox_batch_lookups()
+    if error:
+        return jsonify({"error": error, "success": False}), 400
+    slots = asyncio.Semaphore(ROBLOX_BATCH_CONCURRENCY)
+
+    async def lookup(kind, value):
+        async with slots:
+            data, status = await fetch_roblox_user(**{kind: value})
+        return {"query": {kind: value}, "status": status, **data}
+
+    results = await asyncio.gather(
+        *(lookup(kind, value) for kind, value in lookups), return_exceptions=True
+    )
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            kind, value = lookups[i]
+            app.logger.warning(
+                f"Roblox batch lookup of {kind}={value} failed: {result!r}"
+            )
+            results[i] = {
+                "query": {kind: value},
+                "status": 500,
+                "error": "Lookup failed",
+                "success": False,
+            }
+
+    return jsonify(
+        {
+            "results": results,
+            "total": len(results),
+            "found": sum(1 for r in results if r["success"]),
+            "success": True,
+        }
+    )
 
-        user_data["success"] = True
-        return jsonify(user_data)
 
-    except requests.RequestException as e:
-        return jsonify({
-            "error": "Failed to fetch user info",
-            "success": False
-        }), 500
-        
 @app.route('/try/roblox-user-search')
 def robloxsearchtry():
     return render_template('try/r-user-search.html')
-    
+
 @app.route('/try/roblox-search-info')
 def robloxsearchinfotry():
     return render_template('try/user-info.html')
@@ -1229,23 +1972,14 @@ def parse_timestamp():
 
     except ValueError:
         return jsonify({"success": False, "error": "Invalid ISO 8601 timestamp format"}), 400
-        
-@app.route('/attachment-get', methods=['GET'])
-def attachment_get():
+
+
+@app.route("/attachment-get", methods=["GET"])
+@require_api_key("upstream")
+async def attachment_get():
     bot_token = request.args.get('bot_token')
     message_id = request.args.get('message_id')
     channel_id = request.args.get('channel_id')
-    apikey = request.args.get("key")
-    if not apikey:
-        return jsonify({
-            "error": "Missing API key! Get it from our server at api.loopy5418.dev/support. Example: ?key=apikeyhere",
-            "success": False
-        }), 400
-    if not checkapikey(apikey):
-        return jsonify({
-            "error": "Invalid API key",
-            "success": False
-        }), 403
 
     if not all([bot_token, message_id, channel_id]):
         return jsonify({'success': False, 'error': 'Missing query parameters'}), 400
@@ -1257,11 +1991,16 @@ def attachment_get():
         return jsonify({'success': False, 'error': 'message_id and channel_id must be integers'}), 400
 
     try:
-        data = run_async(fetch_message_attachments(bot_token, channel_id, message_id))
+        data = await discord_rest.fetch_message_attachments(
+            bot_token, channel_id, message_id
+        )
         return jsonify(data)
+    except discord_rest.DiscordError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
-        
+
+
 @app.route('/discord-timestamp/iso', methods=['GET'])
 def discord_timestamp_iso():
     iso = request.args.get("iso")
@@ -1290,7 +2029,7 @@ def discord_timestamp_iso():
         })
     except Exception as e:
         return jsonify({"error": f"Invalid ISO format: {str(e)}", "success": False}), 400
-        
+
 @app.route('/discord-timestamp/normal', methods=['GET'])
 def discord_timestamp_parts():
     tzname = request.args.get("tz", "UTC")
@@ -1322,7 +2061,7 @@ def discord_timestamp_parts():
 
     except Exception as e:
         return jsonify({"error": f"Invalid date parts: {str(e)}", "success": False}), 400
-        
+
 @app.route('/my-ip', methods=['GET'])
 def my_ip():
     ip = request.headers.get('X-Forwarded-For', request.remote_addr)
@@ -1363,20 +2102,51 @@ def my_ip():
         },
         "success": True
     })
-    
+
 
 @app.route('/wiki/get', methods=['GET'])
 def api_get_wikis():
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""
-        SELECT id, title, description, content, created_at
-        FROM wikis
-        ORDER BY created_at DESC
-    """)
-    wikis = cur.fetchall()
-    conn.close()
-    return jsonify(wikis)
+    """Newest wikis first, a page at a time. ?fields= picks the columns
+    (content is left out unless asked for); the next page's ?cursor= comes back
+    in X-Next-Cursor and a Link header."""
+    try:
+        fields = wikis.parse_fields(request.args.get("fields"))
+        limit = wikis.parse_limit(request.args.get("limit"))
+        page, next_cursor = wikis.list_page(request.args.get("cursor"), limit, fields)
+    except wikis.BadRequest as e:
+        return jsonify({"error": str(e), "success": False}), 400
+
+    return paginated(page, next_cursor)
+
+
+@app.route("/wiki/search", methods=["GET"])
+def api_search_wikis():
+    """Full-text search: ?q= (web-search syntax), ranked best first and paged
+    like /wiki/get."""
+    try:
+        limit = wikis.parse_limit(
+            request.args.get("limit"),
+            wikis.WIKI_SEARCH_PAGE_SIZE,
+            wikis.WIKI_SEARCH_PAGE_MAX,
+        )
+        results, next_cursor = wikis.search(
+            request.args.get("q"), request.args.get("cursor"), limit
+        )
+    except wikis.BadRequest as e:
+        return jsonify({"error": str(e), "success": False}), 400
+    return paginated(results, next_cursor)
+
+
+def paginated(items, next_cursor):
+    """A JSON list, with the cursor for the next page in X-Next-Cursor and a
+    Link header."""
+    response = jsonify(items)
+    if next_cursor:
+        args = {**request.args.to_dict(), "cursor": next_cursor}
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+    return response
+
 
 @app.route('/wiki/<int:wiki_id>', methods=['GET'])
 def wiki_detail(wiki_id):
@@ -1410,34 +2180,18 @@ def api_post_wiki():
     if not title or not desc or not content:
         return jsonify({"error":"title, description, content are required", "success": False}), 400
 
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO wikis (title, description, content)
-        VALUES (%s,%s,%s)
-        RETURNING id
-    """, (title, desc, content))
-    new_id = cur.fetchone()[0]
-    conn.commit()
-    conn.close()
+    new_id = wikis.create(title, desc, content)
     return jsonify({"id": new_id, "success": True}), 201
-    
+
 @app.route('/wiki', methods=['GET'])
 def renderwikilist():
     return render_template('wikis.html')
-    
+
 @app.route('/wiki/delete/<int:wiki_id>', methods=['DELETE'])
 def delete_wiki(wiki_id):
     is_admin()  # Check for admin API key
 
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM wikis WHERE id = %s", (wiki_id,))
-    deleted = cur.rowcount
-    conn.commit()
-    conn.close()
-
-    if deleted == 0:
+    if not wikis.delete(wiki_id):
         return jsonify({"error": "Wiki not found", "success": False}), 404
 
-    return jsonify({"success": True, "deleted_id": wiki_id})
\ No newline at end of file
+    return jsonify({"success": True, "deleted_id": wiki_id})
@@ -0,0 +1,317 @@
+import asyncio
+import inspect
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+
+from . import db, discord_rest, metrics, status_stream, upstream, webhooks
+from .aio import background_loop
+from .db import env_int
+from .render_pool import render_pool
+
+logger = logging.getLogger(__name__)
+
+ASGI_THREADS = env_int("ASGI_THREADS", 16)
+ASGI_MAX_BODY_BYTES = env_int("ASGI_MAX_BODY_BYTES", 16 * 1024 * 1024)
+# Status page streams are only coroutines here, so many more fit per worker.
+ASGI_STATUS_STREAMS = env_int("ASGI_STATUS_STREAMS", 500)
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def read_body(receive, max_bytes):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        body += message.get("body", b"")
+        if len(body) > max_bytes:
+            raise BodyTooLarge()
+        if not message.get("more_body", False):
+            return bytes(body)
+
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope into the WSGI environ Flask expects."""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path) :]
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(
+            scope["client"][1]
+        )
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        key = name if name == "CONTENT_TYPE" else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _encode_headers(headers):
+    return [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+
+class AsgiApp:
+    """Serve the Flask app from an ASGI server (see asgi.py at the repo root).
+
+    Async views are awaited directly on the server's event loop, so a worker
+    waiting on Frankfurter, pollinations, roproxy or Discord can hold many
+    requests at once. Everything else goes through the normal WSGI path in a
+    thread pool, which keeps CPU-bound and blocking routes off the loop."""
+
+    def __init__(self, app, threads=ASGI_THREADS, max_body_bytes=ASGI_MAX_BODY_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="asgi-sync"
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+
+        try:
+            body = await read_body(receive, self.max_body_bytes)
+        except ClientDisconnected:
+            return
+        except BodyTooLarge:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 413,
+                    "headers": [(b"content-type", b"text/plain")],
+                }
+            )
+            await send(
+                {"type": "http.response.body", "body": b"Request body too large"}
+            )
+            return
+
+        environ = build_environ(scope, body)
+        if self.is_async_route(environ):
+            await self.handle_async(environ, receive, send)
+        else:
+            await self.handle_sync(environ, send)
+
+    def is_async_route(self, environ):
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return False
+        return inspect.iscoroutinefunction(self.app.view_functions.get(endpoint))
+
+    async def handle_async(self, environ, receive, send):
+        # Mirrors Flask.wsgi_app/full_dispatch_request, awaiting the view
+        # instead of handing it to async_to_sync.
+        app = self.app
+        ctx = app.request_context(environ)
+        error = None
+        try:
+            ctx.push()
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    req = ctx.request
+                    if req.routing_exception is not None:
+                        app.raise_routing_exception(req)
+                    rule = req.url_rule
+                    if (
+                        getattr(rule, "provide_automatic_options", False)
+                        and req.method == "OPTIONS"
+                    ):
+                        rv = app.make_default_options_response()
+                    else:
+                        rv = await app.view_functions[rule.endpoint](**req.view_args)
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            response = app.finalize_request(rv)
+        except Exception as e:
+            error = e
+            response = app.handle_exception(e)
+        try:
+            if hasattr(response.response, "__aiter__"):
+                await self.send_stream(response, environ, receive, send)
+            else:
+                await self.send_response(response, environ, send)
+        finally:
+            ctx.pop(error)
+
+    async def send_response(self, response, environ, send):
+        chunks, status, headers = response.get_wsgi_response(environ)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": _encode_headers(headers),
+            }
+        )
+        try:
+            for chunk in chunks:
+                if chunk:
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+    async def send_stream(self, response, environ, receive, send):
+        """Send an async-generator body, cancelling it if the client disconnects
+        so whatever it is waiting on (e.g. an upstream stream) is dropped."""
+        chunks = response.response
+        headers = response.get_wsgi_headers(environ).to_wsgi_list()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": _encode_headers(headers),
+            }
+        )
+
+        async def pump():
+            async for chunk in chunks:
+                if chunk:
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": chunk.encode() if isinstance(chunk, str) else chunk,
+                            "more_body": True,
+                        }
+                    )
+            await send({"type": "http.response.body", "body": b""})
+
+        async def disconnected():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        pumping = asyncio.ensure_future(pump())
+        watching = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait({pumping, watching}, return_when=asyncio.FIRST_COMPLETED)
+            if not pumping.done():
+                metrics.inc("stream_disconnects_total")
+            for task in (pumping, watching):
+                task.cancel()
+            await asyncio.gather(pumping, watching, return_exceptions=True)
+            if not pumping.cancelled() and pumping.exception() is not None:
+                raise pumping.exception()
+        finally:
+            await chunks.aclose()
+
+    async def handle_sync(self, environ, send):
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = headers
+
+        def begin():
+            app_iter = self.app(environ, start_response)
+            chunks = iter(app_iter)
+            if any(k.lower() == "content-length" for k, _ in started["headers"]):
+                # A sized body is already in memory; fetch it in one hop.
+                return app_iter, None, list(chunks)
+            return app_iter, chunks, [next(chunks, b"")]
+
+        app_iter, chunks, first = await loop.run_in_executor(self.executor, begin)
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": started["status"],
+                    "headers": _encode_headers(started["headers"]),
+                }
+            )
+            for chunk in first:
+                if chunk:
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+            # Streamed bodies (no Content-Length) are pulled one chunk at a time.
+            while chunks is not None:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(app_iter, "close"):
+                await loop.run_in_executor(self.executor, app_iter.close)
+
+    async def lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await loop.run_in_executor(None, self.startup)
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def startup(self):
+        # Same as gunicorn's post_worker_init, for when uvicorn runs us directly.
+        try:
+            db.get_pool().warm()
+        except Exception as e:
+            logger.warning(f"Could not warm database pool: {e}")
+        webhooks.dispatcher.start()
+        status_stream.broadcaster.max_streams = ASGI_STATUS_STREAMS
+        status_stream.broadcaster.start()
+        metrics.store.start()
+
+    async def shutdown(self):
+        await asyncio.gather(
+            discord_rest.close_loop_sessions(),
+            upstream.close_loop_sessions(),
+            return_exceptions=True,
+        )
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, background_loop.shutdown)
+        await loop.run_in_executor(None, render_pool.shutdown)
+        await loop.run_in_executor(None, db.close_pool)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,170 @@
+import hashlib
+import uuid
+
+from . import db, pubsub
+from .cache import LRUCache
+
+KEYS_CHANNEL = "api_keys_changed"
+
+# Keys are only ever stored as their SHA-256 digest (they are random UUIDs, so
+# there is nothing to salt against), plus the first few characters so admins
+# can tell keys apart.
+KEY_PREFIX_LENGTH = 8
+# Most user ids a single bulk admin call may touch.
+KEY_BULK_MAX = db.env_int("KEY_BULK_MAX", 1000)
+
+SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS api_keys (
+        user_id TEXT PRIMARY KEY,
+        key_hash BYTEA NOT NULL,
+        key_prefix TEXT NOT NULL
+    );
+    -- Older deployments kept the plaintext key in api_key: hash it and drop it.
+    ALTER TABLE api_keys ADD COLUMN IF NOT EXISTS key_hash BYTEA;
+    ALTER TABLE api_keys ADD COLUMN IF NOT EXISTS key_prefix TEXT;
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema()
+                     AND table_name = 'api_keys' AND column_name = 'api_key') THEN
+            -- Workers start together; only the first one migrates.
+            LOCK TABLE api_keys IN ACCESS EXCLUSIVE MODE;
+            IF EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_schema = current_schema()
+                         AND table_name = 'api_keys' AND column_name = 'api_key') THEN
+                UPDATE api_keys
+                SET key_hash = sha256(convert_to(api_key, 'UTF8')),
+                    key_prefix = left(api_key, {KEY_PREFIX_LENGTH})
+                WHERE key_hash IS NULL;
+                ALTER TABLE api_keys DROP COLUMN api_key;
+            END IF;
+        END IF;
+    END $$;
+    ALTER TABLE api_keys
+        ALTER COLUMN key_hash SET NOT NULL,
+        ALTER COLUMN key_prefix SET NOT NULL;
+    CREATE UNIQUE INDEX IF NOT EXISTS api_keys_key_hash ON api_keys (key_hash);
+    CREATE INDEX IF NOT EXISTS api_keys_key_prefix ON api_keys (key_prefix);
+"""
+
+# Valid keys are cached for KEY_CACHE_TTL seconds, unknown keys for the
+# (shorter) KEY_CACHE_NEGATIVE_TTL so a freshly issued key is never refused
+# for long even if a notification gets lost.
+KEY_CACHE_TTL = db.env_int("KEY_CACHE_TTL", 300)
+KEY_CACHE_NEGATIVE_TTL = db.env_int("KEY_CACHE_NEGATIVE_TTL", 30)
+key_cache = LRUCache(max_items=db.env_int("KEY_CACHE_SIZE", 10000), ttl=KEY_CACHE_TTL)
+
+
+def hash_key(key):
+    return hashlib.sha256(key.encode()).digest()
+
+
+def key_prefix(key):
+    return key[:KEY_PREFIX_LENGTH]
+
+
+# The cache (and the notifications that invalidate it) go by the digest too,
+# so plaintext keys never leave the request that carried them.
+def cached_key_status(key):
+    """True/False if the key's validity is cached, None when the DB must be asked."""
+    pubsub.ensure_listener()
+    return key_cache.get(hash_key(key).hex())
+
+
+def remember_key(key, valid):
+    key_cache.set(
+        hash_key(key).hex(),
+        valid,
+        ttl=KEY_CACHE_TTL if valid else KEY_CACHE_NEGATIVE_TTL,
+    )
+
+
+def notify_key_changed(cursor, key_hash):
+    """Queue a cross-worker invalidation; Postgres delivers it on commit."""
+    pubsub.notify(cursor, KEYS_CHANNEL, bytes(key_hash).hex())
+
+
+def invalidate_key(key_hash):
+    key_cache.delete(bytes(key_hash).hex())
+
+
+def provision_keys(user_ids):
+    """Create keys for every user that doesn't have one, in one statement.
+    Returns {user_id: (api_key or None if it already existed, key_prefix)}."""
+    new_keys = {user_id: str(uuid.uuid4()) for user_id in user_ids}
+    args = []
+    for user_id, key in new_keys.items():
+        args += [user_id, hash_key(key), key_prefix(key)]
+    values = ", ".join(["(%s, %s, %s)"] * len(new_keys))
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        # As in /admin/generate-key: existing rows come back untouched, and
+        # xmax = 0 marks the ones this statement inserted.
+        c.execute(
+            f"""
+            INSERT INTO api_keys (user_id, key_hash, key_prefix) VALUES {values}
+            ON CONFLICT (user_id) DO UPDATE SET user_id = EXCLUDED.user_id
+            RETURNING user_id, key_hash, key_prefix, xmax = 0
+        """,
+            args,
+        )
+        rows = c.fetchall()
+        created = [bytes(key_hash) for _, key_hash, _, inserted in rows if inserted]
+        pubsub.notify_many(c, KEYS_CHANNEL, [h.hex() for h in created])
+        conn.commit()
+    for key_hash in created:
+        invalidate_key(key_hash)
+    return {
+        user_id: (new_keys[user_id] if inserted else None, prefix)
+        for user_id, _, prefix, inserted in rows
+    }
+
+
+def lookup_keys(user_ids):
+    """{user_id: key_prefix} for the users that have a key."""
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT user_id, key_prefix FROM api_keys WHERE user_id = ANY(%s)",
+            (list(user_ids),),
+        )
+        return dict(c.fetchall())
+
+
+def revoke_keys(user_ids):
+    """Delete the keys of the given users; returns the user ids that had one."""
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "DELETE FROM api_keys WHERE user_id = ANY(%s) RETURNING user_id, key_hash",
+            (list(user_ids),),
+        )
+        rows = c.fetchall()
+        pubsub.notify_many(
+            c, KEYS_CHANNEL, [bytes(key_hash).hex() for _, key_hash in rows]
+        )
+        conn.commit()
+    for _, key_hash in rows:
+        invalidate_key(key_hash)
+    return {user_id for user_id, _ in rows}
+
+
+def key_holders(after=None, limit=KEY_BULK_MAX):
+    """A page of user ids that have a key, in user_id order, after `after`."""
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT user_id FROM api_keys WHERE user_id > %s ORDER BY user_id LIMIT %s",
+            (after or "", limit),
+        )
+        return [row[0] for row in c.fetchall()]
+
+
+def _on_key_changed(payload):
+    if payload == "*":
+        key_cache.clear()
+    else:
+        key_cache.delete(payload)
+
+
+pubsub.subscribe(KEYS_CHANNEL, _on_key_changed, key_cache.clear)
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU with optional per-entry TTL and hit/miss counters.
+
+    With ``max_bytes`` set, entries are also evicted to keep the sum of
+    ``sizeof(value)`` under the budget (values bigger than the whole budget
+    are not stored at all)."""
+
+    def __init__(self, max_items=1024, ttl=None, max_bytes=None, sizeof=len):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires, size = item
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.bytes -= size
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        size = self.sizeof(value) if self.max_bytes else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            if self.max_bytes and size > self.max_bytes:
+                return
+            self._data[key] = (value, expires, size)
+            self.bytes += size
+            while len(self._data) > self.max_items or (
+                self.max_bytes and self.bytes > self.max_bytes
+            ):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                self.bytes -= item[2]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_items": self.max_items,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class SingleFlight:
+    """Coalesce concurrent async calls that share a key onto one in-flight call.
+
+    The call runs as its own task, so a caller that gets cancelled (say, its
+    client disconnected) doesn't take the result away from the others waiting
+    on it."""
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()  # event loop -> {key: task}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """Await fn() unless an identical call is already running; returns
+        (result, shared) where shared is True for callers that piggybacked."""
+        calls = self._calls.setdefault(asyncio.get_running_loop(), {})
+        task = calls.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: calls.pop(key, None))
+        return await asyncio.shield(task), shared
+
+    def in_flight(self):
+        return sum(len(calls) for calls in self._calls.values())
+
+
+class DiskCache:
+    """Byte-budgeted directory of immutable blobs, shared by every worker on the
+    box. Oldest files (by mtime) are pruned once the budget is exceeded."""
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, prune_every=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        try:
+            with open(self._file(key), "rb") as f:
+                value = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp, self._file(key))
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.startswith(".tmp-"):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
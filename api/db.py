@@ -0,0 +1,316 @@
+import os
+import threading
+import time
+import urllib.parse as up
+
+import psycopg2
+from psycopg2 import extensions
+
+
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _connect_kwargs():
+    db_url = os.environ.get("DATABASE_URL")
+    if not db_url:
+        raise Exception("DATABASE_URL not set")
+
+    up.uses_netloc.append("postgres")
+    url = up.urlparse(db_url)
+    return {
+        "database": url.path[1:],
+        "user": url.username,
+        "password": url.password,
+        "host": url.hostname,
+        "port": url.port,
+    }
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def _detach(conn):
+    """Point an inherited connection's socket at /dev/null. The socket is shared
+    with the parent process: closing the connection here, even from the garbage
+    collector, would send the parent's session a Terminate message."""
+    if conn.closed:
+        return
+    devnull = os.open(os.devnull, os.O_RDWR)
+    try:
+        os.dup2(devnull, conn.fileno())
+    finally:
+        os.close(devnull)
+
+
+class PooledConnection:
+    """Thin wrapper handed out by the pool. close() gives the connection back
+    instead of closing it, so existing ``conn.close()`` call sites keep working."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to pool")
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self._conn is not None and not self._conn.closed:
+            self._conn.rollback()
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(
+        self, minconn=1, maxconn=10, timeout=10, max_lifetime=1800, idle_check=30
+    ):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.idle_check = idle_check
+
+        self._kwargs = _connect_kwargs()
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, created_at, last_used)]
+        self._born = {}  # id(conn) -> (conn, created_at), for connections checked out
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._kwargs)
+        self._created += 1
+        return conn
+
+    def _discard(self, conn):
+        self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            self._forget_inherited()
+
+    def _forget_inherited(self):
+        # Connections inherited over a fork: detach them from the parent's
+        # sessions before letting go of them.
+        for conn, _, _ in self._idle:
+            _detach(conn)
+        for conn, _ in self._born.values():
+            _detach(conn)
+        self._pid = os.getpid()
+        self._idle = []
+        self._born = {}
+        self._in_use = 0
+        self._waiting = 0
+
+    def _healthy(self, conn, created, last_used, now):
+        if conn.closed:
+            return False
+        if self.max_lifetime and now - created > self.max_lifetime:
+            return False
+        if self.idle_check and now - last_used > self.idle_check:
+            try:
+                with conn.cursor() as c:
+                    c.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def getconn(self):
+        started = time.monotonic()
+        with self._cond:
+            self._check_fork()
+            if self._closed:
+                raise psycopg2.InterfaceError("connection pool is closed")
+
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"no database connection available after {self.timeout}s"
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._in_use += 1
+            item = self._idle.pop() if self._idle else None
+
+        waited = time.monotonic() - started
+        try:
+            now = time.monotonic()
+            while item is not None:
+                conn, created, last_used = item
+                if self._healthy(conn, created, last_used, now):
+                    break
+                self._discard(conn)
+                with self._cond:
+                    item = self._idle.pop() if self._idle else None
+            if item is None:
+                conn, created = self._connect(), now
+            else:
+                conn, created = item[0], item[1]
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._born[id(conn)] = (conn, created)
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return PooledConnection(self, conn)
+
+    def putconn(self, conn):
+        with self._cond:
+            self._check_fork()
+            conn, created = self._born.pop(id(conn), (conn, None))
+        if created is None:
+            # Not handed out by this process (checked out before a fork, and
+            # detached since): nothing to give back.
+            self._discard(conn)
+            return
+
+        keep = not conn.closed and not self._closed
+        if keep and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                keep = False
+        if (
+            keep
+            and self.max_lifetime
+            and time.monotonic() - created > self.max_lifetime
+        ):
+            keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, created, time.monotonic()))
+            self._cond.notify()
+        if not keep:
+            self._discard(conn)
+
+    def warm(self):
+        with self._cond:
+            missing = self.minconn - len(self._idle) - self._in_use
+        for _ in range(max(missing, 0)):
+            conn = self._connect()
+            with self._cond:
+                self._idle.append((conn, time.monotonic(), time.monotonic()))
+
+    def close(self):
+        with self._cond:
+            self._check_fork()
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pid": self._pid,
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "discarded": self._discarded,
+                "wait_avg_ms": (
+                    round(self._wait_total / self._checkouts * 1000, 3)
+                    if self._checkouts
+                    else 0.0
+                ),
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None or _pool._pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool._pid != os.getpid():
+                if _pool is not None:
+                    # Inherited over a fork. Its locks may be held by threads
+                    # that did not survive it, so start a new pool, without
+                    # taking them.
+                    _pool._forget_inherited()
+                _pool = ConnectionPool(
+                    minconn=env_int("DB_POOL_MIN", 1),
+                    maxconn=env_int("DB_POOL_MAX", 10),
+                    timeout=env_int("DB_POOL_TIMEOUT", 10),
+                    max_lifetime=env_int("DB_POOL_MAX_LIFETIME", 1800),
+                    idle_check=env_int("DB_POOL_IDLE_CHECK", 30),
+                )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def pool_stats():
+    if _pool is None or _pool._pid != os.getpid():
+        return {
+            "pid": os.getpid(),
+            "in_use": 0,
+            "idle": 0,
+            "waiting": 0,
+            "checkouts": 0,
+        }
+    return _pool.stats()
+
+
+def connect():
+    """Open a dedicated, unpooled connection (used for LISTEN sessions)."""
+    return psycopg2.connect(**_connect_kwargs())
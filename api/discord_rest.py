@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import mimetypes
+import weakref
+from collections import OrderedDict
+
+import aiohttp
+
+from .aio import background_loop
+from .db import env_int
+
+API_BASE = "https://discord.com/api/v10"
+TEXT_FILE_EXTENSIONS = [
+    ".txt",
+    ".js",
+    ".bat",
+    ".md",
+    ".csv",
+    ".log",
+    ".json",
+    ".yaml",
+    ".yml",
+    ".xml",
+    ".html",
+]
+ATTACHMENT_TEXT_MAX_BYTES = env_int("ATTACHMENT_TEXT_MAX_BYTES", 1024 * 1024)
+SESSION_CACHE_SIZE = env_int("DISCORD_SESSION_CACHE_SIZE", 32)
+TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5)
+
+
+class DiscordError(Exception):
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+class _LoopSessions:
+    """aiohttp sessions belong to one event loop, so each loop gets its own
+    bounded token -> session LRU plus one unauthenticated session for the CDN."""
+
+    def __init__(self):
+        self.by_token = OrderedDict()
+        self.cdn = None
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def for_token(self, token):
+        key = self._key(token)
+        session = self.by_token.get(key)
+        if session is not None and not session.closed:
+            self.by_token.move_to_end(key)
+            return session
+        session = aiohttp.ClientSession(
+            headers={
+                "Authorization": f"Bot {token}",
+                "User-Agent": "DiscordBot (https://api.loopy5418.dev, 1.0)",
+            },
+            timeout=TIMEOUT,
+        )
+        self.by_token[key] = session
+        while len(self.by_token) > SESSION_CACHE_SIZE:
+            _, evicted = self.by_token.popitem(last=False)
+            asyncio.get_running_loop().create_task(evicted.close())
+        return session
+
+    def forget(self, token):
+        session = self.by_token.pop(self._key(token), None)
+        if session is not None:
+            asyncio.get_running_loop().create_task(session.close())
+
+    def for_cdn(self):
+        if self.cdn is None or self.cdn.closed:
+            self.cdn = aiohttp.ClientSession(timeout=TIMEOUT)
+        return self.cdn
+
+    async def close(self):
+        sessions = list(self.by_token.values()) + ([self.cdn] if self.cdn else [])
+        self.by_token.clear()
+        self.cdn = None
+        await asyncio.gather(*(s.close() for s in sessions), return_exceptions=True)
+
+
+_sessions = weakref.WeakKeyDictionary()  # event loop -> _LoopSessions
+
+
+def loop_sessions():
+    loop = asyncio.get_running_loop()
+    sessions = _sessions.get(loop)
+    if sessions is None:
+        sessions = _sessions[loop] = _LoopSessions()
+    return sessions
+
+
+async def close_loop_sessions():
+    sessions = _sessions.pop(asyncio.get_running_loop(), None)
+    if sessions is not None:
+        await sessions.close()
+
+
+background_loop.on_shutdown(close_loop_sessions)
+
+
+async def _get_message(session, channel_id, message_id):
+    url = f"{API_BASE}/channels/{channel_id}/messages/{message_id}"
+    for attempt in range(2):
+        async with session.get(url) as resp:
+            if resp.status == 200:
+                return await resp.json()
+            if resp.status == 429 and attempt == 0:
+                retry_after = (await resp.json()).get("retry_after", 1)
+                if retry_after <= 2:
+                    await asyncio.sleep(retry_after)
+                    continue
+            if resp.status == 401:
+                raise DiscordError("Invalid bot token", 401)
+            if resp.status == 403:
+                raise DiscordError("Bot has no access to that channel", 403)
+            if resp.status == 404:
+                raise DiscordError("Channel or message not found", 404)
+            raise DiscordError(f"Discord API error: HTTP {resp.status}", 502)
+
+
+async def _read_text(session, url, max_bytes):
+    async with session.get(url) as resp:
+        if resp.status != 200:
+            return f"Failed to fetch content: HTTP {resp.status}"
+        buf = bytearray()
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            buf += chunk
+            if len(buf) > max_bytes:
+                return f"File too large to fetch (limit {max_bytes} bytes)"
+        return buf.decode(resp.charset or "utf-8", errors="replace")
+
+
+async def _attachment_info(session, attachment):
+    filename = attachment.get("filename", "")
+    info = {"filename": filename, "url": attachment.get("url")}
+    file_type, _ = mimetypes.guess_type(filename)
+    info["fileType"] = file_type if file_type else "unknown"
+
+    if any(filename.lower().endswith(ext) for ext in TEXT_FILE_EXTENSIONS):
+        if attachment.get("size", 0) > ATTACHMENT_TEXT_MAX_BYTES:
+            info["content"] = (
+                f"File too large to fetch (limit {ATTACHMENT_TEXT_MAX_BYTES} bytes)"
+            )
+        else:
+            try:
+                info["content"] = await _read_text(
+                    session, attachment["url"], ATTACHMENT_TEXT_MAX_BYTES
+                )
+            except Exception as e:
+                info["content"] = f"Error: {str(e)}"
+    return info
+
+
+async def fetch_message_attachments(bot_token, channel_id, message_id):
+    """One REST call for the message, then all text attachments in parallel."""
+    sessions = loop_sessions()
+    try:
+        message = await _get_message(
+            sessions.for_token(bot_token), channel_id, message_id
+        )
+    except aiohttp.ClientError as e:
+        raise DiscordError(f"Failed to reach Discord: {str(e)}", 502)
+    except DiscordError as e:
+        if e.status == 401:
+            # Don't let bad tokens occupy slots in the session cache.
+            sessions.forget(bot_token)
+        raise
+
+    cdn = sessions.for_cdn()
+    attachments = await asyncio.gather(
+        *(_attachment_info(cdn, a) for a in message.get("attachments", []))
+    )
+    return {"attachments": list(attachments), "success": True}
@@ -0,0 +1,249 @@
+import io
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+from . import upstream
+from .db import env_int
+
+MAX_IMAGE_BYTES = env_int("IMAGE_MAX_BYTES", 8 * 1024 * 1024)
+# Checked against the header before any pixel data is decoded.
+MAX_IMAGE_PIXELS = env_int("IMAGE_MAX_PIXELS", 40_000_000)
+# Larger images are decoded (JPEG) or reduced (everything else) down to this.
+MAX_IMAGE_SIDE = env_int("IMAGE_MAX_SIDE", 2048)
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of the formats we are willing to decode.
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class ImageError(ValueError):
+    pass
+
+
+def sniff_format(head):
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, fmt in SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return None
+
+
+def fetch_image(url, max_bytes=MAX_IMAGE_BYTES):
+    """Download an image, giving up as soon as it is clearly not an image or
+    grows past max_bytes, so a worker never buffers more than the cap."""
+    headers = {"User-Agent": "Mozilla/5.0 (compatible; ImageBot/1.0)"}
+    response = upstream.get("images", url, headers=headers, stream=True)
+    with response:
+        if response.status_code != 200:
+            raise ImageError(f"Failed to download image: HTTP {response.status_code}")
+        content_type = response.headers.get("Content-Type", "")
+        if not content_type.startswith("image/"):
+            raise ImageError(
+                f"URL did not return an image. Content-Type: {content_type}"
+            )
+        try:
+            declared = int(response.headers.get("Content-Length", 0))
+        except ValueError:
+            declared = 0
+        if declared > max_bytes:
+            raise ImageError("File too big!")
+
+        buf = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if not buf and sniff_format(chunk) is None:
+                raise ImageError(
+                    "URL did not return a supported image "
+                    "(PNG, JPEG, GIF, WEBP or BMP)."
+                )
+            buf += chunk
+            if len(buf) > max_bytes:
+                raise ImageError("File too big!")
+    return bytes(buf)
+
+
+def open_image(data, max_side=MAX_IMAGE_SIDE):
+    """Decode image bytes to RGBA, scaled so neither side exceeds max_side.
+
+    Returns (image, scale) where scale is new_size / original_size."""
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError:
+        raise ImageError("Image has too many pixels.")
+    except Exception:
+        raise ImageError("Could not read image.")
+
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageError("Image has too many pixels.")
+
+    scale = min(1.0, max_side / max(width, height))
+    if scale < 1.0:
+        target = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if image.format == "JPEG":
+            # Let libjpeg do the downscaling while decoding (1/2, 1/4, 1/8).
+            image.draft("RGB", target)
+        image.thumbnail(target, reducing_gap=2.0)
+        scale = image.size[0] / width
+
+    return image.convert("RGBA"), scale
+
+
+FONT_DIR = os.path.join(os.path.dirname(__file__), "templates", "static")
+FONT_FILES = {
+    "normal": "Roboto-Regular.ttf",
+    "bold": "Roboto-Bold.ttf",
+    "italic": "Roboto-Italic.ttf",
+    "bold-italic": "Roboto-BoldItalic.ttf",
+}
+PRELOAD_FONT_SIZES = (16, 24, 32, 48, 64, 96)
+MIN_FONT_SIZE, MAX_FONT_SIZE = 4, 512
+
+Layout = namedtuple("Layout", "lines offsets line_height width height")
+
+
+@lru_cache(maxsize=env_int("FONT_CACHE_SIZE", 64))
+def get_font(style, size):
+    """Load (once per process) the Roboto face for a style and pixel size."""
+    font_path = os.path.join(FONT_DIR, FONT_FILES.get(style, FONT_FILES["normal"]))
+    try:
+        return ImageFont.truetype(font_path, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def preload_fonts():
+    for style in FONT_FILES:
+        for size in PRELOAD_FONT_SIZES:
+            get_font(style, size)
+
+
+def _wrap(text, font, max_width):
+    lines = []
+    for paragraph in text.split("\n"):
+        if max_width is None:
+            lines.append(paragraph)
+            continue
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if not line or font.getlength(candidate) <= max_width:
+                line = candidate
+            else:
+                lines.append(line)
+                line = word
+        lines.append(line)
+    return lines
+
+
+@lru_cache(maxsize=env_int("TEXT_LAYOUT_CACHE_SIZE", 1024))
+def layout_text(
+    text, style, size, max_width=None, align="left", line_spacing=4, stroke_width=0
+):
+    """Wrap and measure text once; drawing then only needs the cached offsets."""
+    font = get_font(style, size)
+    lines = _wrap(text, font, max_width)
+    ascent, descent = font.getmetrics()
+    line_height = ascent + descent + line_spacing
+    widths = [font.getlength(line) + 2 * stroke_width for line in lines]
+    width = int(max(widths)) if widths else 0
+    if align == "center":
+        offsets = tuple(int((width - w) / 2) for w in widths)
+    elif align == "right":
+        offsets = tuple(int(width - w) for w in widths)
+    else:
+        offsets = (0,) * len(lines)
+    height = line_height * len(lines) - line_spacing + 2 * stroke_width
+    return Layout(tuple(lines), offsets, line_height, width, height)
+
+
+def resolve_position(position, layout, image_size):
+    width, height = image_size
+    if isinstance(position, str):
+        pos = position.lower().strip()
+        if pos == "top":
+            return ((width - layout.width) // 2, 10)
+        elif pos == "center":
+            return ((width - layout.width) // 2, (height - layout.height) // 2)
+        elif pos == "bottom":
+            return ((width - layout.width) // 2, height - layout.height - 10)
+        try:
+            x, y = map(int, pos.strip("() ").split(","))
+            return (x, y)
+        except ValueError:
+            return (10, 10)
+    if isinstance(position, (list, tuple)) and len(position) == 2:
+        try:
+            return (int(position[0]), int(position[1]))
+        except (TypeError, ValueError):
+            pass
+    return (10, 10)
+
+
+def draw_text(
+    image,
+    text,
+    position=(10, 10),
+    color="#FFFFFF",
+    font_size=32,
+    font_style="normal",
+    align="left",
+    max_width=None,
+    line_spacing=4,
+    stroke_width=0,
+    stroke_color="#000000",
+):
+    font_size = min(max(int(font_size), MIN_FONT_SIZE), MAX_FONT_SIZE)
+    font = get_font(font_style, font_size)
+    layout = layout_text(
+        text, font_style, font_size, max_width, align, line_spacing, stroke_width
+    )
+    x, y = resolve_position(position, layout, image.size)
+
+    draw = ImageDraw.Draw(image)
+    for line, offset in zip(layout.lines, layout.offsets):
+        draw.text(
+            (x + offset + stroke_width, y + stroke_width),
+            line,
+            fill=color,
+            font=font,
+            stroke_width=stroke_width,
+            stroke_fill=stroke_color,
+        )
+        y += layout.line_height
+    return image
+
+
+def render_text_image(image_bytes, text, **options):
+    """Decode, draw and PNG-encode in one call. Numeric positions and sizes are
+    in the original image's pixels and are scaled with it."""
+    image, scale = open_image(image_bytes)
+    if scale < 1.0:
+        for name in ("font_size", "max_width", "stroke_width"):
+            if isinstance(options.get(name), (int, float)):
+                options[name] = max(
+                    0 if name == "stroke_width" else 1, int(options[name] * scale)
+                )
+        position = options.get("position")
+        if (
+            isinstance(position, (list, tuple))
+            and len(position) == 2
+            and all(isinstance(p, (int, float)) for p in position)
+        ):
+            options["position"] = [int(p * scale) for p in position]
+
+    draw_text(image, text, **options)
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
@@ -0,0 +1,349 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+
+from .db import env_int
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; the last bucket is +Inf.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Most routes answer in well under 5 ms, so request latency gets finer buckets.
+REQUEST_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+# Anything else is counted as "OTHER", so odd methods can't mint new series.
+HTTP_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def _observe(key, value, buckets):
+    # Caller holds _lock.
+    hist = _histograms.get(key)
+    if hist is None:
+        hist = _histograms[key] = {
+            "buckets": buckets,
+            "counts": [0] * (len(buckets) + 1),
+            "sum": 0.0,
+            "count": 0,
+        }
+    hist["counts"][bisect_left(buckets, value)] += 1
+    hist["sum"] += value
+    hist["count"] += 1
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _observe(key, value, buckets)
+
+
+# Requests are appended here without taking _lock (deque.append is atomic) and
+# folded into the registry in batches: whenever it is read, or every
+# REQUEST_BATCH requests.
+REQUEST_BATCH = 1024
+_pending_requests = deque()
+# (route, method, status) -> (counter key, histogram key), so label tuples are
+# built once per series rather than once per request.
+_request_series = {}
+
+
+def observe_request(route, method, status, seconds):
+    """Count one HTTP request and record its latency."""
+    _pending_requests.append((route, method, status, seconds))
+    if len(_pending_requests) >= REQUEST_BATCH:
+        _fold_requests()
+
+
+def _fold_requests():
+    with _lock:
+        while _pending_requests:
+            route, method, status, seconds = _pending_requests.popleft()
+            if method not in HTTP_METHODS:
+                method = "OTHER"
+            series = _request_series.get((route, method, status))
+            if series is None:
+                series = _request_series[(route, method, status)] = (
+                    (
+                        "http_requests_total",
+                        (("method", method), ("route", route), ("status", str(status))),
+                    ),
+                    (
+                        "http_request_duration_seconds",
+                        (("method", method), ("route", route)),
+                    ),
+                )
+            _counters[series[0]] += 1
+            _observe(series[1], seconds, REQUEST_BUCKETS)
+
+
+def snapshot():
+    _fold_requests()
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {
+                k: {**v, "counts": list(v["counts"])} for k, v in _histograms.items()
+            },
+        }
+
+
+def quantile(hist, q):
+    """Estimate a quantile from bucket counts: the upper bound of the bucket it
+    falls in, or the largest finite bound when it lands in the overflow bucket."""
+    if not hist or not hist["count"]:
+        return None
+    target = q * hist["count"]
+    seen = 0
+    for bound, count in zip(hist["buckets"], hist["counts"]):
+        seen += count
+        if seen >= target:
+            return bound
+    return hist["buckets"][-1]
+
+
+# Cross-worker export. Each worker's registry is cumulative, so a worker simply
+# writes its whole snapshot over its previous one; /metrics adds them up.
+
+METRICS_DB = os.environ.get(
+    "METRICS_DB", os.path.join(tempfile.gettempdir(), "api-metrics.sqlite3")
+)
+METRICS_FLUSH_SECONDS = env_int("METRICS_FLUSH_SECONDS", 5)
+# Counters and histograms of exited workers are folded into this row.
+RETIRED = 0
+
+
+def _encode(snap):
+    return json.dumps(
+        {
+            "counters": [
+                [name, labels, value]
+                for (name, labels), value in snap["counters"].items()
+            ],
+            "gauges": [
+                [name, labels, value]
+                for (name, labels), value in snap["gauges"].items()
+            ],
+            "histograms": [
+                [name, labels, h["buckets"], h["counts"], h["sum"], h["count"]]
+                for (name, labels), h in snap["histograms"].items()
+            ],
+        }
+    )
+
+
+def _decode(blob):
+    data = json.loads(blob)
+    return {
+        "counters": {
+            (name, tuple(map(tuple, labels))): value
+            for name, labels, value in data["counters"]
+        },
+        "gauges": {
+            (name, tuple(map(tuple, labels))): value
+            for name, labels, value in data["gauges"]
+        },
+        "histograms": {
+            (name, tuple(map(tuple, labels))): {
+                "buckets": tuple(buckets),
+                "counts": counts,
+                "sum": total,
+                "count": count,
+            }
+            for name, labels, buckets, counts, total, count in data["histograms"]
+        },
+    }
+
+
+def _merge(into, snap, gauge_labels=()):
+    for key, value in snap["counters"].items():
+        into["counters"][key] = into["counters"].get(key, 0) + value
+    for (name, labels), value in snap["gauges"].items():
+        into["gauges"][(name, tuple(sorted(labels + gauge_labels)))] = value
+    for key, hist in snap["histograms"].items():
+        mine = into["histograms"].get(key)
+        if mine is None or mine["buckets"] != hist["buckets"]:
+            into["histograms"][key] = {**hist, "counts": list(hist["counts"])}
+        else:
+            mine["counts"] = [a + b for a, b in zip(mine["counts"], hist["counts"])]
+            mine["sum"] += hist["sum"]
+            mine["count"] += hist["count"]
+    return into
+
+
+def _empty():
+    return {"counters": {}, "gauges": {}, "histograms": {}}
+
+
+class MetricsStore:
+    """Worker snapshots in a local SQLite file (like the rate limiter's), so
+    /metrics on any worker reports totals for every worker on the box. Workers
+    flush every METRICS_FLUSH_SECONDS from a background thread; the request
+    path only ever touches the in-process registry above."""
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self._local = threading.local()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers "
+                "(pid INTEGER PRIMARY KEY, updated REAL, snapshot TEXT)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(
+                target=self._run, name="metrics-flusher", daemon=True
+            ).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Could not flush metrics: {e}")
+
+    def flush(self):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO workers (pid, updated, snapshot) VALUES (?, ?, ?)",
+            (os.getpid(), time.time(), _encode(snapshot())),
+        )
+
+    def collect(self):
+        """Every worker's metrics added up. Gauges are per worker, so they get
+        a `pid` label instead (and exited workers' gauges are dropped)."""
+        self.start()
+        self.flush()
+        merged = _empty()
+        for pid, blob in self._conn().execute("SELECT pid, snapshot FROM workers"):
+            _merge(
+                merged, _decode(blob), () if pid == RETIRED else (("pid", str(pid)),)
+            )
+        return merged
+
+    def retire(self, pid):
+        """Fold an exited worker's counters and histograms into the RETIRED row
+        so totals never go backwards. Called from the gunicorn master."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = dict(
+                conn.execute(
+                    "SELECT pid, snapshot FROM workers WHERE pid IN (?, ?)",
+                    (pid, RETIRED),
+                )
+            )
+            if pid in rows:
+                retired = _decode(rows[RETIRED]) if RETIRED in rows else _empty()
+                _merge(retired, {**_decode(rows[pid]), "gauges": {}})
+                conn.execute(
+                    "INSERT OR REPLACE INTO workers (pid, updated, snapshot) "
+                    "VALUES (?, ?, ?)",
+                    (RETIRED, time.time(), _encode(retired)),
+                )
+                conn.execute("DELETE FROM workers WHERE pid = ?", (pid,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def reset(self):
+        """Forget everything; the gunicorn master calls this once at startup."""
+        self._conn().execute("DELETE FROM workers")
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for _, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render_prometheus(snap):
+    """Prometheus text exposition format (0.0.4) for a snapshot."""
+    lines = []
+    for kind, series in (("counter", snap["counters"]), ("gauge", snap["gauges"])):
+        typed = set()
+        for (name, labels), value in sorted(series.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{_labels(labels)} {value}")
+    typed = set()
+    for (name, labels), hist in sorted(snap["histograms"].items()):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip(list(hist["buckets"]) + ["+Inf"], hist["counts"]):
+            cumulative += count
+            lines.append(
+                f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}"
+            )
+        lines.append(f"{name}_sum{_labels(labels)} {hist['sum']}")
+        lines.append(f"{name}_count{_labels(labels)} {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+store = MetricsStore(METRICS_DB, METRICS_FLUSH_SECONDS)
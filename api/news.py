@@ -0,0 +1,99 @@
+import threading
+from collections import namedtuple
+
+import markdown
+
+from . import db, pubsub
+
+NEWS_CHANNEL = "site_news_changed"
+
+# Clearing the news keeps the row (with NULL content) so the version only
+# ever goes up and Last-Modified stays meaningful.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS site_news (
+        id SERIAL PRIMARY KEY,
+        content TEXT
+    );
+    ALTER TABLE site_news ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+    ALTER TABLE site_news ADD COLUMN IF NOT EXISTS updated_at
+        TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
+"""
+
+News = namedtuple("News", "version content html updated_at")
+NO_NEWS = News(0, None, None, None)
+
+_current = None
+_generation = 0
+_lock = threading.Lock()
+loads = 0
+
+
+def _load():
+    global loads
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT version, content, updated_at FROM site_news WHERE id = 1")
+        row = c.fetchone()
+    loads += 1
+    if row is None:
+        return NO_NEWS
+    version, content, updated_at = row
+    return News(
+        version, content, markdown.markdown(content) if content else None, updated_at
+    )
+
+
+def current():
+    """The news as last saved, with its markdown already rendered. Only hits
+    the database after a change (or on a worker's first request)."""
+    global _current
+    pubsub.ensure_listener()
+    news = _current
+    if news is not None:
+        return news
+    with _lock:
+        if _current is None:
+            generation = _generation
+            news = _load()
+            # Don't keep what we read if a change landed while reading it.
+            if generation == _generation:
+                _current = news
+            return news
+        return _current
+
+
+def invalidate(payload=None):
+    global _current, _generation
+    with _lock:
+        _generation += 1
+        _current = None
+
+
+def save(content):
+    """Replace the news (empty content clears it) and tell every worker."""
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            INSERT INTO site_news (id, content) VALUES (1, %s)
+            ON CONFLICT (id) DO UPDATE
+            SET content = EXCLUDED.content,
+                version = site_news.version + 1,
+                updated_at = NOW()
+            RETURNING version
+        """,
+            (content or None,),
+        )
+        version = c.fetchone()[0]
+        pubsub.notify(c, NEWS_CHANNEL, str(version))
+        conn.commit()
+    invalidate()
+    return version
+
+
+def stats():
+    news = _current
+    return {"version": news.version if news else None, "loads": loads}
+
+
+pubsub.subscribe(NEWS_CHANNEL, invalidate, invalidate)
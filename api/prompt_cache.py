@@ -0,0 +1,81 @@
+import hashlib
+import json
+import unicodedata
+
+from . import metrics
+from .cache import LRUCache, SingleFlight
+from .db import env_int
+
+PROMPT_CACHE_TTL = env_int("PROMPT_CACHE_TTL", 3600)
+
+prompt_cache = LRUCache(
+    max_items=env_int("PROMPT_CACHE_MAX_ITEMS", 10000),
+    ttl=PROMPT_CACHE_TTL,
+    max_bytes=env_int("PROMPT_CACHE_MAX_BYTES", 16 * 1024 * 1024),
+)
+in_flight = SingleFlight()
+bypassed = 0
+
+
+def normalize_prompt(prompt):
+    # Bot commands and retries differ only in spacing or Unicode form; the
+    # wording and case still matter to the model, so those are kept.
+    return " ".join(unicodedata.normalize("NFC", prompt).split())
+
+
+def cache_key(model, prompt):
+    return hashlib.sha256(f"{model}\0{normalize_prompt(prompt)}".encode()).hexdigest()
+
+
+def get(key):
+    encoded = prompt_cache.get(key)
+    return None if encoded is None else json.loads(encoded)
+
+
+def put(key, result):
+    # Stored serialized so the byte budget counts what the entry really costs.
+    prompt_cache.set(key, json.dumps(result, separators=(",", ":")).encode())
+
+
+async def get_or_fetch(key, fetch):
+    """Return (result, outcome) where outcome is 'hit', 'coalesced' or 'miss'.
+
+    fetch() must return (result, cacheable); only cacheable results are
+    stored, but every waiter on the same in-flight call gets the result."""
+    result = get(key)
+    if result is not None:
+        metrics.inc("prompt_cache_requests_total", outcome="hit")
+        return result, "hit"
+
+    async def fetch_and_store():
+        result, cacheable = await fetch()
+        if cacheable:
+            put(key, result)
+        return result
+
+    result, shared = await in_flight.do(key, fetch_and_store)
+    outcome = "coalesced" if shared else "miss"
+    metrics.inc("prompt_cache_requests_total", outcome=outcome)
+    return result, outcome
+
+
+def record_bypass():
+    global bypassed
+    bypassed += 1
+    metrics.inc("prompt_cache_requests_total", outcome="bypass")
+
+
+def stats():
+    memory = prompt_cache.stats()
+    hits, coalesced, misses = memory["hits"], in_flight.coalesced, in_flight.leaders
+    served = hits + coalesced + misses
+    return {
+        **memory,
+        "misses": misses,
+        "coalesced": coalesced,
+        "bypassed": bypassed,
+        "in_flight": in_flight.in_flight(),
+        # Share of cacheable requests that never reached pollinations.
+        "hit_ratio": round((hits + coalesced) / served, 4) if served else 0.0,
+        "ttl": PROMPT_CACHE_TTL,
+    }
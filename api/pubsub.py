@@ -0,0 +1,89 @@
+import logging
+import os
+import select
+import threading
+import time
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+# channel -> (on_message(payload), on_reset()). Subscribe at import time: the
+# listener LISTENs on whatever is registered when it (re)connects.
+_subscribers = {}
+
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def subscribe(channel, on_message, on_reset):
+    """Call on_message(payload) for every NOTIFY on `channel`, in every worker.
+    on_reset() runs whenever the listener (re)connects, since anything sent
+    while it was not listening was missed."""
+    _subscribers[channel] = (on_message, on_reset)
+
+
+def notify(cursor, channel, payload=""):
+    """Queue a cross-worker message; Postgres delivers it on commit."""
+    cursor.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+
+
+def notify_many(cursor, channel, payloads):
+    """notify() for a list of payloads, in one round-trip."""
+    if payloads:
+        cursor.execute(
+            "SELECT pg_notify(%s, p) FROM unnest(%s::text[]) AS p",
+            (channel, list(payloads)),
+        )
+
+
+def _reset_all():
+    for _, on_reset in list(_subscribers.values()):
+        on_reset()
+
+
+def _listen_forever():
+    backoff = 1
+    while True:
+        conn = None
+        try:
+            conn = db.connect()
+            conn.autocommit = True
+            with conn.cursor() as c:
+                for channel in list(_subscribers):
+                    c.execute(f"LISTEN {channel}")
+            _reset_all()
+            backoff = 1
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    message = conn.notifies.pop(0)
+                    handlers = _subscribers.get(message.channel)
+                    if handlers:
+                        handlers[0](message.payload)
+        except Exception as e:
+            logger.warning(f"Notification listener disconnected: {e}")
+            _reset_all()
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+
+def ensure_listener():
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        threading.Thread(
+            target=_listen_forever, name="pg-listener", daemon=True
+        ).start()
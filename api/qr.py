@@ -0,0 +1,116 @@
+import hashlib
+import io
+import json
+import os
+
+import qrcode
+import qrcode.image.svg
+from qrcode.exceptions import DataOverflowError
+from qrcode.constants import (
+    ERROR_CORRECT_H,
+    ERROR_CORRECT_L,
+    ERROR_CORRECT_M,
+    ERROR_CORRECT_Q,
+)
+
+from .cache import DiskCache, LRUCache
+from .db import env_int
+from .render_pool import render_pool
+
+ERROR_CORRECTION = {
+    "L": ERROR_CORRECT_L,
+    "M": ERROR_CORRECT_M,
+    "Q": ERROR_CORRECT_Q,
+    "H": ERROR_CORRECT_H,
+}
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+qr_cache = LRUCache(
+    max_items=100000, max_bytes=env_int("QR_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+)
+qr_disk_cache = (
+    DiskCache(
+        os.environ["QR_CACHE_DIR"],
+        env_int("QR_DISK_CACHE_MAX_BYTES", 256 * 1024 * 1024),
+    )
+    if os.environ.get("QR_CACHE_DIR")
+    else None
+)
+
+
+def parse_options(args):
+    """Read size/error_correction/border/format from query args, raising ValueError."""
+    try:
+        size = int(args.get("size", 10))
+        border = int(args.get("border", 4))
+    except ValueError:
+        raise ValueError("'size' and 'border' must be integers.")
+    if not 1 <= size <= 50:
+        raise ValueError("'size' must be between 1 and 50.")
+    if not 0 <= border <= 20:
+        raise ValueError("'border' must be between 0 and 20.")
+
+    error_correction = args.get("error_correction", "M").upper()
+    if error_correction not in ERROR_CORRECTION:
+        raise ValueError("'error_correction' must be one of L, M, Q, H.")
+
+    fmt = args.get("format", "png").lower()
+    if fmt not in FORMATS:
+        raise ValueError("'format' must be 'png' or 'svg'.")
+
+    return {
+        "size": size,
+        "border": border,
+        "error_correction": error_correction,
+        "format": fmt,
+    }
+
+
+def cache_key(data, options):
+    normalized = json.dumps(
+        {"data": data, **options}, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def render(data, size=10, border=4, error_correction="M", format="png"):
+    qr = qrcode.QRCode(
+        error_correction=ERROR_CORRECTION[error_correction],
+        box_size=size,
+        border=border,
+    )
+    qr.add_data(data)
+    try:
+        qr.make(fit=True)
+    except ValueError:
+        # With fit=True, qrcode runs past version 40 instead of raising this.
+        raise DataOverflowError("Too much data for a QR code")
+    buf = io.BytesIO()
+    if format == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buf)
+    else:
+        qr.make_image().save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def get_or_render(data, options):
+    """Return (etag, body, mimetype), rendering only on a cache miss."""
+    key = cache_key(data, options)
+    body = qr_cache.get(key)
+    if body is None and qr_disk_cache is not None:
+        body = qr_disk_cache.get(key)
+        if body is not None:
+            qr_cache.set(key, body)
+    if body is None:
+        body = render_pool.run("qr", render, data, **options)
+        qr_cache.set(key, body)
+        if qr_disk_cache is not None:
+            qr_disk_cache.set(key, body)
+    return f'"{key}"', body, FORMATS[options["format"]]
+
+
+def stats():
+    result = {"memory": qr_cache.stats()}
+    if qr_disk_cache is not None:
+        result["disk"] = qr_disk_cache.stats()
+    return result
@@ -0,0 +1,193 @@
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from .db import env_int
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_rate(value, default):
+    # "30/60" -> bucket of 30 tokens refilled over 60 seconds
+    if value is None:
+        return default
+    try:
+        count, seconds = value.split("/")
+        count, seconds = int(count), float(seconds)
+    except ValueError:
+        count = seconds = 0
+    if count <= 0 or seconds <= 0:
+        # A zero rate would never refill (and divides by zero in hit()).
+        logger.warning(
+            f"Ignoring rate limit {value!r}: expected <count>/<seconds>, both > 0"
+        )
+        return default
+    return count, count / seconds
+
+
+# route class -> (bucket capacity, tokens refilled per second)
+ROUTE_CLASSES = {
+    "cheap": _parse_rate(os.environ.get("RATE_LIMIT_CHEAP"), (120, 2.0)),
+    "upstream": _parse_rate(os.environ.get("RATE_LIMIT_UPSTREAM"), (30, 0.5)),
+    "cpu": _parse_rate(os.environ.get("RATE_LIMIT_CPU"), (10, 10 / 60)),
+}
+DAILY_QUOTA = env_int("DAILY_QUOTA", 10000)
+
+
+def _seconds_until_midnight(now):
+    return 86400 - int(now) % 86400
+
+
+class RateLimiter:
+    """Token buckets and daily quotas kept in a local SQLite file, so every
+    gunicorn worker on the box sees the same numbers without touching Postgres."""
+
+    def __init__(self, path, route_classes, daily_quota):
+        self.path = path
+        self.route_classes = route_classes
+        self.daily_quota = daily_quota
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._last_day = None
+        self.allowed = {name: 0 for name in route_classes}
+        self.limited = {name: 0 for name in route_classes}
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT, route_class TEXT, tokens REAL, updated REAL, "
+                "PRIMARY KEY (key, route_class))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS quotas ("
+                "key TEXT, day TEXT, used INTEGER, PRIMARY KEY (key, day))"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def hit(self, key, route_class, cost=1):
+        """Charge `cost` tokens. A call goes through as long as one token is
+        left, so a batch bigger than the bucket still can: the bucket goes
+        negative and later calls wait until it has refilled past zero."""
+        capacity, rate = self.route_classes[route_class]
+        now = time.time()
+        day = datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%d")
+        result = {
+            "allowed": True,
+            "limit": capacity,
+            "remaining": capacity,
+            "reset": 0,
+            "retry_after": 0,
+            "quota_limit": self.daily_quota,
+            "quota_remaining": self.daily_quota,
+            "quota_reset": _seconds_until_midnight(now),
+        }
+
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._last_day != day:
+                    conn.execute("DELETE FROM quotas WHERE day < ?", (day,))
+                    conn.execute(
+                        "DELETE FROM buckets WHERE updated < ?", (now - 86400,)
+                    )
+                    self._last_day = day
+
+                row = conn.execute(
+                    "SELECT tokens, updated FROM buckets "
+                    "WHERE key = ? AND route_class = ?",
+                    (key, route_class),
+                ).fetchone()
+                tokens = (
+                    capacity
+                    if row is None
+                    else min(capacity, row[0] + (now - row[1]) * rate)
+                )
+                row = conn.execute(
+                    "SELECT used FROM quotas WHERE key = ? AND day = ?", (key, day)
+                ).fetchone()
+                used = row[0] if row else 0
+
+                if used + cost > self.daily_quota:
+                    result["allowed"] = False
+                    result["retry_after"] = result["quota_reset"]
+                elif tokens < 1:
+                    result["allowed"] = False
+                    result["retry_after"] = math.ceil((1 - tokens) / rate)
+                else:
+                    tokens -= cost
+                    used += cost
+                    conn.execute(
+                        "INSERT INTO quotas (key, day, used) VALUES (?, ?, ?) "
+                        "ON CONFLICT (key, day) "
+                        "DO UPDATE SET used = used + excluded.used",
+                        (key, day, cost),
+                    )
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets "
+                    "(key, route_class, tokens, updated) VALUES (?, ?, ?, ?)",
+                    (key, route_class, tokens, now),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # Fail open: a broken limiter must not take the API down with it.
+            logger.warning(f"Rate limiter unavailable: {e}")
+            return result
+
+        result["remaining"] = max(int(tokens), 0)
+        result["reset"] = math.ceil((capacity - tokens) / rate)
+        result["quota_remaining"] = max(self.daily_quota - used, 0)
+        with self._lock:
+            counter = self.allowed if result["allowed"] else self.limited
+            counter[route_class] += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "classes": {
+                    name: {"capacity": capacity, "per_second": round(rate, 4)}
+                    for name, (capacity, rate) in self.route_classes.items()
+                },
+                "daily_quota": self.daily_quota,
+                "allowed": dict(self.allowed),
+                "limited": dict(self.limited),
+            }
+
+
+def headers_for(result):
+    headers = {
+        "X-RateLimit-Limit": str(result["limit"]),
+        "X-RateLimit-Remaining": str(result["remaining"]),
+        "X-RateLimit-Reset": str(result["reset"]),
+        "X-Quota-Limit": str(result["quota_limit"]),
+        "X-Quota-Remaining": str(result["quota_remaining"]),
+        "X-Quota-Reset": str(result["quota_reset"]),
+    }
+    if not result["allowed"]:
+        headers["Retry-After"] = str(result["retry_after"])
+    return headers
+
+
+limiter = RateLimiter(
+    os.environ.get(
+        "RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "api-ratelimit.sqlite3")
+    ),
+    ROUTE_CLASSES,
+    DAILY_QUOTA,
+)
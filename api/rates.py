@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+
+from . import upstream
+from .db import env_int
+
+logger = logging.getLogger(__name__)
+
+RATES_URL = "https://api.frankfurter.app/latest"
+# Frankfurter publishes once per business day; checking hourly catches the
+# new table soon after it appears without putting any request on the hot path.
+REFRESH_SECONDS = env_int("RATES_REFRESH_SECONDS", 3600)
+
+
+class UnsupportedCurrency(ValueError):
+    pass
+
+
+class RateTable:
+    def __init__(self, refresh_seconds=REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.rates = None  # currency -> units per 1 EUR
+        self.date = None
+        self.fetched_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self):
+        resp = upstream.get("frankfurter", RATES_URL)
+        resp.raise_for_status()
+        data = resp.json()
+        rates = {k.upper(): float(v) for k, v in data["rates"].items()}
+        rates[data["base"].upper()] = 1.0
+        with self._lock:
+            self.rates = rates
+            self.date = data["date"]
+            self.fetched_at = time.time()
+            self.last_error = None
+
+    def _refresh_in_background(self):
+        try:
+            self._fetch()
+        except Exception as e:
+            # Keep serving the old table; try again on the next request.
+            logger.warning(f"Exchange rate refresh failed: {e}")
+            self.last_error = str(e)
+        finally:
+            self._refreshing = False
+
+    def ensure_fresh(self):
+        """Return the current table, fetching synchronously only if there is none."""
+        if self.rates is None:
+            self._fetch()
+        elif (
+            time.time() - self.fetched_at > self.refresh_seconds
+            and not self._refreshing
+        ):
+            with self._lock:
+                if self._refreshing:
+                    return self
+                self._refreshing = True
+            threading.Thread(
+                target=self._refresh_in_background, name="rates-refresh", daemon=True
+            ).start()
+        return self
+
+    @property
+    def age(self):
+        return int(time.time() - self.fetched_at) if self.fetched_at else None
+
+    @property
+    def stale(self):
+        return (
+            self.fetched_at is not None
+            and time.time() - self.fetched_at > self.refresh_seconds
+        )
+
+    def rate(self, base, target):
+        rates = self.rates
+        for currency in (base, target):
+            if currency not in rates:
+                raise UnsupportedCurrency(f"Unsupported currency: {currency}")
+        return rates[target] / rates[base]
+
+    def currencies(self):
+        return sorted(self.rates)
+
+
+rate_table = RateTable()
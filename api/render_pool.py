@@ -0,0 +1,171 @@
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import threading
+import time
+
+from . import imaging, metrics
+from .db import env_int
+
+RENDER_PROCESSES = env_int("RENDER_PROCESSES", 2)
+RENDER_QUEUE_MAX = env_int("RENDER_QUEUE_MAX", 8)
+RENDER_TIMEOUT = env_int("RENDER_TIMEOUT", 20)
+
+
+class RenderBusy(Exception):
+    """The render queue is full; the caller should answer 503 with retry_after."""
+
+    def __init__(self, retry_after):
+        super().__init__("Render queue is full")
+        self.retry_after = retry_after
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+class RenderPool:
+    """Bounded process pool for Pillow/qrcode work, so CPU-heavy requests run
+    outside the request worker and cannot hold its GIL."""
+
+    def __init__(
+        self,
+        processes=RENDER_PROCESSES,
+        queue_max=RENDER_QUEUE_MAX,
+        timeout=RENDER_TIMEOUT,
+    ):
+        self.processes = processes
+        self.queue_max = queue_max
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.avg_seconds = 0.0
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            # forkserver: children never inherit this process's threads or locks.
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["api.imaging", "api.qr"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=context,
+                initializer=imaging.preload_fonts,
+            )
+            self._pid = os.getpid()
+        return self._executor
+
+    def _job_done(self, job, started):
+        def callback(future):
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+                self.avg_seconds = (
+                    elapsed
+                    if not self.avg_seconds
+                    else 0.8 * self.avg_seconds + 0.2 * elapsed
+                )
+                metrics.set_gauge("render_queue_depth", self.pending)
+            metrics.observe("render_job_seconds", elapsed, job=job)
+
+        return callback
+
+    def run(self, job, fn, *args, **kwargs):
+        with self._lock:
+            if self.pending >= self.queue_max:
+                self.rejected += 1
+                metrics.inc("render_rejected_total", job=job)
+                # Time for the processes to drain what is already queued.
+                raise RenderBusy(
+                    retry_after=max(
+                        1, math.ceil(self.avg_seconds * self.pending / self.processes)
+                    )
+                )
+            self.pending += 1
+            metrics.set_gauge("render_queue_depth", self.pending)
+            executor = self._get_executor()
+
+        started = time.monotonic()
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+                # A crashed child leaves the executor broken; start over next time.
+                self._executor = None
+            raise
+        future.add_done_callback(self._job_done(job, started))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            metrics.inc("render_timeouts_total", job=job)
+            if not future.cancel():
+                # Already running: cancel() can't stop it, and the child would
+                # keep its CPU and its queue slot. Kill it with the pool.
+                self._recycle(executor)
+            raise RenderTimeout(f"Rendering took longer than {self.timeout}s")
+        except concurrent.futures.process.BrokenProcessPool:
+            with self._lock:
+                self._executor = None
+            raise
+
+    def _recycle(self, executor):
+        """Replace `executor` with a fresh pool and terminate its children. The
+        executor doesn't say which child runs which job, so other jobs still
+        running on it fail with BrokenProcessPool; their slots are freed by
+        the done callbacks either way."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        snap = metrics.snapshot()["histograms"]
+        jobs = {
+            dict(labels)["job"]: {
+                "count": hist["count"],
+                "avg_ms": (
+                    round(hist["sum"] / hist["count"] * 1000, 2)
+                    if hist["count"]
+                    else 0.0
+                ),
+                "p95": metrics.quantile(hist, 0.95),
+            }
+            for (name, labels), hist in snap.items()
+            if name == "render_job_seconds"
+        }
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "queue_depth": self.pending,
+                "queue_max": self.queue_max,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "avg_job_ms": round(self.avg_seconds * 1000, 2),
+                "jobs": jobs,
+            }
+
+
+render_pool = RenderPool()
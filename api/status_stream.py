@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import threading
+
+from . import metrics, sysmon
+from .db import env_int
+
+# Per worker. Under gunicorn's threaded WSGI workers every open stream holds a
+# request thread, so the default is small; asgi.py raises it, since there a
+# stream is just a coroutine. Viewers past the cap are not refused: they get
+# one sample per request instead (see StatusBroadcaster.poll).
+STATUS_STREAM_MAX = env_int("STATUS_STREAM_MAX", 2)
+# Comment lines sent when there is nothing new, so proxies keep the connection
+# open and dead clients are noticed on the next write.
+STATUS_STREAM_HEARTBEAT_SECONDS = env_int("STATUS_STREAM_HEARTBEAT_SECONDS", 15)
+# How long EventSource waits before reconnecting.
+STATUS_STREAM_RETRY_MS = env_int("STATUS_STREAM_RETRY_MS", 5000)
+
+HEARTBEAT = b": heartbeat\n\n"
+
+
+def snapshot(sample):
+    """The status page's view of a sampler sample."""
+    return {
+        "healthy": True,
+        "worker": os.getpid(),
+        **{k: v for k, v in sample.items() if k != "workers"},
+        **sysmon.STATIC,
+    }
+
+
+def encode(sample):
+    data = json.dumps(snapshot(sample))
+    return f"id: {sample['sampled_at']}\nevent: status\ndata: {data}\n\n".encode()
+
+
+class StatusBroadcaster:
+    """Fans the sampler's samples out to every open /status/stream.
+
+    The sampler thread is the only producer: each sample is encoded once and
+    stored as `latest`, then every subscriber's event is set on its own loop.
+    Subscribers always send the newest frame, so a slow client skips samples
+    instead of queueing them."""
+
+    def __init__(
+        self, max_streams=STATUS_STREAM_MAX, heartbeat=STATUS_STREAM_HEARTBEAT_SECONDS
+    ):
+        self.max_streams = max_streams
+        self.heartbeat = heartbeat
+        self.latest = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._published = 0
+        self._open = 0
+        self._polled = 0
+        self._registered = False
+
+    def start(self):
+        with self._lock:
+            if not self._registered:
+                self._registered = True
+                sysmon.sampler.on_sample(self.publish)
+        sysmon.sampler.start()
+
+    def publish(self, sample):
+        frame = encode(sample)
+        with self._lock:
+            self.latest = frame
+            self._published += 1
+            subscribers = list(self._subscribers)
+        for loop, event in subscribers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop already closed; its stream is going away.
+                pass
+
+    def open(self):
+        """Reserve a stream slot; None if all max_streams are taken."""
+        with self._lock:
+            if self._open >= self.max_streams:
+                return None
+            self._open += 1
+        self.start()
+        metrics.inc("status_streams_opened_total")
+        return StatusStream(self)
+
+    def poll(self):
+        """A complete response body for a viewer that found every slot taken:
+        the newest sample, after which EventSource reconnects on its own once
+        the retry interval is up. The viewer ends up polling the same URL."""
+        with self._lock:
+            self._polled += 1
+        metrics.inc("status_streams_polled_total")
+        return f"retry: {STATUS_STREAM_RETRY_MS}\n\n".encode() + (
+            self.latest or encode(sysmon.sampler.latest())
+        )
+
+    def _release(self):
+        with self._lock:
+            self._open -= 1
+
+    async def frames(self):
+        """SSE frames for one client: the newest sample straight away, then
+        each new one as it is published, with heartbeats in between."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            yield f"retry: {STATUS_STREAM_RETRY_MS}\n\n".encode()
+            yield self.latest or encode(sysmon.sampler.latest())
+            event = subscriber[1]
+            while True:
+                try:
+                    await asyncio.wait_for(event.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+                    continue
+                event.clear()
+                yield self.latest
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def stats(self):
+        return {
+            "streams": self._open,
+            "max_streams": self.max_streams,
+            "published": self._published,
+            "polled": self._polled,
+        }
+
+
+class StatusStream:
+    """A response body for one client. Holds its slot until closed, even if the
+    server closes it before the first frame was ever pulled (a plain async
+    generator would skip its finally block then)."""
+
+    def __init__(self, broadcaster):
+        self._broadcaster = broadcaster
+        self._frames = broadcaster.frames()
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._frames.__anext__()
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            self._broadcaster._release()
+        await self._frames.aclose()
+
+
+broadcaster = StatusBroadcaster()
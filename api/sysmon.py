@@ -0,0 +1,170 @@
+import logging
+import os
+import platform
+import threading
+import time
+from collections import deque
+
+import psutil
+
+from .db import env_int
+
+logger = logging.getLogger(__name__)
+
+SYSINFO_SAMPLE_SECONDS = env_int("SYSINFO_SAMPLE_SECONDS", 2)
+# Ring buffer length: an hour of history at the default interval.
+SYSINFO_HISTORY_SAMPLES = env_int("SYSINFO_HISTORY_SAMPLES", 1800)
+SYSINFO_HISTORY_MAX_POINTS = 500
+
+# Numeric fields averaged when a history series is downsampled.
+SERIES_FIELDS = (
+    "cpu_usage_percent",
+    "ram_used_percent",
+    "disk_used_percent",
+    "load_1",
+    "workers_rss_mb",
+)
+
+STATIC = {
+    "cpu_cores": psutil.cpu_count(logical=False),
+    "cpu_threads": psutil.cpu_count(logical=True),
+    "platform": platform.system(),
+    "platform_release": platform.release(),
+    "python_version": platform.python_version(),
+}
+
+
+def _workers():
+    """This process and its sibling workers, when running under gunicorn."""
+    me = psutil.Process()
+    try:
+        parent = me.parent()
+        if parent is not None and "gunicorn" in " ".join(parent.cmdline()):
+            return parent.children()
+    except psutil.Error:
+        pass
+    return [me]
+
+
+def take_sample():
+    # cpu_percent(None) is the average since the previous call, i.e. over one
+    # sampling interval; it never blocks.
+    ram = psutil.virtual_memory()
+    disk = psutil.disk_usage("/")
+    load_1, load_5, load_15 = psutil.getloadavg()
+    workers = []
+    for proc in _workers():
+        try:
+            workers.append(
+                {"pid": proc.pid, "rss_mb": round(proc.memory_info().rss / 1024**2, 1)}
+            )
+        except psutil.Error:
+            continue
+    return {
+        "sampled_at": time.time(),
+        "cpu_usage_percent": psutil.cpu_percent(interval=None),
+        "ram_total_mb": round(ram.total / 1024**2),
+        "ram_used_mb": round(ram.used / 1024**2),
+        "ram_used_percent": ram.percent,
+        "disk_total_gb": round(disk.total / 1024**3),
+        "disk_used_gb": round(disk.used / 1024**3),
+        "disk_used_percent": disk.percent,
+        "load_1": round(load_1, 2),
+        "load_5": round(load_5, 2),
+        "load_15": round(load_15, 2),
+        "uptime_seconds": int(time.time() - psutil.boot_time()),
+        "workers": workers,
+        "workers_rss_mb": round(sum(w["rss_mb"] for w in workers), 1),
+    }
+
+
+class Sampler:
+    """Samples the machine every `interval` seconds from a daemon thread
+    (one per worker process) into a fixed-size ring buffer, so requests only
+    ever read what is already there."""
+
+    def __init__(self, interval=SYSINFO_SAMPLE_SECONDS, size=SYSINFO_HISTORY_SAMPLES):
+        self.interval = interval
+        self.samples = deque(maxlen=size)
+        self._pid = None
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.samples.clear()
+            # Prime cpu_percent so the first real sample covers one interval.
+            psutil.cpu_percent(interval=None)
+            threading.Thread(
+                target=self._run, name="sysinfo-sampler", daemon=True
+            ).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                sample = take_sample()
+            except Exception as e:
+                logger.warning(f"System sampler failed: {e}")
+                continue
+            self.samples.append(sample)
+            for listener in list(self._listeners):
+                try:
+                    listener(sample)
+                except Exception as e:
+                    logger.warning(f"System sample listener failed: {e}")
+
+    def on_sample(self, listener):
+        """Call listener(sample) from the sampler thread after every sample."""
+        self._listeners.append(listener)
+
+    def latest(self):
+        self.start()
+        try:
+            return self.samples[-1]
+        except IndexError:
+            # Nothing sampled yet in this worker: take one now (its CPU figure
+            # covers the time since start() primed it).
+            return take_sample()
+
+    def history(self, window, points):
+        """Samples from the last `window` seconds, averaged into at most
+        `points` evenly spaced buckets, oldest first."""
+        self.start()
+        now = time.time()
+        since = now - window
+        samples = [s for s in list(self.samples) if s["sampled_at"] >= since]
+        width = window / points
+        buckets = {}
+        for sample in samples:
+            buckets.setdefault(
+                min(int((sample["sampled_at"] - since) / width), points - 1), []
+            ).append(sample)
+        series = []
+        for index in sorted(buckets):
+            group = buckets[index]
+            point = {
+                "t": round(since + (index + 0.5) * width, 3),
+                "samples": len(group),
+            }
+            for field in SERIES_FIELDS:
+                point[field] = round(sum(s[field] for s in group) / len(group), 2)
+            point["cpu_usage_percent_max"] = max(s["cpu_usage_percent"] for s in group)
+            series.append(point)
+        return series
+
+    def stats(self):
+        return {
+            "interval_seconds": self.interval,
+            "samples": len(self.samples),
+            "capacity": self.samples.maxlen,
+            "running": self._pid == os.getpid(),
+        }
+
+
+sampler = Sampler()
@@ -0,0 +1,432 @@
+import asyncio
+import contextlib
+import json
+import random
+import threading
+import time
+import weakref
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .aio import background_loop
+from .db import env_int
+
+RETRY_STATUSES = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class UpstreamBusy(requests.RequestException):
+    """Raised when an upstream already has max_concurrency requests in flight."""
+
+
+class AsyncResponse:
+    """The parts of requests.Response the route handlers use, with the body
+    already read so it can outlive the aiohttp connection."""
+
+    def __init__(self, status_code, headers, content, encoding, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding or "utf-8"
+        self.url = url
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(
+                f"{self.status_code} Error for url: {self.url}", response=self
+            )
+
+
+# aiohttp only tells connect and read timeouts apart from 3.10 on.
+_CONNECT_TIMEOUT_ERRORS = (aiohttp.ClientConnectorError,) + (
+    (aiohttp.ConnectionTimeoutError,)
+    if hasattr(aiohttp, "ConnectionTimeoutError")
+    else ()
+)
+
+
+def _as_requests_error(e):
+    """Map aiohttp errors onto the requests exceptions handlers already catch."""
+    if isinstance(e, _CONNECT_TIMEOUT_ERRORS):
+        return (
+            requests.ConnectTimeout(str(e))
+            if isinstance(e, asyncio.TimeoutError)
+            else requests.ConnectionError(str(e))
+        )
+    if isinstance(e, asyncio.TimeoutError):
+        return requests.ReadTimeout(str(e) or "Read timed out")
+    return requests.ConnectionError(str(e))
+
+
+class _LoopState:
+    """aiohttp sessions and asyncio semaphores are tied to one event loop."""
+
+    def __init__(self, upstream):
+        self.slots = asyncio.Semaphore(upstream.max_concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=upstream.max_concurrency, limit_per_host=upstream.max_concurrency
+            )
+        )
+
+
+class Upstream:
+    def __init__(
+        self,
+        name,
+        connect_timeout=3,
+        read_timeout=10,
+        retries=2,
+        max_concurrency=16,
+        backoff=0.25,
+        acquire_timeout=5,
+    ):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.max_concurrency = max_concurrency
+        self.backoff = backoff
+        self.acquire_timeout = acquire_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._loops = weakref.WeakKeyDictionary()  # event loop -> _LoopState
+        self.in_flight = 0
+
+    @property
+    def budget(self):
+        """Longest one request can take: waiting for a slot, then every attempt
+        running into both timeouts, plus the longest possible backoff."""
+        connect, read = self.timeout
+        backoff = sum(self.backoff * 2**attempt for attempt in range(self.retries))
+        return self.acquire_timeout + (self.retries + 1) * (connect + read) + backoff
+
+    def _backoff_delay(self, attempt):
+        # Full jitter: anywhere between 0 and the exponential ceiling.
+        return random.uniform(0, self.backoff * 2**attempt)
+
+    def _sleep_before_retry(self, attempt):
+        time.sleep(self._backoff_delay(attempt))
+
+    def _track_in_flight(self, delta):
+        with self._lock:
+            self.in_flight += delta
+            metrics.set_gauge("upstream_in_flight", self.in_flight, upstream=self.name)
+
+    def request(self, method, url, retries=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        retries = self.retries if retries is None else retries
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS
+
+        waited = time.monotonic()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            metrics.inc("upstream_rejected_total", upstream=self.name)
+            raise UpstreamBusy(f"Too many concurrent requests to {self.name}")
+        metrics.observe(
+            "upstream_wait_seconds", time.monotonic() - waited, upstream=self.name
+        )
+        self._track_in_flight(1)
+
+        try:
+            attempt = 0
+            while True:
+                started = time.monotonic()
+                try:
+                    resp = self.session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    metrics.observe(
+                        "upstream_request_seconds",
+                        time.monotonic() - started,
+                        upstream=self.name,
+                    )
+                    metrics.inc(
+                        "upstream_requests_total",
+                        upstream=self.name,
+                        outcome=type(e).__name__,
+                    )
+                    # A read timeout on a POST may already have had side effects.
+                    retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+                    if attempt >= retries or not retryable:
+                        raise
+                else:
+                    metrics.observe(
+                        "upstream_request_seconds",
+                        time.monotonic() - started,
+                        upstream=self.name,
+                    )
+                    metrics.inc(
+                        "upstream_requests_total",
+                        upstream=self.name,
+                        outcome=f"{resp.status_code // 100}xx",
+                    )
+                    if (
+                        resp.status_code not in RETRY_STATUSES
+                        or not idempotent
+                        or attempt >= retries
+                    ):
+                        return resp
+                    resp.close()
+                metrics.inc("upstream_retries_total", upstream=self.name)
+                self._sleep_before_retry(attempt)
+                attempt += 1
+        finally:
+            self._track_in_flight(-1)
+            self._slots.release()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None or state.session.closed:
+            state = self._loops[loop] = _LoopState(self)
+        return state
+
+    async def close_loop_session(self):
+        state = self._loops.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state.session.close()
+
+    async def _acquire_async(self):
+        state = self._loop_state()
+        waited = time.monotonic()
+        try:
+            await asyncio.wait_for(state.slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("upstream_rejected_total", upstream=self.name)
+            raise UpstreamBusy(f"Too many concurrent requests to {self.name}")
+        metrics.observe(
+            "upstream_wait_seconds", time.monotonic() - waited, upstream=self.name
+        )
+        self._track_in_flight(1)
+        return state
+
+    @contextlib.asynccontextmanager
+    async def astream(self, method, url, timeout=None, **kwargs):
+        """Open a request whose body the caller reads incrementally from the
+        yielded aiohttp response. The concurrency slot is held until the block
+        exits, and there are no retries since a partial stream can't be replayed.
+        The read timeout applies per chunk, not to the whole body."""
+        connect_timeout, read_timeout = timeout or self.timeout
+        client_timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        state = await self._acquire_async()
+        started = time.monotonic()
+        outcome = "cancelled"
+        try:
+            async with state.session.request(
+                method.upper(), url, timeout=client_timeout, **kwargs
+            ) as resp:
+                outcome = f"{resp.status // 100}xx"
+                yield resp
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = _as_requests_error(e)
+            outcome = type(error).__name__
+            raise error from e
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client went away mid-stream; leaving the block drops the connection.
+            outcome = "cancelled"
+            raise
+        finally:
+            metrics.observe(
+                "upstream_request_seconds",
+                time.monotonic() - started,
+                upstream=self.name,
+            )
+            metrics.inc("upstream_requests_total", upstream=self.name, outcome=outcome)
+            self._track_in_flight(-1)
+            state.slots.release()
+
+    async def arequest(self, method, url, retries=None, timeout=None, **kwargs):
+        """Async twin of request(): same timeouts, retry policy, concurrency
+        cap and metrics, but on a per-event-loop aiohttp session."""
+        connect_timeout, read_timeout = timeout or self.timeout
+        client_timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        retries = self.retries if retries is None else retries
+        method = method.upper()
+        idempotent = method in IDEMPOTENT_METHODS
+        state = await self._acquire_async()
+
+        try:
+            attempt = 0
+            while True:
+                started = time.monotonic()
+                try:
+                    async with state.session.request(
+                        method, url, timeout=client_timeout, **kwargs
+                    ) as resp:
+                        content = await resp.read()
+                        result = AsyncResponse(
+                            resp.status,
+                            resp.headers,
+                            content,
+                            resp.get_encoding() if content else None,
+                            str(resp.url),
+                        )
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = _as_requests_error(e)
+                    metrics.observe(
+                        "upstream_request_seconds",
+                        time.monotonic() - started,
+                        upstream=self.name,
+                    )
+                    metrics.inc(
+                        "upstream_requests_total",
+                        upstream=self.name,
+                        outcome=type(error).__name__,
+                    )
+                    retryable = idempotent or isinstance(error, requests.ConnectTimeout)
+                    if attempt >= retries or not retryable:
+                        raise error from e
+                else:
+                    metrics.observe(
+                        "upstream_request_seconds",
+                        time.monotonic() - started,
+                        upstream=self.name,
+                    )
+                    metrics.inc(
+                        "upstream_requests_total",
+                        upstream=self.name,
+                        outcome=f"{result.status_code // 100}xx",
+                    )
+                    if (
+                        result.status_code not in RETRY_STATUSES
+                        or not idempotent
+                        or attempt >= retries
+                    ):
+                        return result
+                metrics.inc("upstream_retries_total", upstream=self.name)
+                await asyncio.sleep(self._backoff_delay(attempt))
+                attempt += 1
+        finally:
+            self._track_in_flight(-1)
+            state.slots.release()
+
+
+UPSTREAMS = {
+    "frankfurter": Upstream(
+        "frankfurter",
+        read_timeout=10,
+        max_concurrency=env_int("UPSTREAM_FRANKFURTER_CONCURRENCY", 8),
+    ),
+    "pollinations": Upstream(
+        "pollinations",
+        connect_timeout=5,
+        read_timeout=120,
+        retries=1,
+        max_concurrency=env_int("UPSTREAM_POLLINATIONS_CONCURRENCY", 8),
+    ),
+    "roproxy": Upstream(
+        "roproxy",
+        read_timeout=10,
+        max_concurrency=env_int("UPSTREAM_ROPROXY_CONCURRENCY", 16),
+    ),
+    "images": Upstream(
+        "images",
+        read_timeout=10,
+        retries=1,
+        max_concurrency=env_int("UPSTREAM_IMAGES_CONCURRENCY", 16),
+    ),
+    "webhook": Upstream(
+        "webhook",
+        read_timeout=15,
+        retries=1,
+        max_concurrency=env_int("UPSTREAM_WEBHOOK_CONCURRENCY", 16),
+    ),
+}
+
+
+def max_budget():
+    return max(u.budget for u in UPSTREAMS.values())
+
+
+def get(name, url, **kwargs):
+    return UPSTREAMS[name].get(url, **kwargs)
+
+
+def post(name, url, **kwargs):
+    return UPSTREAMS[name].post(url, **kwargs)
+
+
+async def aget(name, url, **kwargs):
+    return await UPSTREAMS[name].arequest("GET", url, **kwargs)
+
+
+async def apost(name, url, **kwargs):
+    return await UPSTREAMS[name].arequest("POST", url, **kwargs)
+
+
+def astream(name, method, url, **kwargs):
+    return UPSTREAMS[name].astream(method, url, **kwargs)
+
+
+async def close_loop_sessions():
+    await asyncio.gather(
+        *(u.close_loop_session() for u in UPSTREAMS.values()), return_exceptions=True
+    )
+
+
+background_loop.on_shutdown(close_loop_sessions)
+
+
+def stats():
+    snap = metrics.snapshot()
+    result = {}
+    for name, upstream in UPSTREAMS.items():
+        requests_by_outcome = {
+            dict(labels)["outcome"]: count
+            for (metric, labels), count in snap["counters"].items()
+            if metric == "upstream_requests_total" and dict(labels)["upstream"] == name
+        }
+        total = sum(requests_by_outcome.values())
+        errors = sum(
+            v
+            for k, v in requests_by_outcome.items()
+            if not k.startswith(("2", "3", "4"))
+        )
+        latency = snap["histograms"].get(
+            ("upstream_request_seconds", (("upstream", name),))
+        )
+        result[name] = {
+            "in_flight": upstream.in_flight,
+            "max_concurrency": upstream.max_concurrency,
+            "saturation": round(upstream.in_flight / upstream.max_concurrency, 3),
+            "requests": requests_by_outcome,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "rejected": snap["counters"].get(
+                ("upstream_rejected_total", (("upstream", name),)), 0
+            ),
+            "retries": snap["counters"].get(
+                ("upstream_retries_total", (("upstream", name),)), 0
+            ),
+            "latency_p50": metrics.quantile(latency, 0.5),
+            "latency_p95": metrics.quantile(latency, 0.95),
+            "latency_p99": metrics.quantile(latency, 0.99),
+        }
+    return result
@@ -0,0 +1,404 @@
+"""Declarative schema for Discord webhook messages.
+
+Validation enforces Discord's documented limits locally (see
+https://discord.com/developers/docs/resources/message#embed-object-embed-limits)
+and returns a cleaned copy that keeps only known keys.
+
+Each schema is compiled once, at import, into one flat function (see
+compile_schema) that only answers "valid or not" and builds the cleaned copy.
+Only when it rejects a payload does the recursive walk over the nodes run, to
+find the failing value and report its path.
+"""
+
+# Total characters across title, description, field names/values, footer text
+# and author name of every embed in one message.
+EMBED_TOTAL_CHARS = 6000
+
+
+class SchemaError(ValueError):
+    def __init__(self, path, message):
+        self.path = path or ""
+        self.message = message
+        super().__init__(
+            f"'{self.path}' {message}."
+            if self.path
+            else f"{message[0].upper()}{message[1:]}."
+        )
+
+    def under(self, prefix):
+        """The same error as seen from one level up: `prefix` is the key or
+        "[index]" (or the caller's path) the failing value was found at."""
+        if not self.path:
+            return SchemaError(prefix, self.message)
+        separator = "" if self.path.startswith("[") else "."
+        return SchemaError(f"{prefix}{separator}{self.path}", self.message)
+
+
+# Nodes raise SchemaError with a path relative to themselves; containers
+# prefix it on the way out, so paths are only built when something fails.
+
+
+class String:
+    def __init__(self, max_length=None, min_length=0, counted=False):
+        self.max_length = max_length
+        self.min_length = min_length
+        self.counted = counted  # counts toward the enclosing Array's max_total_chars
+
+    def validate(self, value, total):
+        if type(value) is not str:
+            raise SchemaError("", "must be a string")
+        length = len(value)
+        if length < self.min_length:
+            if self.min_length == 1:
+                raise SchemaError("", "must not be empty")
+            raise SchemaError("", f"must be at least {self.min_length} characters")
+        if self.max_length is not None and length > self.max_length:
+            raise SchemaError("", f"must be at most {self.max_length} characters")
+        if self.counted and total is not None:
+            total[0] += length
+        return value
+
+
+class Integer:
+    def __init__(self, minimum=None, maximum=None):
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def validate(self, value, total):
+        # type() rather than isinstance(): True is not a color.
+        if type(value) is not int:
+            raise SchemaError("", "must be an integer")
+        if (self.minimum is not None and value < self.minimum) or (
+            self.maximum is not None and value > self.maximum
+        ):
+            raise SchemaError("", f"must be between {self.minimum} and {self.maximum}")
+        return value
+
+
+class Boolean:
+    """Any JSON value, coerced with bool()."""
+
+    def __init__(self, default=None):
+        self.default = default
+
+    def validate(self, value, total):
+        return bool(value)
+
+
+class Object:
+    def __init__(self, fields, required=(), omit_if_empty=False):
+        self.fields = fields
+        self.required = required
+        self.omit_if_empty = omit_if_empty
+        # Per-field flags looked up once, not on every payload.
+        self._fields = [
+            (
+                key,
+                child.validate,
+                key in required,
+                getattr(child, "omit_if_empty", False),
+                getattr(child, "default", None),
+            )
+            for key, child in fields.items()
+        ]
+
+    def validate(self, value, total):
+        if type(value) is not dict:
+            raise SchemaError("", "must be an object")
+        cleaned = {}
+        for key, validate, required, omit_if_empty, default in self._fields:
+            if key in value:
+                try:
+                    result = validate(value[key], total)
+                except SchemaError as e:
+                    raise e.under(key) from None
+                if result or not omit_if_empty:
+                    cleaned[key] = result
+            elif required:
+                raise SchemaError(key, "is required")
+            elif default is not None:
+                cleaned[key] = default
+        return cleaned
+
+
+class Array:
+    def __init__(self, items, max_items=None, max_total_chars=None):
+        self.items = items
+        self.max_items = max_items
+        self.max_total_chars = max_total_chars
+
+    def validate(self, value, total):
+        if type(value) is not list:
+            raise SchemaError("", "must be a list")
+        if self.max_items is not None and len(value) > self.max_items:
+            raise SchemaError("", f"must have at most {self.max_items} items")
+        if self.max_total_chars is not None:
+            total = [0]
+        cleaned = []
+        for i, item in enumerate(value):
+            try:
+                cleaned.append(self.items.validate(item, total))
+            except SchemaError as e:
+                raise e.under(f"[{i}]") from None
+        if self.max_total_chars is not None and total[0] > self.max_total_chars:
+            raise SchemaError(
+                "",
+                f"must not exceed {self.max_total_chars} characters in total "
+                f"(got {total[0]})",
+            )
+        return cleaned
+
+
+def _validate(node, value, path):
+    try:
+        return node.validate(value, None)
+    except SchemaError as e:
+        if path:
+            raise e.under(path) from None
+        raise
+
+
+class _Invalid(Exception):
+    """Raised by compiled validators; the walk then finds out what is wrong."""
+
+
+class _Compiler:
+    """Emits the body of one compiled validator. The checks on the simple
+    values (strings, integers) of one object are joined, types first, so the
+    happy path is straight-line code with no paths or messages in it; every
+    failure just raises _Invalid. Required keys are plain subscripts: the
+    KeyError of a missing one is turned into _Invalid once, around the body."""
+
+    def __init__(self):
+        self.lines = []
+        self.names = 0
+
+    def name(self, prefix):
+        self.names += 1
+        return f"{prefix}{self.names}"
+
+    def emit(self, depth, line):
+        self.lines.append("    " * depth + line)
+
+    def check(self, depth, failures):
+        if failures:
+            self.emit(depth, f"if {' or '.join(failures)}:")
+            self.emit(depth + 1, "raise _Invalid")
+
+    def finish(self, depth, total, checks):
+        """Emit the checks collected from `node` calls: type checks, then the
+        lengths the bounds need, then the bounds, then the running total."""
+        types, lengths, bounds = [], [], []
+        for node_types, node_lengths, node_bounds in checks:
+            types += node_types
+            lengths += node_lengths
+            bounds += node_bounds
+        if not lengths:
+            return self.check(depth, types + bounds)
+        self.check(depth, types)
+        for length, value in lengths:
+            self.emit(depth, f"{length} = len({value})")
+        self.check(depth, bounds)
+        counted = [length for length, _ in lengths]
+        if total and counted:
+            self.emit(depth, f"{total} += {' + '.join(counted)}")
+
+    def node(self, node, value, depth, total):
+        """Emit code for `value`. Returns (checks, result): the checks for
+        `finish`, as (types, lengths, bounds), and the expression for the
+        cleaned value."""
+        return getattr(self, type(node).__name__.lower())(node, value, depth, total)
+
+    @staticmethod
+    def lengths(value, low, high):
+        # Two plain comparisons run faster than a chained one.
+        failures = []
+        if low == 1:
+            failures.append(f"not {value}")
+        elif low:
+            failures.append(f"{value} < {low}")
+        if high is not None:
+            failures.append(f"{value} > {high}")
+        return failures
+
+    def string(self, node, value, depth, total):
+        types = [f"type({value}) is not str"]
+        if node.counted and total:
+            length = self.name("n")
+            bounds = self.lengths(length, node.min_length, node.max_length)
+            return (types, [(length, value)], bounds), value
+        bounds = self.lengths(f"len({value})", node.min_length, node.max_length)
+        return (types, [], bounds), value
+
+    def integer(self, node, value, depth, total):
+        types, bounds = [f"type({value}) is not int"], []
+        if node.minimum is not None:
+            bounds.append(f"{value} < {node.minimum}")
+        if node.maximum is not None:
+            bounds.append(f"{value} > {node.maximum}")
+        return (types, [], bounds), value
+
+    def boolean(self, node, value, depth, total):
+        return ([], [], []), f"(True if {value} else False)"
+
+    def object(self, node, value, depth, total):
+        self.check(depth, [f"type({value}) is not dict"])
+        fields = node.fields.items()
+        if all(self.always_present(node, key, child) for key, child in fields):
+            return self.fixed_object(node, value, depth, total)
+        cleaned = self.name("o")
+        self.emit(depth, f"{cleaned} = {{}}")
+        for key, child in fields:
+            item = self.name("v")
+            self.emit(depth, f"if {key!r} in {value}:")
+            self.emit(depth + 1, f"{item} = {value}[{key!r}]")
+            checks, result = self.node(child, item, depth + 1, total)
+            self.finish(depth + 1, total, [checks])
+            if getattr(child, "omit_if_empty", False):
+                self.emit(depth + 1, f"if {result}:")
+                self.emit(depth + 2, f"{cleaned}[{key!r}] = {result}")
+            else:
+                self.emit(depth + 1, f"{cleaned}[{key!r}] = {result}")
+            if key in node.required:
+                self.emit(depth, "else:")
+                self.emit(depth + 1, "raise _Invalid")
+            elif getattr(child, "default", None) is not None:
+                self.emit(depth, "else:")
+                self.emit(depth + 1, f"{cleaned}[{key!r}] = {child.default!r}")
+        return ([], [], []), cleaned
+
+    @staticmethod
+    def always_present(node, key, child):
+        if getattr(child, "omit_if_empty", False):
+            return False
+        return key in node.required or getattr(child, "default", None) is not None
+
+    def fixed_object(self, node, value, depth, total):
+        # Every key ends up in the output: one dict literal, one set of checks.
+        checks, results = [], []
+        for key, child in node.fields.items():
+            item = self.name("v")
+            if key in node.required:
+                self.emit(depth, f"{item} = {value}[{key!r}]")
+            elif child.default is False:
+                self.emit(depth, f"{item} = {value}.get({key!r})")
+            else:
+                self.emit(depth, f"{item} = {value}.get({key!r}, {child.default!r})")
+            item_checks, result = self.node(child, item, depth, total)
+            checks.append(item_checks)
+            results.append(f"{key!r}: {result}")
+        self.finish(depth, total, checks)
+        return ([], [], []), "{" + ", ".join(results) + "}"
+
+    def array(self, node, value, depth, total):
+        failures = [f"type({value}) is not list"]
+        if node.max_items is not None:
+            failures.append(f"len({value}) > {node.max_items}")
+        self.check(depth, failures)
+        if node.max_total_chars is not None:
+            total = self.name("t")
+            self.emit(depth, f"{total} = 0")
+        cleaned, item = self.name("a"), self.name("v")
+        self.emit(depth, f"{cleaned} = []")
+        self.emit(depth, f"for {item} in {value}:")
+        checks, result = self.node(node.items, item, depth + 1, total)
+        self.finish(depth + 1, total, [checks])
+        self.emit(depth + 1, f"{cleaned}.append({result})")
+        if node.max_total_chars is not None:
+            self.check(depth, [f"{total} > {node.max_total_chars}"])
+        return ([], [], []), cleaned
+
+
+# Builtins the generated code uses, bound as locals (default arguments).
+_LOCALS = ("type", "len", "str", "int", "dict", "list")
+
+
+def compile_schema(node, name="validate"):
+    """Compile a schema into `name(value)`, which returns the cleaned value or
+    raises _Invalid. The generated source is kept on it as `__source__`."""
+    compiler = _Compiler()
+    checks, result = compiler.node(node, "value", 2, None)
+    compiler.finish(2, None, [checks])
+    compiler.emit(2, f"return {result}")
+    bound = ", ".join(f"{builtin}={builtin}" for builtin in _LOCALS)
+    source = "\n".join(
+        [f"def {name}(value, _Invalid=_Invalid, {bound}):", "    try:"]
+        + compiler.lines
+        + ["    except KeyError:", "        raise _Invalid", ""]
+    )
+    namespace = {"_Invalid": _Invalid}
+    exec(compile(source, f"<schema {name}>", "exec"), namespace)
+    validate = namespace[name]
+    validate.__source__ = source
+    return validate
+
+
+MEDIA = Object({"url": String()}, required=("url",))
+
+EMBED = Object(
+    {
+        "title": String(max_length=256, counted=True),
+        "description": String(max_length=4096, counted=True),
+        "url": String(),
+        "color": Integer(minimum=0, maximum=0xFFFFFF),
+        "author": Object(
+            {
+                "name": String(max_length=256, counted=True),
+                "url": String(),
+                "icon_url": String(),
+            },
+            omit_if_empty=True,
+        ),
+        "footer": Object(
+            {
+                "text": String(max_length=2048, counted=True),
+                "icon_url": String(),
+            },
+            omit_if_empty=True,
+        ),
+        "fields": Array(
+            Object(
+                {
+                    "name": String(max_length=256, min_length=1, counted=True),
+                    "value": String(max_length=1024, min_length=1, counted=True),
+                    "inline": Boolean(default=False),
+                },
+                required=("name", "value"),
+            ),
+            max_items=25,
+        ),
+        "image": MEDIA,
+        "thumbnail": MEDIA,
+    }
+)
+
+MESSAGE = Object(
+    {
+        "content": String(max_length=2000),
+        "username": String(max_length=80),
+        "avatar_url": String(),
+        "embeds": Array(EMBED, max_items=10, max_total_chars=EMBED_TOTAL_CHARS),
+    }
+)
+
+
+_validate_embed = compile_schema(EMBED, "validate_embed")
+_validate_message = compile_schema(MESSAGE, "validate_message")
+
+
+def validate_embed(embed, path=None):
+    """Validate one embed and return a cleaned copy, or raise SchemaError."""
+    try:
+        return _validate_embed(embed)
+    except _Invalid:
+        return _validate(EMBED, embed, path)
+
+
+def validate_message(message, path=None):
+    """Validate a webhook message (content, username, avatar_url, embeds) and
+    return the payload to send, or raise SchemaError. `path` names the message
+    in error paths, e.g. "messages[2]"."""
+    try:
+        return _validate_message(message)
+    except _Invalid:
+        return _validate(MESSAGE, message, path)
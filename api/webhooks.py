@@ -0,0 +1,408 @@
+import asyncio
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+
+import requests
+from psycopg2.extras import Json, RealDictCursor
+
+from . import db, metrics, upstream
+from .aio import background_loop
+from .db import env_int
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_MAX_ATTEMPTS = env_int("WEBHOOK_MAX_ATTEMPTS", 5)
+WEBHOOK_CLAIM_BATCH = env_int("WEBHOOK_CLAIM_BATCH", 50)
+WEBHOOK_POLL_SECONDS = env_int("WEBHOOK_POLL_SECONDS", 2)
+WEBHOOK_RETENTION_HOURS = env_int("WEBHOOK_RETENTION_HOURS", 24)
+# A row stuck in 'sending' this long belonged to a worker that died mid-delivery.
+# Each delivery renews its claim right before it is sent (see _renew), so this
+# only has to cover one send, not a whole claimed batch.
+WEBHOOK_RECLAIM_SECONDS = 120
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+DISCORD_WEBHOOK = re.compile(
+    r"^https://(?:ptb\.|canary\.)?discord(?:app)?\.com/api(?:/v\d+)?/webhooks/(\d+)/"
+)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS webhook_deliveries (
+        id TEXT PRIMARY KEY,
+        bucket TEXT NOT NULL,
+        webhook_url TEXT NOT NULL,
+        payload JSONB NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        claimed_at TIMESTAMP WITH TIME ZONE,
+        last_status INTEGER,
+        last_error TEXT,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT clock_timestamp(),
+        delivered_at TIMESTAMP WITH TIME ZONE
+    );
+    CREATE INDEX IF NOT EXISTS webhook_deliveries_due
+        ON webhook_deliveries (next_attempt_at) WHERE status IN ('queued', 'sending');
+    ALTER TABLE webhook_deliveries ADD COLUMN IF NOT EXISTS claim_token TEXT;
+"""
+
+
+def bucket_for(url):
+    # Discord rate-limits per webhook; anything else gets a bucket per URL.
+    match = DISCORD_WEBHOOK.match(url)
+    return match.group(1) if match else hashlib.sha256(url.encode()).hexdigest()[:32]
+
+
+def enqueue(url, payloads):
+    """Store one delivery per payload and return their ids, in order."""
+    ids = [uuid.uuid4().hex for _ in payloads]
+    bucket = bucket_for(url)
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        args = []
+        for delivery_id, payload in zip(ids, payloads):
+            args += [delivery_id, bucket, url, Json(payload)]
+        values = ", ".join(["(%s, %s, %s, %s)"] * len(payloads))
+        c.execute(
+            "INSERT INTO webhook_deliveries (id, bucket, webhook_url, payload) "
+            f"VALUES {values}",
+            args,
+        )
+        conn.commit()
+    metrics.inc("webhook_enqueued_total", len(ids))
+    dispatcher.wake()
+    return ids
+
+
+def get_statuses(ids):
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute(
+            """
+            SELECT id, status, attempts, last_status, last_error,
+                   created_at, next_attempt_at, delivered_at
+            FROM webhook_deliveries WHERE id = ANY(%s)
+        """,
+            (list(ids),),
+        )
+        rows = {row["id"]: row for row in c.fetchall()}
+    result = []
+    for delivery_id in ids:
+        row = rows.get(delivery_id)
+        if row is None:
+            result.append({"id": delivery_id, "status": "unknown"})
+            continue
+        for field in ("created_at", "next_attempt_at", "delivered_at"):
+            row[field] = row[field].isoformat() if row[field] else None
+        if row["status"] in ("delivered", "failed"):
+            row.pop("next_attempt_at")
+        result.append(row)
+    return result
+
+
+def _claim(limit):
+    """Claim up to `limit` due deliveries, and any whose claim has lapsed. The
+    rows share a fresh claim_token, which every later update checks, so a
+    worker that lost a row to a reclaim can no longer touch it."""
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute(
+            """
+            UPDATE webhook_deliveries
+            SET status = 'sending', attempts = attempts + 1, claimed_at = NOW(),
+                claim_token = %s
+            WHERE id IN (
+                SELECT id FROM webhook_deliveries
+                WHERE (status = 'queued' AND next_attempt_at <= NOW())
+                   OR (status = 'sending'
+                       AND claimed_at < NOW() - make_interval(secs => %s))
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, bucket, webhook_url, payload, attempts, created_at,
+                      claim_token
+        """,
+            (uuid.uuid4().hex, WEBHOOK_RECLAIM_SECONDS, limit),
+        )
+        rows = c.fetchall()
+        conn.commit()
+    # RETURNING has no order; deliveries to one webhook should go out FIFO.
+    return sorted(rows, key=lambda row: row["created_at"])
+
+
+def _renew(row):
+    """Restart the reclaim clock on a claimed delivery just before sending it.
+    False if another worker has reclaimed it meanwhile: it is theirs to send."""
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            UPDATE webhook_deliveries SET claimed_at = NOW()
+            WHERE id = %s AND status = 'sending' AND claim_token = %s
+        """,
+            (row["id"], row["claim_token"]),
+        )
+        conn.commit()
+        return c.rowcount == 1
+
+
+def _finish(row, status, http_status=None, error=None):
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            UPDATE webhook_deliveries
+            SET status = %s, last_status = %s, last_error = %s,
+                delivered_at = CASE WHEN %s = 'delivered' THEN NOW() END
+            WHERE id = %s AND claim_token = %s
+        """,
+            (status, http_status, error, status, row["id"], row["claim_token"]),
+        )
+        conn.commit()
+
+
+def _requeue(rows, delay, http_status=None, error=None, refund=False):
+    """Put claimed deliveries back in the queue after `delay` seconds. `refund`
+    gives back the attempt when the delivery never really got a chance (rate
+    limit)."""
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            UPDATE webhook_deliveries
+            SET status = 'queued', next_attempt_at = NOW() + make_interval(secs => %s),
+                attempts = attempts - %s,
+                last_status = COALESCE(%s, last_status),
+                last_error = COALESCE(%s, last_error)
+            WHERE id = ANY(%s) AND claim_token = ANY(%s)
+        """,
+            (
+                delay,
+                1 if refund else 0,
+                http_status,
+                error,
+                [row["id"] for row in rows],
+                list({row["claim_token"] for row in rows}),
+            ),
+        )
+        conn.commit()
+
+
+def _hold_bucket(bucket, delay):
+    """Push every queued delivery for a webhook past its rate-limit reset, so
+    dispatchers in other workers respect it too."""
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            UPDATE webhook_deliveries
+            SET next_attempt_at =
+                GREATEST(next_attempt_at, NOW() + make_interval(secs => %s))
+            WHERE bucket = %s AND status = 'queued'
+        """,
+            (delay, bucket),
+        )
+        conn.commit()
+
+
+def _prune():
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            DELETE FROM webhook_deliveries
+            WHERE status IN ('delivered', 'failed')
+              AND created_at < NOW() - make_interval(hours => %s)
+        """,
+            (WEBHOOK_RETENTION_HOURS,),
+        )
+        conn.commit()
+
+
+def _retry_delay(attempts):
+    # Full jitter, like upstream retries, but on a scale of seconds.
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempts))
+
+
+def _rate_limit_delay(resp):
+    """Seconds until the webhook's bucket has room again, or 0."""
+    if resp.status_code == 429:
+        try:
+            return float(resp.json().get("retry_after", 1))
+        except ValueError:
+            return float(resp.headers.get("Retry-After", 1))
+    if resp.headers.get("X-RateLimit-Remaining") == "0":
+        return float(resp.headers.get("X-RateLimit-Reset-After", 1))
+    return 0.0
+
+
+class Dispatcher:
+    """Delivers queued webhook messages from the worker's background loop.
+
+    Every worker runs one; rows are claimed with SKIP LOCKED, and each claim is
+    renewed right before its send, so they never double-send. Deliveries to the
+    same webhook go one after another so its X-RateLimit-* headers can be
+    honoured; different webhooks go in parallel."""
+
+    def __init__(self):
+        self.blocked_until = {}  # bucket -> time.time() when it has room again
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self._wake = None
+        self._task = None
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def start(self):
+        """Make sure this worker's dispatcher is running. Must not be called
+        from the background loop's own thread."""
+        loop = background_loop.start()
+        with self._lock:
+            if (
+                self._task is None
+                or self._task.get_loop() is not loop
+                or self._task.done()
+            ):
+                asyncio.run_coroutine_threadsafe(self._spawn(), loop).result()
+
+    async def _spawn(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.ensure_future(self.run())
+
+    def _wake_after(self, delay):
+        # Poll again as soon as a held bucket reopens instead of on the next tick.
+        asyncio.get_running_loop().call_later(delay, self._wake.set)
+
+    def wake(self):
+        self.start()
+        background_loop.loop.call_soon_threadsafe(self._wake.set)
+
+    async def run(self):
+        while True:
+            try:
+                rows = await asyncio.to_thread(_claim, WEBHOOK_CLAIM_BATCH)
+            except Exception as e:
+                logger.warning(f"Webhook dispatcher could not claim deliveries: {e}")
+                rows = []
+            if rows:
+                buckets = {}
+                for row in rows:
+                    buckets.setdefault(row["bucket"], []).append(row)
+                await asyncio.gather(
+                    *(
+                        self._deliver_bucket(bucket, rows)
+                        for bucket, rows in buckets.items()
+                    )
+                )
+                continue
+
+            if time.monotonic() - self._last_prune > 300:
+                self._last_prune = time.monotonic()
+                now = time.time()
+                self.blocked_until = {
+                    b: until for b, until in self.blocked_until.items() if until > now
+                }
+                try:
+                    await asyncio.to_thread(_prune)
+                except Exception as e:
+                    logger.warning(
+                        f"Webhook dispatcher could not prune deliveries: {e}"
+                    )
+            try:
+                await asyncio.wait_for(self._wake.wait(), WEBHOOK_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _deliver_bucket(self, bucket, rows):
+        for i, row in enumerate(rows):
+            wait = self.blocked_until.get(bucket, 0) - time.time()
+            if wait > 0:
+                await asyncio.to_thread(_requeue, rows[i:], wait, refund=True)
+                self._wake_after(wait)
+                return
+            try:
+                # The rows of a batch wait their turn while the ones before them
+                # are sent; by now another worker may have taken this one over.
+                if await asyncio.to_thread(_renew, row):
+                    await self._deliver(bucket, row)
+            except Exception as e:
+                logger.warning(
+                    f"Webhook delivery {row['id']} could not be recorded: {e}"
+                )
+
+    async def _deliver(self, bucket, row):
+        try:
+            resp = await upstream.apost(
+                "webhook", row["webhook_url"], json=row["payload"], retries=0
+            )
+        except requests.RequestException as e:
+            await self._retry(row, None, str(e))
+            return
+
+        delay = _rate_limit_delay(resp)
+        if delay:
+            self.blocked_until[bucket] = time.time() + delay
+
+        if resp.status_code in (200, 204):
+            self.delivered += 1
+            metrics.inc("webhook_deliveries_total", outcome="delivered")
+            await asyncio.to_thread(_finish, row, "delivered", resp.status_code)
+        elif resp.status_code == 429:
+            self.rate_limited += 1
+            metrics.inc("webhook_deliveries_total", outcome="rate_limited")
+            await asyncio.to_thread(
+                _requeue,
+                [row],
+                delay,
+                429,
+                "Rate limited by Discord",
+                refund=True,
+            )
+            await asyncio.to_thread(_hold_bucket, bucket, delay)
+            self._wake_after(delay)
+        elif resp.status_code >= 500:
+            await self._retry(row, resp.status_code, resp.text[:500])
+        else:
+            # Any other 4xx (bad payload, deleted webhook) won't succeed on retry.
+            self.failed += 1
+            metrics.inc("webhook_deliveries_total", outcome="failed")
+            await asyncio.to_thread(
+                _finish, row, "failed", resp.status_code, resp.text[:500]
+            )
+
+    async def _retry(self, row, http_status, error):
+        if row["attempts"] >= WEBHOOK_MAX_ATTEMPTS:
+            self.failed += 1
+            metrics.inc("webhook_deliveries_total", outcome="failed")
+            await asyncio.to_thread(_finish, row, "failed", http_status, error)
+        else:
+            self.retried += 1
+            metrics.inc("webhook_deliveries_total", outcome="retried")
+            await asyncio.to_thread(
+                _requeue, [row], _retry_delay(row["attempts"]), http_status, error
+            )
+
+    def stats(self):
+        now = time.time()
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rate_limited": self.rate_limited,
+            "blocked_webhooks": sum(
+                1 for until in self.blocked_until.values() if until > now
+            ),
+        }
+
+
+dispatcher = Dispatcher()
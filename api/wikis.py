@@ -0,0 +1,277 @@
+import base64
+import binascii
+import html
+import threading
+from datetime import datetime
+
+from psycopg2.extras import RealDictCursor
+
+from . import db, pubsub
+from .cache import LRUCache
+
+WIKIS_CHANNEL = "wikis_changed"
+
+WIKI_PAGE_SIZE = db.env_int("WIKI_PAGE_SIZE", 50)
+WIKI_PAGE_MAX = db.env_int("WIKI_PAGE_MAX", 100)
+WIKI_SEARCH_PAGE_SIZE = db.env_int("WIKI_SEARCH_PAGE_SIZE", 10)
+WIKI_SEARCH_PAGE_MAX = db.env_int("WIKI_SEARCH_PAGE_MAX", 50)
+WIKI_SEARCH_MAX_QUERY = 200
+# ts_headline re-parses the text it is given (~4 ms per 20 KB), so snippets
+# are cut from the start of the content only.
+WIKI_SNIPPET_SCAN_CHARS = db.env_int("WIKI_SNIPPET_SCAN_CHARS", 5000)
+
+FIELDS = ("id", "title", "description", "content", "created_at")
+DEFAULT_FIELDS = ("id", "title", "description", "created_at")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS wikis (
+        id SERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+    );
+    CREATE INDEX IF NOT EXISTS wikis_created_at ON wikis (created_at DESC, id DESC);
+    ALTER TABLE wikis ADD COLUMN IF NOT EXISTS search tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A') ||
+        setweight(to_tsvector('english', description), 'B') ||
+        setweight(to_tsvector('english', content), 'C')
+    ) STORED;
+    CREATE INDEX IF NOT EXISTS wikis_search ON wikis USING GIN (search);
+"""
+
+# ts_headline wraps matches in these; they are swapped for <mark> after the
+# snippet has been HTML-escaped.
+_HL_START, _HL_STOP = "\x02", "\x03"
+HEADLINE_OPTIONS = (
+    f"StartSel={_HL_START}, StopSel={_HL_STOP}, "
+    'MaxFragments=2, MaxWords=30, MinWords=10, FragmentDelimiter=" … "'
+)
+
+# Keyset condition for the page after (rank, id) in search results.
+AFTER_RANK = "AND (ts_rank(w.search, q.query), w.id) < (%s::real, %s)"
+
+# Listing pages by (cursor, limit, fields). Writes clear it in every worker;
+# the TTL only matters if a notification is lost.
+listing_cache = LRUCache(
+    max_items=db.env_int("WIKI_CACHE_SIZE", 256), ttl=db.env_int("WIKI_CACHE_TTL", 300)
+)
+# Search result pages by (query, cursor, limit), cleared along with the listing.
+search_cache = LRUCache(
+    max_items=db.env_int("WIKI_SEARCH_CACHE_SIZE", 512),
+    ttl=db.env_int("WIKI_CACHE_TTL", 300),
+)
+_generation = 0
+_lock = threading.Lock()
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def encode_cursor(*parts):
+    return (
+        base64.urlsafe_b64encode("|".join(map(str, parts)).encode())
+        .decode()
+        .rstrip("=")
+    )
+
+
+def decode_cursor(cursor, *types):
+    """Parse a cursor made by encode_cursor back into one value per type."""
+    try:
+        parts = (
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            .decode()
+            .split("|")
+        )
+        if len(parts) != len(types):
+            raise ValueError(cursor)
+        return tuple(parse(part) for parse, part in zip(types, parts))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise BadRequest("Invalid cursor.")
+
+
+def parse_fields(fields):
+    if not fields:
+        return DEFAULT_FIELDS
+    wanted = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in wanted if f not in FIELDS]
+    if unknown:
+        raise BadRequest(
+            f"Unknown field(s): {', '.join(unknown)}. Choose from {', '.join(FIELDS)}."
+        )
+    return wanted
+
+
+def parse_limit(limit, default=WIKI_PAGE_SIZE, maximum=WIKI_PAGE_MAX):
+    if limit is None:
+        return default
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise BadRequest("'limit' must be an integer.")
+    if not 1 <= limit <= maximum:
+        raise BadRequest(f"'limit' must be between 1 and {maximum}.")
+    return limit
+
+
+def list_page(cursor=None, limit=WIKI_PAGE_SIZE, fields=DEFAULT_FIELDS):
+    """Return (wikis, next_cursor) for the page after `cursor`, newest first.
+    next_cursor is None on the last page."""
+    pubsub.ensure_listener()
+    key = (cursor, limit, fields)
+    page = listing_cache.get(key)
+    if page is not None:
+        return page
+
+    after = decode_cursor(cursor, datetime.fromisoformat, int) if cursor else None
+    # created_at and id are always read: they make up the next cursor.
+    columns = ", ".join(dict.fromkeys(fields + ("created_at", "id")))
+    generation = _generation
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        if after:
+            c.execute(
+                f"""
+                SELECT {columns} FROM wikis
+                WHERE (created_at, id) < (%s, %s)
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """,
+                (*after, limit + 1),
+            )
+        else:
+            c.execute(
+                f"SELECT {columns} FROM wikis "
+                "ORDER BY created_at DESC, id DESC LIMIT %s",
+                (limit + 1,),
+            )
+        rows = c.fetchall()
+
+    next_cursor = (
+        encode_cursor(rows[limit - 1]["created_at"].isoformat(), rows[limit - 1]["id"])
+        if len(rows) > limit
+        else None
+    )
+    page = ([{f: row[f] for f in fields} for row in rows[:limit]], next_cursor)
+    with _lock:
+        if generation == _generation:
+            listing_cache.set(key, page)
+    return page
+
+
+def search(query, cursor=None, limit=WIKI_SEARCH_PAGE_SIZE):
+    """Return (results, next_cursor) for a web-search style query ("quoted
+    phrases", -excluded, or), best match first. Titles outrank descriptions,
+    which outrank content. Each result carries an HTML-safe `snippet` of the
+    content with matches wrapped in <mark>."""
+    query = (query or "").strip()
+    if not query:
+        raise BadRequest("Missing search query. Pass it as ?q=.")
+    if len(query) > WIKI_SEARCH_MAX_QUERY:
+        raise BadRequest(
+            f"Search query must be at most {WIKI_SEARCH_MAX_QUERY} characters."
+        )
+    pubsub.ensure_listener()
+    key = (query, cursor, limit)
+    page = search_cache.get(key)
+    if page is not None:
+        return page
+
+    after = decode_cursor(cursor, float, int) if cursor else None
+    generation = _generation
+
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        # Rank every match through the GIN index, but only build headlines
+        # (which re-parse the content) for the page being returned.
+        c.execute(
+            f"""
+            SELECT id, title, description, created_at, rank,
+                   ts_headline('english', left(content, %s), query, %s) AS snippet
+            FROM (
+                SELECT w.id, w.title, w.description, w.content, w.created_at, q.query,
+                       ts_rank(w.search, q.query) AS rank
+                FROM wikis w, websearch_to_tsquery('english', %s) AS q(query)
+                WHERE w.search @@ q.query
+                {AFTER_RANK if after else ""}
+                ORDER BY rank DESC, w.id DESC
+                LIMIT %s
+            ) page
+            ORDER BY rank DESC, id DESC
+        """,
+            (
+                WIKI_SNIPPET_SCAN_CHARS,
+                HEADLINE_OPTIONS,
+                query,
+                *(after or ()),
+                limit + 1,
+            ),
+        )
+        rows = c.fetchall()
+
+    next_cursor = (
+        encode_cursor(repr(rows[limit - 1]["rank"]), rows[limit - 1]["id"])
+        if len(rows) > limit
+        else None
+    )
+    results = rows[:limit]
+    for row in results:
+        row["snippet"] = (
+            html.escape(row["snippet"])
+            .replace(_HL_START, "<mark>")
+            .replace(_HL_STOP, "</mark>")
+        )
+    page = (results, next_cursor)
+    with _lock:
+        if generation == _generation:
+            search_cache.set(key, page)
+    return page
+
+
+def invalidate(payload=None):
+    global _generation
+    with _lock:
+        _generation += 1
+        listing_cache.clear()
+        search_cache.clear()
+
+
+def create(title, description, content):
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute(
+            """
+            INSERT INTO wikis (title, description, content)
+            VALUES (%s, %s, %s)
+            RETURNING id
+        """,
+            (title, description, content),
+        )
+        wiki_id = c.fetchone()[0]
+        pubsub.notify(c, WIKIS_CHANNEL)
+        conn.commit()
+    invalidate()
+    return wiki_id
+
+
+def delete(wiki_id):
+    """Delete a wiki; False if there was no such wiki."""
+    with db.get_pool().getconn() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM wikis WHERE id = %s", (wiki_id,))
+        deleted = c.rowcount
+        if deleted:
+            pubsub.notify(c, WIKIS_CHANNEL)
+        conn.commit()
+    if deleted:
+        invalidate()
+    return bool(deleted)
+
+
+def stats():
+    return {"listing": listing_cache.stats(), "search": search_cache.stats()}
+
+
+pubsub.subscribe(WIKIS_CHANNEL, invalidate, invalidate)
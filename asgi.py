@@ -0,0 +1,4 @@
+from api.app import app as flask_app
+from api.asgi import AsgiApp
+
+app = AsgiApp(flask_app)
@@ -1,3 +1,10 @@
 #!/usr/bin/env bash
 
-gunicorn wsgi:app --bind 0.0.0.0:$PORT --log-level=debug --workers=4
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    # Async views (upstream-bound routes) are awaited on each worker's event loop;
+    # sync routes run in a thread pool of ASGI_THREADS per worker.
+    exec gunicorn asgi:app -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT --log-level=debug --workers=4
+fi
+
+# Threads let cheap routes keep flowing while a request waits on the render pool.
+gunicorn wsgi:app -c gunicorn.conf.py --bind 0.0.0.0:$PORT --log-level=debug --workers=4 --threads=${GUNICORN_THREADS:-8}
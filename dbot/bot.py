@@ -1,4 +1,5 @@
 import os
+import asyncio
 import aiohttp
 import discord
 from discord.ext import commands
@@ -82,7 +83,7 @@ async def key_generate(ctx: discord.ApplicationContext, user: discord.Member):
             if data.get("success"):
                 await ctx.respond(f"Generated API key for {user.mention}: `{data['api_key']}`")
             elif data.get("error") == "API Key for this user already exists":
-                await ctx.respond(f"{user.mention} already has an API key: `{data['api_key']}`")
+                await ctx.respond(f"{user.mention} already has an API key (starts with `{data['key_prefix']}`).")
             else:
                 await ctx.respond(f"Failed to generate key: {data.get('error')}")
 
@@ -110,7 +111,8 @@ async def key_get(ctx: discord.ApplicationContext, user: discord.Member):
         async with session.get(url, headers=headers) as resp:
             data = await resp.json()
             if data.get("success"):
-                await ctx.respond(f"{user.mention}'s API key: `{data['api_key']}`")
+                # Keys are stored hashed; only their first characters can be shown.
+                await ctx.respond(f"{user.mention}'s API key starts with `{data['key_prefix']}`.")
             else:
                 await ctx.respond(f"Failed to get key: {data.get('message')}")
 
@@ -169,12 +171,8 @@ async def get_api_key(ctx: discord.ApplicationContext):
                         await ctx.respond("Couldn't DM you — please check your privacy settings.")
 
                 elif data.get("error") == "API Key for this user already exists":
-                    key = data.get("api_key")
-                    try:
-                        await ctx.author.send(f"Here's your API key again: `{key}`")
-                        await ctx.respond("You already had an API key — I've sent it again in your DMs.")
-                    except discord.Forbidden:
-                        await ctx.respond("Couldn't DM you — please check your privacy settings.")
+                    # The API only keeps a hash of the key, so it can't be sent again.
+                    await ctx.respond(f"You already have an API key (it starts with `{data.get('key_prefix')}`). If you lost it, ask an admin to reset it.")
 
                 else:
                     await ctx.respond("Something went wrong while generating your API key.")
@@ -243,38 +241,117 @@ async def update_news_cmd(ctx, *, content: str):
         except Exception:
             await ctx.send("Error occurred while updating the news.")
 
-@bot.event
-async def on_member_remove(member: discord.Member):
-    channel_id = 1365259997365272699  # Mod-only channel ID
-    notify_channel = bot.get_channel(channel_id)
-    
+MOD_CHANNEL_ID = 1365259997365272699  # Mod-only channel ID
+BULK_MAX = 1000  # user ids per bulk admin call
+LEAVE_BATCH_SECONDS = 5
+
+# Members who left recently; revoked together so a mass leave (or a raid
+# cleanup) costs one API call instead of one per member.
+pending_leaves = {}
+leave_flush = None
+
+async def revoke_keys(session, api_key, user_ids):
+    """Revoke keys in bulk; returns the set of user ids that had one."""
+    revoked = set()
+    headers = {"X-API-KEY": api_key}
+    for i in range(0, len(user_ids), BULK_MAX):
+        payload = {"user_ids": user_ids[i:i + BULK_MAX]}
+        async with session.post("https://api.loopy5418.dev/admin/bulk/delete-key", json=payload, headers=headers) as resp:
+            data = await resp.json()
+            if not data.get("success"):
+                raise RuntimeError(data.get("error", "Unknown error"))
+            revoked.update(r["user_id"] for r in data["results"] if r["success"])
+    return revoked
+
+async def flush_leaves():
+    global leave_flush
+    await asyncio.sleep(LEAVE_BATCH_SECONDS)
+    members = dict(pending_leaves)
+    pending_leaves.clear()
+    leave_flush = None
+    notify_channel = bot.get_channel(MOD_CHANNEL_ID)
+    names = ", ".join(str(m) for m in members.values())
+
     async with aiohttp.ClientSession() as session:
         if not await check_api_up(session):
             if notify_channel:
-                await notify_channel.send(f"{member} left the server, but the API is currently down.")
+                await notify_channel.send(f"{names} left the server, but the API is currently down.")
             return
 
         api_key = get_admin_api_key()
         if not api_key:
             if notify_channel:
-                await notify_channel.send(f"{member} left the server, but admin API key is not configured.")
+                await notify_channel.send(f"{names} left the server, but admin API key is not configured.")
             return
 
-        url = f"https://api.loopy5418.dev/admin/delete-key?user_id={member.id}"
-        headers = {"X-API-KEY": api_key}
-
         try:
-            async with session.delete(url, headers=headers) as resp:
-                data = await resp.json()
-                if data.get("success"):
-                    if notify_channel:
-                        await notify_channel.send(f"Revoked API key for {member}. They left the server.")
-                else:
-                    if notify_channel:
-                        await notify_channel.send(f"Failed to revoke API key for {member}: {data.get('message')}")
+            revoked = await revoke_keys(session, api_key, list(members))
+            if notify_channel and revoked:
+                who = ", ".join(str(members[user_id]) for user_id in revoked)
+                await notify_channel.send(f"Revoked API keys for {who}. They left the server.")
         except Exception as e:
             if notify_channel:
-                await notify_channel.send(f"Error revoking API key for {member}: {str(e)}")
+                await notify_channel.send(f"Error revoking API keys for {names}: {str(e)}")
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    global leave_flush
+    pending_leaves[str(member.id)] = member
+    if leave_flush is None:
+        leave_flush = asyncio.create_task(flush_leaves())
+
+@bot.slash_command(name="admin-key-reconcile", description="(ADMIN ONLY) Revoke the API keys of everyone no longer in the server.")
+async def key_reconcile(ctx: discord.ApplicationContext):
+    if not is_admin(ctx):
+        await ctx.respond("You don't have permission to use this command.", ephemeral=True)
+        return
+
+    await ctx.defer()
+    async with aiohttp.ClientSession() as session:
+        if not await check_api_up(session):
+            await ctx.respond("The API is currently down.")
+            return
+
+        api_key = get_admin_api_key()
+        if not api_key:
+            await ctx.respond("Missing ADMIN_API_KEYS configuration.")
+            return
+
+        # Every key holder missing from the member cache gets revoked, so the
+        # cache has to be complete first.
+        guild = ctx.guild
+        if guild is None:
+            await ctx.respond("This command only works in a server.")
+            return
+        if not guild.chunked:
+            try:
+                await guild.chunk()
+            except Exception as e:
+                await ctx.respond(f"Could not load the member list: {e}")
+                return
+        if not guild.chunked or len(guild.members) < (guild.member_count or 0):
+            await ctx.respond(
+                f"Only {len(guild.members)} of {guild.member_count} members are loaded; "
+                "not revoking anything. Try again in a minute."
+            )
+            return
+
+        members = {str(m.id) for m in guild.members}
+        holders, after = [], ""
+        try:
+            while after is not None:
+                url = "https://api.loopy5418.dev/admin/bulk/key-holders"
+                async with session.get(url, params={"after": after}, headers={"X-API-KEY": api_key}) as resp:
+                    data = await resp.json()
+                holders += data["user_ids"]
+                after = data["next"]
+            departed = [user_id for user_id in holders if user_id not in members]
+            revoked = await revoke_keys(session, api_key, departed) if departed else set()
+        except Exception as e:
+            await ctx.respond(f"Reconciliation failed: {e}")
+            return
+
+        await ctx.respond(f"Checked {len(holders)} API keys against {len(members)} members; revoked {len(revoked)}.")
 
 @bot.command(name="addWiki")
 async def add_wiki(ctx: commands.Context, title: str = None, desc: str = None, *, rest: str = None):
@@ -0,0 +1,40 @@
+# Loaded by bin/run.sh. Each worker owns its own pools; these hooks make sure
+# they are created after the fork and shut down cleanly when a worker exits.
+
+
+def on_starting(server):
+    from api import metrics
+
+    # Counters start from zero with the new master; Prometheus sees a reset.
+    metrics.store.reset()
+
+
+def post_worker_init(worker):
+    from api import db, metrics, status_stream, webhooks
+
+    try:
+        db.get_pool().warm()
+    except Exception as e:
+        worker.log.warning(f"Could not warm database pool: {e}")
+    # Picks up deliveries queued before a restart, not just new ones.
+    webhooks.dispatcher.start()
+    status_stream.broadcaster.start()
+    metrics.store.start()
+
+
+def worker_exit(server, worker):
+    from api import db, metrics
+    from api.aio import background_loop
+    from api.render_pool import render_pool
+
+    background_loop.shutdown()
+    render_pool.shutdown()
+    db.close_pool()
+    metrics.store.flush()
+
+
+def child_exit(server, worker):
+    from api import metrics
+
+    # Runs in the master for every exit, killed workers included.
+    metrics.store.retire(worker.pid)
@@ -0,0 +1,113 @@
+"""API-key lookup latency as the key table grows.
+
+Fills scratch (temporary) tables with 1k..1M keys and times the query
+checkapikey() runs on a cache miss, against both layouts:
+
+  hashed  -- key_hash BYTEA with a unique index (the current schema)
+  legacy  -- plaintext api_key TEXT with no index (the old schema)
+
+    DATABASE_URL=postgres://... python tests/load/bench_key_lookup.py
+
+Nothing is written to the real api_keys table.
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+import uuid
+
+# Run as a script, so make the repo root importable.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from api import auth, db  # noqa: E402
+
+
+def key_for(i):
+    # Same formula as the SQL below, so lookups hit existing rows.
+    return str(uuid.UUID(hashlib.md5(f"k{i}".encode()).hexdigest()))
+
+
+def fill(c, size):
+    c.execute("DROP TABLE IF EXISTS bench_keys_hashed, bench_keys_legacy")
+    c.execute("CREATE TEMP TABLE bench_keys_hashed (LIKE api_keys INCLUDING ALL)")
+    c.execute(
+        "CREATE TEMP TABLE bench_keys_legacy (user_id TEXT PRIMARY KEY, api_key TEXT NOT NULL)"
+    )
+    c.execute(
+        f"""
+        INSERT INTO bench_keys_hashed (user_id, key_hash, key_prefix)
+        SELECT 'u' || i, sha256(convert_to(k, 'UTF8')), left(k, {auth.KEY_PREFIX_LENGTH})
+        FROM (SELECT i, md5('k' || i)::uuid::text AS k FROM generate_series(1, %s) i) keys
+    """,
+        (size,),
+    )
+    c.execute(
+        """
+        INSERT INTO bench_keys_legacy (user_id, api_key)
+        SELECT 'u' || i, md5('k' || i)::uuid::text FROM generate_series(1, %s) i
+    """,
+        (size,),
+    )
+    c.execute("ANALYZE bench_keys_hashed")
+    c.execute("ANALYZE bench_keys_legacy")
+
+
+def time_lookups(c, sql, args_for, size, lookups):
+    samples = []
+    for _ in range(lookups):
+        args = args_for(key_for(random.randint(1, size)))
+        started = time.perf_counter()
+        c.execute(sql, args)
+        assert c.fetchone() is not None
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument(
+        "--legacy-lookups",
+        type=int,
+        default=50,
+        help="the unindexed scan is slow at large sizes",
+    )
+    args = parser.parse_args()
+
+    conn = db.connect()
+    conn.autocommit = True
+    c = conn.cursor()
+    print(
+        f"{'keys':>9} {'hashed p50 us':>14} {'p99 us':>8} {'legacy p50 us':>14} {'p99 us':>8}"
+    )
+    for size in (int(s) for s in args.sizes.split(",")):
+        fill(c, size)
+        hashed = time_lookups(
+            c,
+            "SELECT 1 FROM bench_keys_hashed WHERE key_hash = %s",
+            lambda key: (auth.hash_key(key),),
+            size,
+            args.lookups,
+        )
+        legacy = time_lookups(
+            c,
+            "SELECT 1 FROM bench_keys_legacy WHERE api_key = %s",
+            lambda key: (key,),
+            size,
+            args.legacy_lookups,
+        )
+        print(
+            f"{size:>9} {hashed[0]:>14.0f} {hashed[1]:>8.0f} {legacy[0]:>14.0f} {legacy[1]:>8.0f}"
+        )
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Per-request cost of the request metrics hooks, measured on /health.
+
+Drives the Flask app's WSGI callable directly (no server, no sockets) so the
+hooks are the only difference between the two runs:
+
+  off -- start_request_timer / record_request_metrics unregistered
+  on  -- the app as deployed
+
+Rounds alternate between the two to cancel out drift, and the fastest round
+of each counts (scheduler noise only ever adds time). Since that difference
+is small next to the noise on a busy box, the two hooks are also timed on
+their own inside a /health request context.
+
+    DATABASE_URL=postgres://... python tests/load/bench_request_metrics.py
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+from flask import Response
+
+# Run as a script, so make the repo root importable.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from api.app import app, record_request_metrics, start_request_timer  # noqa: E402
+
+
+def environ():
+    return {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": "/health",
+        "QUERY_STRING": "",
+        "SCRIPT_NAME": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(b""),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def per_request_us(requests):
+    started = time.perf_counter()
+    for _ in range(requests):
+        for _ in app.wsgi_app(environ(), start_response):
+            pass
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def set_hooks(enabled):
+    before, after = app.before_request_funcs.setdefault(
+        None, []
+    ), app.after_request_funcs.setdefault(None, [])
+    if enabled and start_request_timer not in before:
+        before.insert(0, start_request_timer)
+        after.append(record_request_metrics)
+    elif not enabled and start_request_timer in before:
+        before.remove(start_request_timer)
+        after.remove(record_request_metrics)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=15)
+    args = parser.parse_args()
+
+    per_request_us(1000)
+    off, on = [], []
+    for _ in range(args.rounds):
+        for enabled, results in ((False, off), (True, on)):
+            set_hooks(enabled)
+            results.append(per_request_us(args.requests))
+    set_hooks(True)
+
+    response = Response("OK")
+    with app.request_context(environ()) as ctx:
+        ctx.match_request()
+        started = time.perf_counter()
+        for _ in range(100000):
+            start_request_timer()
+            record_request_metrics(response)
+        hooks_us = (time.perf_counter() - started) / 100000 * 1e6
+
+    off_us, on_us = min(off), min(on)
+    print(f"/health without metrics  {off_us:7.1f} us/request")
+    print(f"/health with metrics     {on_us:7.1f} us/request")
+    print(
+        f"difference               {on_us - off_us:7.1f} us/request ({(on_us - off_us) / off_us:.1%})"
+    )
+    print(
+        f"hooks alone              {hooks_us:7.2f} us/request ({hooks_us / off_us:.1%})"
+    )
+
+
+if __name__ == "__main__":
+    main()
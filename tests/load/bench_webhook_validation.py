@@ -0,0 +1,185 @@
+"""Micro-benchmark: the schema-driven webhook validator against the
+hand-written validate_embed it replaced.
+
+    python tests/load/bench_webhook_validation.py
+
+The legacy function is copied verbatim below and, as in the old
+/webhook-send handler, redefined on every call. Note the schema validator also
+enforces Discord's length/count limits, which the legacy one never checked.
+"""
+
+import os
+import sys
+import timeit
+
+# Run as a script, so make the repo root importable.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from api.webhook_schema import validate_message  # noqa: E402
+
+
+def legacy_payload(data):
+    def validate_embed(embed):
+        """Validate one embed dict and return a cleaned version or raise ValueError."""
+        if not isinstance(embed, dict):
+            raise ValueError("Each embed must be an object.")
+
+        embed_obj = {}
+
+        if "title" in embed:
+            if not isinstance(embed["title"], str):
+                raise ValueError("'title' must be a string.")
+            embed_obj["title"] = embed["title"]
+
+        if "description" in embed:
+            if not isinstance(embed["description"], str):
+                raise ValueError("'description' must be a string.")
+            embed_obj["description"] = embed["description"]
+
+        if "url" in embed:
+            if not isinstance(embed["url"], str):
+                raise ValueError("'url' must be a string.")
+            embed_obj["url"] = embed["url"]
+
+        if "color" in embed:
+            if not isinstance(embed["color"], int):
+                raise ValueError("'color' must be an integer.")
+            embed_obj["color"] = embed["color"]
+
+        if "author" in embed:
+            if not isinstance(embed["author"], dict):
+                raise ValueError("'author' must be an object.")
+            author = {}
+            if "name" in embed["author"]:
+                if not isinstance(embed["author"]["name"], str):
+                    raise ValueError("'author.name' must be a string.")
+                author["name"] = embed["author"]["name"]
+            if "url" in embed["author"]:
+                if not isinstance(embed["author"]["url"], str):
+                    raise ValueError("'author.url' must be a string.")
+                author["url"] = embed["author"]["url"]
+            if "icon_url" in embed["author"]:
+                if not isinstance(embed["author"]["icon_url"], str):
+                    raise ValueError("'author.icon_url' must be a string.")
+                author["icon_url"] = embed["author"]["icon_url"]
+            if author:
+                embed_obj["author"] = author
+
+        if "footer" in embed:
+            if not isinstance(embed["footer"], dict):
+                raise ValueError("'footer' must be an object.")
+            footer = {}
+            if "text" in embed["footer"]:
+                if not isinstance(embed["footer"]["text"], str):
+                    raise ValueError("'footer.text' must be a string.")
+                footer["text"] = embed["footer"]["text"]
+            if "icon_url" in embed["footer"]:
+                if not isinstance(embed["footer"]["icon_url"], str):
+                    raise ValueError("'footer.icon_url' must be a string.")
+                footer["icon_url"] = embed["footer"]["icon_url"]
+            if footer:
+                embed_obj["footer"] = footer
+
+        if "fields" in embed:
+            if not isinstance(embed["fields"], list):
+                raise ValueError("'fields' must be a list.")
+            fields = []
+            for field in embed["fields"]:
+                if not isinstance(field, dict):
+                    raise ValueError("Each field in 'fields' must be an object.")
+                if "name" not in field or "value" not in field:
+                    raise ValueError("Each field must have 'name' and 'value'.")
+                if not isinstance(field["name"], str) or not isinstance(
+                    field["value"], str
+                ):
+                    raise ValueError("'field.name' and 'field.value' must be strings.")
+                field_obj = {
+                    "name": field["name"],
+                    "value": field["value"],
+                    "inline": bool(field.get("inline", False)),
+                }
+                fields.append(field_obj)
+            embed_obj["fields"] = fields
+
+        if "image" in embed:
+            if (
+                not isinstance(embed["image"], dict)
+                or "url" not in embed["image"]
+                or not isinstance(embed["image"]["url"], str)
+            ):
+                raise ValueError("'image' must be an object with a string 'url'.")
+            embed_obj["image"] = {"url": embed["image"]["url"]}
+
+        if "thumbnail" in embed:
+            if (
+                not isinstance(embed["thumbnail"], dict)
+                or "url" not in embed["thumbnail"]
+                or not isinstance(embed["thumbnail"]["url"], str)
+            ):
+                raise ValueError("'thumbnail' must be an object with a string 'url'.")
+            embed_obj["thumbnail"] = {"url": embed["thumbnail"]["url"]}
+
+        return embed_obj
+
+    payload = {}
+    for key in ("content", "username", "avatar_url"):
+        if data.get(key):
+            if not isinstance(data[key], str):
+                raise ValueError(f"'{key}' must be a string.")
+            payload[key] = data[key]
+    if data.get("embeds"):
+        if not isinstance(data["embeds"], list):
+            raise ValueError("'embeds' must be a list.")
+        payload["embeds"] = [validate_embed(embed) for embed in data["embeds"]]
+    return payload
+
+
+def sample(embeds, fields):
+    return {
+        "content": "Deploy finished",
+        "username": "ci-bot",
+        "embeds": [
+            {
+                "title": f"Build #{i}",
+                "description": "All checks passed. " * 5,
+                "url": "https://example.com/build",
+                "color": 0x2ECC71,
+                "author": {"name": "ci", "icon_url": "https://example.com/ci.png"},
+                "footer": {"text": "main @ 1a2b3c4"},
+                "fields": [
+                    {"name": f"step {j}", "value": "ok", "inline": True}
+                    for j in range(fields)
+                ],
+                "thumbnail": {"url": "https://example.com/t.png"},
+            }
+            for i in range(embeds)
+        ],
+    }
+
+
+def main():
+    for label, data in [
+        ("content only", {"content": "hello"}),
+        ("1 embed, 3 fields", sample(1, 3)),
+        ("10 embeds, 25 fields", sample(10, 25)),
+    ]:
+        assert validate_message(data) == legacy_payload(data)
+        number = 2000 if len(data.get("embeds", [])) < 10 else 50
+        # Alternate the two in short rounds, so a burst of load on the machine
+        # slows both down rather than skewing the ratio.
+        legacy = schema = float("inf")
+        for _ in range(50):
+            legacy = min(
+                legacy, timeit.timeit(lambda: legacy_payload(data), number=number)
+            )
+            schema = min(
+                schema, timeit.timeit(lambda: validate_message(data), number=number)
+            )
+        legacy, schema = legacy / number, schema / number
+        print(
+            f"{label:<22} legacy {legacy * 1e6:8.2f} us   schema {schema * 1e6:8.2f} us   ({legacy / schema:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
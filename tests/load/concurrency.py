@@ -0,0 +1,88 @@
+"""Closed-loop concurrency sweep against a running server.
+
+Runs N concurrent clients that each issue requests back to back for a fixed
+duration and reports throughput and latency per concurrency level. Point it at
+the same route under both deployment modes to compare how they scale:
+
+    SERVER_MODE=wsgi PORT=8080 bash bin/run.sh
+    python tests/load/concurrency.py http://localhost:8080 "/roblox-user-search?key=...&username=builderman"
+
+    SERVER_MODE=asgi PORT=8080 bash bin/run.sh
+    python tests/load/concurrency.py http://localhost:8080 "/roblox-user-search?key=...&username=builderman"
+
+To take the real proxy (and its rate limits) out of the picture, start
+tests/load/fake_roproxy.py and point the server at it with
+ROPROXY_USERS_URL / ROPROXY_APIS_URL (see that file).
+
+With upstream-bound routes the sync workers flatten out at workers x threads
+in-flight requests, while the ASGI workers keep scaling until the per-upstream
+concurrency caps (UPSTREAM_<NAME>_CONCURRENCY) are reached.
+"""
+
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+
+async def client(session, url, deadline, latencies, errors):
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            async with session.get(url) as resp:
+                await resp.read()
+                if resp.status >= 500 or resp.status == 429:
+                    errors.append(resp.status)
+                    continue
+        except aiohttp.ClientError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.monotonic() - started)
+
+
+async def sweep(base, path, levels, duration):
+    url = base.rstrip("/") + path
+    print(f"{'concurrency':>11} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for level in levels:
+        latencies, errors = [], []
+        connector = aiohttp.TCPConnector(limit=level)
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=120)
+        ) as session:
+            deadline = time.monotonic() + duration
+            await asyncio.gather(
+                *(
+                    client(session, url, deadline, latencies, errors)
+                    for _ in range(level)
+                )
+            )
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+        print(
+            f"{level:>11} {len(latencies) / duration:>8.1f} {p50:>8.1f} {p99:>8.1f} {len(errors):>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("base", help="server base URL, e.g. http://localhost:8080")
+    parser.add_argument("path", help="request path including query string")
+    parser.add_argument(
+        "--levels",
+        default="1,4,16,32,64,128",
+        help="comma-separated concurrency levels",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="seconds per level"
+    )
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(",")]
+    asyncio.run(sweep(args.base, args.path, levels, args.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""A stand-in for users.roproxy.com / apis.roproxy.com with a fixed latency.
+
+Serves the three endpoints the Roblox routes call, each answering after
+--delay seconds, so tests/load/concurrency.py can compare the deployment
+modes without hitting (or being rate limited by) the real proxy:
+
+    python tests/load/fake_roproxy.py --port 9000 --delay 0.2
+    ROPROXY_USERS_URL=http://127.0.0.1:9000 ROPROXY_APIS_URL=http://127.0.0.1:9000 \\
+        ROBLOX_API_KEY=fake SERVER_MODE=asgi PORT=8080 bash bin/run.sh
+"""
+
+import argparse
+import asyncio
+
+from aiohttp import web
+
+
+def make_app(delay):
+    async def search(request):
+        await asyncio.sleep(delay)
+        keyword = request.query.get("keyword", "")
+        return web.json_response(
+            {"data": [{"id": 156, "name": keyword, "displayName": keyword}]}
+        )
+
+    async def user(request):
+        await asyncio.sleep(delay)
+        user_id = int(request.match_info["user_id"])
+        return web.json_response(
+            {
+                "id": user_id,
+                "name": f"user{user_id}",
+                "displayName": f"user{user_id}",
+                "description": "",
+                "created": "2006-02-27T21:06:40.3Z",
+                "isBanned": False,
+            }
+        )
+
+    async def thumbnail(request):
+        await asyncio.sleep(delay)
+        return web.json_response(
+            {"done": True, "response": {"imageUri": "https://example.com/avatar.png"}}
+        )
+
+    app = web.Application()
+    app.router.add_get("/v1/users/search", search)
+    app.router.add_get(r"/v1/users/{user_id:\d+}", user)
+    app.router.add_get(r"/cloud/v2/users/{user_id:\d+}:generateThumbnail", thumbnail)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--delay", type=float, default=0.2, help="seconds before every response"
+    )
+    args = parser.parse_args()
+    web.run_app(make_app(args.delay), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Open N status-page viewers (GET /status/stream) against a running server.
+
+Reports how many viewers got a live stream, how many got a one-sample poll
+response instead (past STATUS_STREAM_MAX / ASGI_STATUS_STREAMS per worker;
+they are not retried here), and how many status events the streams received.
+With an admin key it also prints the serving worker's broadcaster stats:
+`published` grows with time, not with the number of viewers.
+
+    SERVER_MODE=asgi PORT=8080 bash bin/run.sh
+    python tests/load/status_viewers.py http://localhost:8080 --viewers 500 --admin-key ...
+"""
+
+import argparse
+import asyncio
+
+import aiohttp
+
+
+async def viewer(session, url, counts):
+    events = 0
+    try:
+        async with session.get(url) as resp:
+            if resp.status != 200:
+                counts["errors"] += 1
+                return
+            async for line in resp.content:
+                if line.startswith(b"event: status"):
+                    events += 1
+        # The server ended the response itself: every slot was taken.
+        counts["polled"] += 1
+    except asyncio.CancelledError:
+        counts["streamed"] += 1
+        counts["events"] += events
+        raise
+    except aiohttp.ClientError:
+        counts["errors"] += 1
+
+
+async def run(base, viewers, duration, admin_key):
+    base = base.rstrip("/")
+    counts = {"streamed": 0, "polled": 0, "errors": 0, "events": 0}
+    async with aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=0)
+    ) as session:
+        tasks = [
+            asyncio.ensure_future(viewer(session, base + "/status/stream", counts))
+            for _ in range(viewers)
+        ]
+        await asyncio.sleep(duration)
+        if admin_key:
+            async with session.get(
+                base + "/admin/stats", headers={"X-API-KEY": admin_key}
+            ) as resp:
+                print(
+                    "broadcaster (one worker):", (await resp.json())["status_streams"]
+                )
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    per_viewer = counts["events"] / counts["streamed"] if counts["streamed"] else 0
+    print(
+        f"streamed {counts['streamed']}, polled {counts['polled']}, errors {counts['errors']}, "
+        f"{counts['events']} events ({per_viewer:.1f} per viewer in {duration}s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("base")
+    parser.add_argument("--viewers", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--admin-key")
+    args = parser.parse_args()
+    asyncio.run(run(args.base, args.viewers, args.duration, args.admin_key))
+
+
+if __name__ == "__main__":
+    main()
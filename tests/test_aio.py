@@ -0,0 +1,33 @@
+import asyncio
+import concurrent.futures
+
+import pytest
+
+from api.aio import BackgroundLoop
+
+
+def test_run_returns_result_on_shared_loop():
+    bg = BackgroundLoop()
+    try:
+
+        async def which_loop():
+            return asyncio.get_running_loop()
+
+        assert bg.run(which_loop()) is bg.run(which_loop())
+    finally:
+        bg.shutdown()
+
+
+def test_timeout_cancels_and_shutdown_runs_hooks():
+    bg = BackgroundLoop()
+    closed = []
+
+    async def hook():
+        closed.append(True)
+
+    bg.on_shutdown(hook)
+    with pytest.raises(concurrent.futures.TimeoutError):
+        bg.run(asyncio.sleep(5), timeout=0.05)
+    bg.shutdown()
+    assert closed == [True]
+    assert not bg.stats()["running"]
@@ -1,5 +1,13 @@
+import asyncio
+import concurrent.futures.process
+import os
+import time
+
 import pytest
+from werkzeug.test import EnvironBuilder
 from api.app import app
+from api import db, qr, status_stream, sysmon, upstream, webhooks
+from api.ratelimit import ROUTE_CLASSES
 
 
 @pytest.fixture
@@ -8,9 +16,346 @@ def client():
         yield client
 
 
+@pytest.fixture
+def api_key(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_API_KEYS", "admin")
+    admin = {"X-API-KEY": "admin"}
+    client.delete("/admin/delete-key?user_id=test-fixture-user", headers=admin)
+    yield client.post(
+        "/admin/generate-key", headers=admin, json={"user_id": "test-fixture-user"}
+    ).json["api_key"]
+    client.delete("/admin/delete-key?user_id=test-fixture-user", headers=admin)
+
+
 def test_index(client):
     assert client.get("/").status_code == 200
 
 
 def test_health(client):
     assert client.get("/health").status_code == 200
+
+
+def test_sysinfo_serves_sampled_history(client, monkeypatch):
+    sampler = sysmon.Sampler(interval=1, size=10)
+    monkeypatch.setattr(sysmon, "sampler", sampler)
+    sampler._pid = os.getpid()  # no background thread: samples are added by hand
+    now = time.time()
+    for age, cpu in ((9.5, 10), (8.5, 30), (0.5, 50)):
+        sampler.samples.append(
+            {**sysmon.take_sample(), "sampled_at": now - age, "cpu_usage_percent": cpu}
+        )
+    info = client.get("/sysinfo").json
+    assert (
+        info["cpu_usage_percent"] == 50
+        and len(info["load_average"]) == 3
+        and info["workers"]
+    )
+    series = client.get("/sysinfo/history?window=10&points=2").json["series"]
+    assert [
+        (p["samples"], p["cpu_usage_percent"], p["cpu_usage_percent_max"])
+        for p in series
+    ] == [(2, 20, 30), (1, 50, 50)]
+    assert client.get("/sysinfo/history?window=11").status_code == 400
+
+
+def test_status_stream_fans_out_samples(client, monkeypatch):
+    broadcaster = status_stream.StatusBroadcaster(max_streams=1, heartbeat=1)
+    monkeypatch.setattr(status_stream, "broadcaster", broadcaster)
+    broadcaster.publish({**sysmon.take_sample(), "cpu_usage_percent": 12.5})
+    response = client.get("/status/stream", buffered=False)
+    assert response.mimetype == "text/event-stream"
+    frames = iter(response.response)
+    assert next(frames).startswith(b"retry:")
+    assert b'"cpu_usage_percent": 12.5' in next(frames)
+    polled = client.get("/status/stream")
+    assert (
+        polled.status_code == 200
+        and polled.data.startswith(b"retry:")
+        and polled.data.count(b"event: status") == 1
+    )
+    assert next(frames) == status_stream.HEARTBEAT
+    broadcaster.publish({**sysmon.take_sample(), "cpu_usage_percent": 99.0})
+    assert b'"cpu_usage_percent": 99.0' in next(frames)
+    response.close()
+    assert broadcaster.stats()["streams"] == 0
+
+
+def test_status_stream_closed_before_first_frame_frees_its_slot(monkeypatch):
+    broadcaster = status_stream.StatusBroadcaster(max_streams=1)
+    monkeypatch.setattr(status_stream, "broadcaster", broadcaster)
+    # As a WSGI server does when the client is gone before the first write
+    # (the test client would pull a frame first).
+    body = app(
+        EnvironBuilder(path="/status/stream").get_environ(),
+        lambda status, headers: None,
+    )
+    assert broadcaster.stats()["streams"] == 1
+    body.close()
+    assert broadcaster.stats()["streams"] == 0
+
+
+def test_webhook_batch_reports_the_invalid_message(client):
+    response = client.post(
+        "/webhook-send",
+        json={
+            "url": "https://discord.com/api/webhooks/1/token",
+            "messages": [{"content": "ok"}, {"embeds": [{"title": 5}]}],
+        },
+    )
+    assert response.status_code == 400
+    assert response.json["error"] == "'messages[1].embeds[0].title' must be a string."
+
+
+def test_queued_webhook_send_needs_a_key_and_charges_per_message(
+    client, api_key, monkeypatch
+):
+    monkeypatch.setattr(webhooks.dispatcher, "wake", lambda: None)
+    body = {
+        "url": "https://discord.com/api/webhooks/1/token",
+        "messages": [{"content": "one"}, {"content": "two"}],
+    }
+    response = client.post("/webhook-send", json=body)
+    assert response.status_code == 400 and "Missing api key" in response.json["error"]
+    single = {"url": body["url"], "content": "one", "async": True}
+    assert client.post("/webhook-send", json=single).status_code == 400
+
+    response = client.post("/webhook-send", json={**body, "api_key": api_key})
+    ids = response.json["delivery_ids"]
+    try:
+        assert response.status_code == 202 and len(ids) == 2
+        capacity = ROUTE_CLASSES["upstream"][0]
+        assert int(response.headers["X-RateLimit-Remaining"]) == capacity - 2
+    finally:
+        with db.get_pool().getconn() as conn:
+            conn.cursor().execute(
+                "DELETE FROM webhook_deliveries WHERE id = ANY(%s)", (ids,)
+            )
+            conn.commit()
+
+
+def test_qr_render_failures_are_not_500s(client, api_key, monkeypatch):
+    def broken(*args, **kwargs):
+        raise concurrent.futures.process.BrokenProcessPool()
+
+    response = client.get(f"/qr?key={api_key}&data={'x' * 8000}")
+    assert response.status_code == 400 and "Too much data" in response.json["error"]
+
+    monkeypatch.setattr(qr.render_pool, "run", broken)
+    response = client.get(f"/qr?key={api_key}&data=broken-pool")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+
+
+def test_index_revalidates_with_etag(client):
+    headers = {"User-Agent": "Mozilla/5.0"}
+    first = client.get("/", headers=headers)
+    assert first.status_code == 200 and first.headers["ETag"]
+    again = client.get("/", headers={**headers, "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.data == b""
+
+
+def test_wiki_listing_pages_with_a_cursor(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_API_KEYS", "admin")
+    admin = {"X-API-KEY": "admin"}
+    ids = [
+        client.post(
+            "/wiki/make",
+            headers=admin,
+            json={"title": f"t{i}", "description": "d", "content": "c"},
+        ).json["id"]
+        for i in range(3)
+    ]
+
+    first = client.get("/wiki/get?limit=2")
+    assert [w["id"] for w in first.json][:2] == ids[:0:-1]
+    assert "content" not in first.json[0]
+    second = client.get(
+        f"/wiki/get?limit=2&fields=id,content&cursor={first.headers['X-Next-Cursor']}"
+    )
+    assert second.json[0] == {"id": ids[0], "content": "c"}
+
+    for wiki_id in ids:
+        client.delete(f"/wiki/delete/{wiki_id}", headers=admin)
+    assert ids[2] not in [w["id"] for w in client.get("/wiki/get?limit=2").json]
+
+
+def test_wiki_search_ranks_title_matches_first(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_API_KEYS", "admin")
+    admin = {"X-API-KEY": "admin"}
+    in_content = client.post(
+        "/wiki/make",
+        headers=admin,
+        json={
+            "title": "Setup",
+            "description": "d",
+            "content": "Install 1 < 2 zebrafish package",
+        },
+    ).json["id"]
+    in_title = client.post(
+        "/wiki/make",
+        headers=admin,
+        json={"title": "Zebrafish", "description": "d", "content": "c"},
+    ).json["id"]
+
+    try:
+        results = client.get("/wiki/search?q=zebrafish").json
+        assert [r["id"] for r in results] == [in_title, in_content]
+        assert "1 &lt; 2 <mark>zebrafish</mark>" in results[1]["snippet"]
+        assert client.get("/wiki/search").status_code == 400
+    finally:
+        for wiki_id in (in_content, in_title):
+            client.delete(f"/wiki/delete/{wiki_id}", headers=admin)
+
+
+def test_generated_key_is_stored_hashed_and_works_until_deleted(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_API_KEYS", "admin")
+    admin = {"X-API-KEY": "admin"}
+    client.delete("/admin/delete-key?user_id=test-user", headers=admin)
+
+    created = client.post(
+        "/admin/generate-key", headers=admin, json={"user_id": "test-user"}
+    ).json
+    assert created["success"] and created["api_key"].startswith(created["key_prefix"])
+    again = client.post(
+        "/admin/generate-key", headers=admin, json={"user_id": "test-user"}
+    ).json
+    assert (
+        not again["success"]
+        and "api_key" not in again
+        and again["key_prefix"] == created["key_prefix"]
+    )
+    assert (
+        client.get(
+            f"/admin/get-user-id?api_key={created['api_key']}", headers=admin
+        ).json["user_id"]
+        == "test-user"
+    )
+    assert client.get(f"/qr?key={created['api_key']}&data=hi").status_code == 200
+
+    client.delete("/admin/delete-key?user_id=test-user", headers=admin)
+    assert client.get(f"/qr?key={created['api_key']}&data=hi").status_code == 403
+
+
+def test_bulk_key_admin_reports_per_user(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_API_KEYS", "admin")
+    admin = {"X-API-KEY": "admin"}
+    client.post(
+        "/admin/bulk/delete-key",
+        headers=admin,
+        json={"user_ids": ["bulk-1", "bulk-2", "bulk-3"]},
+    )
+    client.post("/admin/generate-key", headers=admin, json={"user_id": "bulk-1"})
+
+    generated = client.post(
+        "/admin/bulk/generate-key",
+        headers=admin,
+        json={"user_ids": ["bulk-1", "bulk-2", "bulk-2", "bulk-3"]},
+    ).json
+    assert [(r["user_id"], r["success"]) for r in generated["results"]] == [
+        ("bulk-1", False),
+        ("bulk-2", True),
+        ("bulk-3", True),
+    ]
+
+    deleted = client.post(
+        "/admin/bulk/delete-key",
+        headers=admin,
+        json={"user_ids": ["bulk-2", "bulk-missing"]},
+    ).json
+    assert [r["success"] for r in deleted["results"]] == [True, False]
+    found = client.post(
+        "/admin/bulk/get-key",
+        headers=admin,
+        json={"user_ids": ["bulk-1", "bulk-2", "bulk-3"]},
+    ).json
+    assert [r["success"] for r in found["results"]] == [True, False, True]
+
+    page = client.get(
+        "/admin/bulk/key-holders?after=bulk-0&limit=1", headers=admin
+    ).json
+    assert page["user_ids"] == ["bulk-1"] and page["next"] == "bulk-1"
+    for limit in ("0", "-1", "x"):
+        response = client.get(f"/admin/bulk/key-holders?limit={limit}", headers=admin)
+        assert response.status_code == 400
+
+    assert (
+        client.post(
+            "/admin/bulk/delete-key", headers=admin, json={"user_ids": "bulk-1"}
+        ).status_code
+        == 400
+    )
+    client.post(
+        "/admin/bulk/delete-key", headers=admin, json={"user_ids": ["bulk-1", "bulk-3"]}
+    )
+
+
+class FakeRobloxResponse:
+    def __init__(self, data, status_code=200):
+        self.data, self.status_code, self.ok = data, status_code, status_code < 400
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+
+def test_roblox_batch_charges_per_user_and_isolates_failures(
+    client, api_key, monkeypatch
+):
+    monkeypatch.setenv("ROBLOX_API_KEY", "roblox")
+
+    async def fake_aget(name, url, **kwargs):
+        if "generateThumbnail" in url:
+            return FakeRobloxResponse({"response": {"imageUri": "https://img"}})
+        user_id = url.rsplit("/", 1)[1]
+        if user_id == "2":
+            return FakeRobloxResponse(ValueError("not JSON"))
+        if user_id == "3":
+            raise RuntimeError("boom")
+        return FakeRobloxResponse({"id": int(user_id), "name": "u"})
+
+    monkeypatch.setattr(upstream, "aget", fake_aget)
+
+    response = client.post(
+        "/roblox-user-info/batch", json={"api_key": api_key, "user_ids": [1, "2", 3]}
+    )
+    assert [(r["status"], r["success"]) for r in response.json["results"]] == [
+        (200, True),
+        (500, False),
+        (500, False),
+    ]
+    assert (
+        int(response.headers["X-RateLimit-Remaining"])
+        == ROUTE_CLASSES["upstream"][0] - 3
+    )
+
+    bad = client.post(
+        "/roblox-user-info/batch", json={"api_key": api_key, "user_ids": ["1/../../x"]}
+    )
+    assert bad.status_code == 400
+
+
+def test_currency_lists_need_the_bulk_parameters(client, api_key):
+    for query in ("target=USD&amount=1,000", "target=USD,EUR&amount=1"):
+        response = client.get(f"/currency-converter?key={api_key}&base=EUR&{query}")
+        assert (
+            response.status_code == 400 and "comma-separated" in response.json["error"]
+        )
+
+
+def test_async_view_timeout_is_a_504(client, monkeypatch):
+    async def slow_apost(name, url, **kwargs):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(upstream, "apost", slow_apost)
+    monkeypatch.setattr("api.app.ASYNC_TIMEOUT", 0.05)
+    response = client.post(
+        "/webhook-send", json={"url": "https://discord.test/hook", "content": "hi"}
+    )
+    assert response.status_code == 504 and response.json == {
+        "error": "Upstream timed out",
+        "success": False,
+    }
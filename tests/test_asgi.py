@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+import pytest
+
+from api import status_stream, sysmon, upstream
+from api.app import app
+from api.asgi import AsgiApp
+
+
+@pytest.fixture
+def asgi():
+    asgi = AsgiApp(app, threads=2)
+    yield asgi
+    asgi.executor.shutdown(wait=True)
+
+
+async def call(asgi, method, path, body=b"", headers=(), disconnect_after=None):
+    """Drive one HTTP request through the adapter with an in-memory
+    receive/send. With disconnect_after, the client goes away once that many
+    non-empty body chunks have arrived."""
+    inbox = asyncio.Queue()
+    inbox.put_nowait({"type": "http.request", "body": body, "more_body": False})
+    sent = []
+
+    async def receive():
+        return await inbox.get()
+
+    async def send(message):
+        sent.append(message)
+        chunks = [
+            m for m in sent if m["type"] == "http.response.body" and m.get("body")
+        ]
+        if disconnect_after is not None and len(chunks) == disconnect_after:
+            inbox.put_nowait({"type": "http.disconnect"})
+
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "scheme": "http",
+        "method": method,
+        "path": path,
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 50000),
+    }
+    await asyncio.wait_for(asgi(scope, receive, send), 10)
+    start, rest = sent[0], sent[1:]
+    assert start["type"] == "http.response.start"
+    assert (
+        rest[-1] == {"type": "http.response.body", "body": b""}
+        or disconnect_after is not None
+    )
+    headers = {k.decode(): v.decode() for k, v in start["headers"]}
+    return start["status"], headers, [m["body"] for m in rest if m.get("body")]
+
+
+class FakeWebhookResponse:
+    status_code = 204
+    text = ""
+
+
+def test_async_route_is_awaited_on_the_server_loop(asgi, monkeypatch):
+    seen = {}
+
+    async def fake_apost(name, url, **kwargs):
+        seen["loop"], seen["url"], seen["json"] = (
+            asyncio.get_running_loop(),
+            url,
+            kwargs["json"],
+        )
+        return FakeWebhookResponse()
+
+    monkeypatch.setattr(upstream, "apost", fake_apost)
+
+    async def main():
+        body = json.dumps(
+            {"url": "https://discord.test/hook", "content": "hi"}
+        ).encode()
+        result = await call(
+            asgi,
+            "POST",
+            "/webhook-send",
+            body,
+            headers=[("Content-Type", "application/json")],
+        )
+        return result, asyncio.get_running_loop()
+
+    (status, headers, chunks), loop = asyncio.run(main())
+    assert status == 200 and json.loads(b"".join(chunks)) == {"success": True}
+    assert seen["loop"] is loop
+    assert (
+        seen["url"] == "https://discord.test/hook" and seen["json"]["content"] == "hi"
+    )
+
+
+def test_sync_route_goes_through_the_thread_pool(asgi):
+    status, headers, chunks = asyncio.run(call(asgi, "GET", "/health"))
+    assert status == 200 and b"".join(chunks) == b"OK"
+    assert headers["content-length"] == "2"
+
+    status, _, _ = asyncio.run(call(asgi, "GET", "/no-such-route"))
+    assert status == 404
+
+
+def test_streamed_response_stops_and_frees_its_slot_on_disconnect(asgi, monkeypatch):
+    broadcaster = status_stream.StatusBroadcaster(max_streams=1, heartbeat=1)
+    monkeypatch.setattr(status_stream, "broadcaster", broadcaster)
+    broadcaster.publish({**sysmon.take_sample(), "cpu_usage_percent": 12.5})
+
+    status, headers, chunks = asyncio.run(
+        call(asgi, "GET", "/status/stream", disconnect_after=2)
+    )
+    assert status == 200 and headers["content-type"].startswith("text/event-stream")
+    assert chunks[0].startswith(b"retry:") and b'"cpu_usage_percent": 12.5' in chunks[1]
+    assert broadcaster.stats()["streams"] == 0
+    assert not broadcaster._subscribers
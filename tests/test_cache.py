@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+from api import prompt_cache
+from api.cache import LRUCache, SingleFlight
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_items=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry_counts_as_miss():
+    cache = LRUCache(max_items=10, ttl=0.01)
+    cache.set("key", True)
+    cache.set("bad", False, ttl=60)
+    time.sleep(0.02)
+    assert cache.get("key") is None
+    assert cache.get("bad") is False
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+
+def test_delete_invalidates():
+    cache = LRUCache()
+    cache.set("key", True)
+    cache.delete("key")
+    assert cache.get("key") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == ["answer"] * 5
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert flight.in_flight() == 0
+
+
+def test_prompt_cache_key_ignores_spacing_only():
+    assert prompt_cache.cache_key(
+        "openai", " hello   there\n"
+    ) == prompt_cache.cache_key("openai", "hello there")
+    assert prompt_cache.cache_key("openai", "hello there") != prompt_cache.cache_key(
+        "openai-fast", "hello there"
+    )
+    assert prompt_cache.cache_key("openai", "Hello there") != prompt_cache.cache_key(
+        "openai", "hello there"
+    )
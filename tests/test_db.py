@@ -0,0 +1,102 @@
+import gc
+import os
+import time
+
+import pytest
+from psycopg2 import extensions
+
+from api import db
+
+
+@pytest.fixture
+def pool():
+    pool = db.ConnectionPool(minconn=1, maxconn=1, timeout=0.2, idle_check=0.01)
+    yield pool
+    pool.close()
+
+
+def backend_pid(conn):
+    with conn.cursor() as c:
+        c.execute("SELECT pg_backend_pid()")
+        return c.fetchone()[0]
+
+
+def test_checkout_and_return_reuses_the_connection(pool):
+    pool.warm()
+    with pool.getconn() as conn:
+        pid = backend_pid(conn)
+        assert pool.stats()["in_use"] == 1
+        with pytest.raises(db.PoolTimeout):
+            pool.getconn()
+    assert conn.closed
+    assert pool.stats()["in_use"] == 0 and pool.stats()["idle"] == 1
+
+    with pool.getconn() as conn:
+        assert backend_pid(conn) == pid
+    stats = pool.stats()
+    assert stats["created"] == 1 and stats["checkouts"] == 2 and stats["timeouts"] == 1
+
+
+def test_failed_block_is_rolled_back_before_reuse(pool):
+    with pytest.raises(RuntimeError):
+        with pool.getconn() as conn:
+            conn.cursor().execute("SELECT 1")
+            raise RuntimeError()
+    with pool.getconn() as conn:
+        assert conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+
+
+def test_broken_idle_connection_is_replaced(pool):
+    with pool.getconn() as conn:
+        pid = backend_pid(conn)
+
+    # Kill the session from outside while it sits idle in the pool, as a
+    # database restart or an idle timeout would.
+    killer = db.connect()
+    try:
+        killer.autocommit = True
+        with killer.cursor() as c:
+            c.execute("SELECT pg_terminate_backend(%s)", (pid,))
+    finally:
+        killer.close()
+    time.sleep(0.05)  # past idle_check, so the next checkout pings first
+
+    with pool.getconn() as conn:
+        assert backend_pid(conn) != pid
+    stats = pool.stats()
+    assert stats["discarded"] == 1 and stats["created"] == 2
+
+
+def test_fork_leaves_the_parents_sessions_alone():
+    pool = db.ConnectionPool(minconn=1, maxconn=2, timeout=1)
+    try:
+        pool.warm()
+        held = pool.getconn()  # checked out across the fork
+        pids = {backend_pid(held)}
+        with pool.getconn() as conn:
+            pids.add(backend_pid(conn))
+        assert len(pids) == 2
+
+        child = os.fork()
+        if child == 0:
+            # Use the pool, give back the inherited checkout, and let the
+            # collector have everything inherited.
+            ok = False
+            try:
+                with pool.getconn() as conn:
+                    ok = backend_pid(conn) not in pids
+                held.close()
+                pool.close()
+                gc.collect()
+            finally:
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(child, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+
+        # Both sessions are still this process's own.
+        assert backend_pid(held) in pids
+        held.close()
+        with pool.getconn() as conn:
+            assert backend_pid(conn) in pids
+    finally:
+        pool.close()
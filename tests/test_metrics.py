@@ -0,0 +1,63 @@
+import time
+
+from api import metrics
+
+
+def other_worker(store, pid, requests):
+    # What another worker's flush would have written.
+    snap = {"counters": {}, "gauges": {("render_queue_depth", ()): 3}, "histograms": {}}
+    counter = (
+        "http_requests_total",
+        (("method", "GET"), ("route", "/health"), ("status", "200")),
+    )
+    snap["counters"][counter] = requests
+    store._conn().execute(
+        "INSERT OR REPLACE INTO workers VALUES (?, ?, ?)",
+        (pid, time.time(), metrics._encode(snap)),
+    )
+
+
+def health_count(snap):
+    return snap["counters"].get(
+        (
+            "http_requests_total",
+            (("method", "GET"), ("route", "/health"), ("status", "200")),
+        ),
+        0,
+    )
+
+
+def test_collect_adds_up_workers_and_keeps_retired_counts(tmp_path):
+    store = metrics.MetricsStore(str(tmp_path / "metrics.sqlite3"), interval=60)
+    metrics.observe_request("/health", "GET", 200, 0.0004)
+    mine = health_count(metrics.snapshot())
+
+    other_worker(store, 999999, 5)
+    merged = store.collect()
+    assert health_count(merged) == mine + 5
+    assert merged["gauges"][("render_queue_depth", (("pid", "999999"),))] == 3
+
+    store.retire(999999)
+    merged = store.collect()
+    assert health_count(merged) == mine + 5
+    assert not any(labels == (("pid", "999999"),) for _, labels in merged["gauges"])
+
+
+def test_render_prometheus_histogram_is_cumulative():
+    snap = {
+        "counters": {},
+        "gauges": {},
+        "histograms": {
+            ("x_seconds", (("route", '/a"b'),)): {
+                "buckets": (0.1, 1),
+                "counts": [2, 1, 1],
+                "sum": 3.5,
+                "count": 4,
+            },
+        },
+    }
+    text = metrics.render_prometheus(snap)
+    assert "# TYPE x_seconds histogram" in text
+    assert 'x_seconds_bucket{route="/a\\"b",le="1"} 3' in text
+    assert 'x_seconds_bucket{route="/a\\"b",le="+Inf"} 4' in text
+    assert 'x_seconds_count{route="/a\\"b"} 4' in text
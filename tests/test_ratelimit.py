@@ -0,0 +1,47 @@
+from api.ratelimit import RateLimiter, _parse_rate, headers_for
+
+
+def make_limiter(tmp_path, quota=100):
+    return RateLimiter(str(tmp_path / "limits.sqlite3"), {"cpu": (2, 0.001)}, quota)
+
+
+def test_bucket_empties_and_sets_retry_after(tmp_path):
+    limiter = make_limiter(tmp_path)
+    assert limiter.hit("key", "cpu")["allowed"]
+    assert limiter.hit("key", "cpu")["remaining"] == 0
+    blocked = limiter.hit("key", "cpu")
+    assert not blocked["allowed"]
+    assert int(headers_for(blocked)["Retry-After"]) > 0
+    assert limiter.hit("other", "cpu")["allowed"]
+
+
+def test_daily_quota(tmp_path):
+    limiter = make_limiter(tmp_path, quota=1)
+    assert limiter.hit("key", "cpu")["quota_remaining"] == 0
+    blocked = limiter.hit("key", "cpu")
+    assert not blocked["allowed"]
+    assert blocked["retry_after"] == blocked["quota_reset"]
+
+
+def test_buckets_shared_between_instances(tmp_path):
+    first, second = make_limiter(tmp_path), make_limiter(tmp_path)
+    first.hit("key", "cpu")
+    first.hit("key", "cpu")
+    assert not second.hit("key", "cpu")["allowed"]
+
+
+def test_rates_must_be_positive():
+    assert _parse_rate("30/60", (1, 1.0)) == (30, 0.5)
+    for bad in ("0/60", "30/0", "-5/60", "30/-1", "30", "x/y"):
+        assert _parse_rate(bad, (1, 1.0)) == (1, 1.0)
+
+
+def test_batch_cost_can_overdraw_the_bucket(tmp_path):
+    limiter = RateLimiter(str(tmp_path / "limits.sqlite3"), {"cpu": (2, 0.5)}, 100)
+    first = limiter.hit("key", "cpu", cost=5)
+    assert (
+        first["allowed"] and first["remaining"] == 0 and first["quota_remaining"] == 95
+    )
+    blocked = limiter.hit("key", "cpu")
+    assert not blocked["allowed"] and blocked["retry_after"] >= 7
+    assert not limiter.hit("other", "cpu", cost=101)["allowed"]
@@ -0,0 +1,26 @@
+import time
+
+import pytest
+
+from api.render_pool import RenderPool, RenderTimeout
+
+
+def test_timed_out_job_is_killed_and_pool_recovers():
+    pool = RenderPool(processes=1, queue_max=2, timeout=1)
+    try:
+        assert pool.run("test", pow, 2, 3) == 8
+        stuck = list(pool._executor._processes.values())
+
+        with pytest.raises(RenderTimeout):
+            pool.run("test", time.sleep, 60)
+        deadline = time.monotonic() + 5
+        while (
+            pool.pending or any(p.is_alive() for p in stuck)
+        ) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert pool.pending == 0
+        assert not any(p.is_alive() for p in stuck)
+
+        assert pool.run("test", pow, 3, 2) == 9
+    finally:
+        pool.shutdown()
@@ -0,0 +1,97 @@
+import pytest
+
+from api import webhook_schema
+from api.webhook_schema import SchemaError, validate_embed, validate_message
+
+
+def test_cleans_embed_like_before():
+    embed = validate_embed(
+        {
+            "title": "t",
+            "unknown": 1,
+            "author": {},
+            "fields": [
+                {"name": "n", "value": "v", "inline": 1},
+                {"name": "m", "value": "w"},
+            ],
+            "image": {"url": "https://example.com/a.png", "extra": True},
+        }
+    )
+    assert embed == {
+        "title": "t",
+        "fields": [
+            {"name": "n", "value": "v", "inline": True},
+            {"name": "m", "value": "w", "inline": False},
+        ],
+        "image": {"url": "https://example.com/a.png"},
+    }
+
+
+@pytest.mark.parametrize(
+    "message, error",
+    [
+        (
+            {"embeds": [{}, {"fields": [{"name": "n", "value": 3}]}]},
+            "'embeds[1].fields[0].value' must be a string.",
+        ),
+        (
+            {"embeds": [{"title": "x" * 257}]},
+            "'embeds[0].title' must be at most 256 characters.",
+        ),
+        ({"embeds": [{}] * 11}, "'embeds' must have at most 10 items."),
+        (
+            {"embeds": [{"fields": [{"name": "n", "value": "v"}] * 26}]},
+            "'embeds[0].fields' must have at most 25 items.",
+        ),
+        (
+            {"embeds": [{"fields": [{"value": "v"}]}]},
+            "'embeds[0].fields[0].name' is required.",
+        ),
+        ({"embeds": [{"color": True}]}, "'embeds[0].color' must be an integer."),
+        (
+            {"embeds": [{"description": "x" * 4000}, {"description": "x" * 2001}]},
+            "'embeds' must not exceed 6000 characters in total (got 6001).",
+        ),
+        ({"content": "x" * 2001}, "'content' must be at most 2000 characters."),
+    ],
+)
+def test_enforces_discord_limits_with_paths(message, error):
+    with pytest.raises(SchemaError) as exc:
+        validate_message(message)
+    assert str(exc.value) == error
+
+
+def test_path_prefix_names_the_message():
+    with pytest.raises(SchemaError) as exc:
+        validate_message({"embeds": [{"footer": {"text": 1}}]}, "messages[3]")
+    assert exc.value.path == "messages[3].embeds[0].footer.text"
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        {},
+        {"content": "hi", "username": "bot", "avatar_url": "a", "extra": 1},
+        {"embeds": []},
+        {
+            "embeds": [
+                {
+                    "title": "t",
+                    "color": 0,
+                    "author": {"name": "a"},
+                    "footer": {},
+                    "fields": [
+                        {"name": "n", "value": "v", "inline": "yes"},
+                        {"name": "m", "value": "w", "inline": 0},
+                    ],
+                    "thumbnail": {"url": "u", "height": 1},
+                },
+                {"description": "x" * 4000, "fields": []},
+            ]
+        },
+    ],
+)
+def test_compiled_validator_matches_the_walk(message):
+    compiled = webhook_schema._validate_message(message)
+    assert compiled == webhook_schema._validate(webhook_schema.MESSAGE, message, None)
+    assert validate_message(message) == compiled
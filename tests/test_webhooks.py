@@ -0,0 +1,72 @@
+import asyncio
+
+import api.app  # noqa: F401 (creates the tables)
+from api import db, upstream, webhooks
+from api.upstream import AsyncResponse
+
+
+def test_bucket_is_the_discord_webhook_id():
+    assert webhooks.bucket_for("https://discord.com/api/webhooks/123/abc") == "123"
+    assert (
+        webhooks.bucket_for("https://canary.discord.com/api/v10/webhooks/123/def")
+        == "123"
+    )
+    assert webhooks.bucket_for("https://example.com/hook") != webhooks.bucket_for(
+        "https://example.com/other"
+    )
+
+
+def test_rate_limit_delay_from_headers_and_429_body():
+    exhausted = AsyncResponse(
+        204,
+        {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset-After": "1.5"},
+        b"",
+        None,
+        "",
+    )
+    assert webhooks._rate_limit_delay(exhausted) == 1.5
+    limited = AsyncResponse(
+        429, {}, b'{"retry_after": 0.25, "global": false}', None, ""
+    )
+    assert webhooks._rate_limit_delay(limited) == 0.25
+    ok = AsyncResponse(204, {"X-RateLimit-Remaining": "4"}, b"", None, "")
+    assert webhooks._rate_limit_delay(ok) == 0.0
+
+
+def test_batch_held_past_the_reclaim_window_is_sent_once(monkeypatch):
+    monkeypatch.setattr(webhooks.dispatcher, "wake", lambda: None)
+    url = "https://discord.com/api/webhooks/999/reclaim-test"
+    ids = webhooks.enqueue(url, [{"content": "first"}, {"content": "second"}])
+
+    def claim():
+        # Only this test's rows: the database may hold others.
+        return [r for r in webhooks._claim(50) if r["webhook_url"] == url]
+
+    rows = claim()
+    assert [r["id"] for r in rows] == ids
+    # As if the batch had waited behind slow sends for longer than the window.
+    with db.get_pool().getconn() as conn:
+        conn.cursor().execute(
+            "UPDATE webhook_deliveries "
+            "SET claimed_at = NOW() - make_interval(secs => %s) WHERE id = ANY(%s)",
+            (webhooks.WEBHOOK_RECLAIM_SECONDS + 1, ids),
+        )
+        conn.commit()
+
+    sent = []
+    other = webhooks.Dispatcher()
+
+    async def fake_apost(name, url, json, **kwargs):
+        sent.append(json["content"])
+        if len(sent) == 1:
+            # Meanwhile another worker takes what still looks abandoned; the
+            # delivery being sent was renewed, so that is only the second one.
+            reclaimed = await asyncio.to_thread(claim)
+            assert [r["id"] for r in reclaimed] == ids[1:]
+            await other._deliver_bucket("999", reclaimed)
+        return AsyncResponse(204, {}, b"", None, "")
+
+    monkeypatch.setattr(upstream, "apost", fake_apost)
+    asyncio.run(webhooks.Dispatcher()._deliver_bucket("999", rows))
+    assert sent == ["first", "second"]
+    assert [d["status"] for d in webhooks.get_statuses(ids)] == ["delivered"] * 2
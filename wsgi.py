@@ -1,4 +1,4 @@
-from api import app
+from api.app import app
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080)